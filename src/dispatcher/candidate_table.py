@@ -0,0 +1,72 @@
+"""
+the table of candidate vehicle-trip pairs, which are scored and assigned by the dispatchers
+"""
+
+from src.simulator.request import Req, ReqRegistry
+from src.simulator.vehicle import Veh
+from src.simulator.route_functions import *
+
+
+class CandidateTable(object):
+    """
+    CandidateTable stores the candidate vehicle-trip pairs of an epoch column by column (a struct of arrays). Each pair
+    [veh, trip, sche, cost, score] indicates that the vehicle can serve the orders in the trip by following the schedule.
+    The pairs are added one by one through "add_pair", and the columns are converted to arrays by "build_arrays".
+    Attributes:
+        vehs: the vehicles, indexed by vehicle id
+        reqs: the requests, indexed by request id
+        veh_ids: vehicle id of each pair
+        trip_ptr: the trip of the i-th pair is given by trip_rids[trip_ptr[i]:trip_ptr[i+1]] (CSR encoding)
+        trip_rids: ids of the requests in all pairs' trips
+        sches: schedule of each pair
+        costs: cost of each pair, e.g. the travel time of its schedule
+        scores: score of each pair, of which the sum is maximized by the assignment
+    """
+
+    def __init__(self, vehs: list[Veh], reqs: ReqRegistry):
+        self.vehs = vehs
+        self.reqs = reqs
+        self.veh_ids = []
+        self.trip_ptr = [0]
+        self.trip_rids = []
+        self.sches = []
+        self.costs = []
+        self.scores = []
+
+    def add_pair(self, veh_id: int, trip_rids: list[int], sche: tuple[(int, int, int, float), ...], cost: float,
+                 score: float = 0.0):
+        self.veh_ids.append(veh_id)
+        self.trip_rids.extend(trip_rids)
+        self.trip_ptr.append(len(self.trip_rids))
+        self.sches.append(sche)
+        self.costs.append(cost)
+        self.scores.append(score)
+
+    def build_arrays(self):
+        self.veh_ids = np.array(self.veh_ids, dtype=np.int64)
+        self.trip_ptr = np.array(self.trip_ptr, dtype=np.int64)
+        self.trip_rids = np.array(self.trip_rids, dtype=np.int64)
+        self.costs = np.array(self.costs, dtype=np.float64)
+        self.scores = np.array(self.scores, dtype=np.float64)
+
+    def get_trip_sizes(self) -> np.ndarray:
+        return np.diff(self.trip_ptr)
+
+    # (The index of the pair that each entry of trip_rids belongs to.)
+    def get_pair_idxs_of_trip_rids(self) -> np.ndarray:
+        return np.repeat(np.arange(len(self.veh_ids)), self.get_trip_sizes())
+
+    def get_trip_rids(self, idx: int) -> list[int]:
+        return self.trip_rids[self.trip_ptr[idx]:self.trip_ptr[idx + 1]].tolist()
+
+    # (A pair is given as the list [veh, trip, sche, cost, score], which is a copy of the values in the table.)
+    def __getitem__(self, idx: int) -> [Veh, list[Req], tuple[(int, int, int, float), ...], float, float]:
+        return [self.vehs[self.veh_ids[idx]], [self.reqs[rid] for rid in self.get_trip_rids(idx)], self.sches[idx],
+                float(self.costs[idx]), float(self.scores[idx])]
+
+    def __iter__(self):
+        for idx in range(len(self.veh_ids)):
+            yield self[idx]
+
+    def __len__(self) -> int:
+        return len(self.veh_ids)
@@ -3,38 +3,43 @@ optimal batch assignment: computing the optimal schedule pool and then assign th
 """
 
 from src.dispatcher.ilp_assign import *
-from itertools import permutations
+import multiprocessing
+import multiprocessing.pool
 
 FEASIBLE_TRIP_TABLE = [[[] for i in range(VEH_CAPACITY[0] + 4)] for j in range(FLEET_SIZE[0])]
 PREV_FEASIBLE_TRIP_TABLE = [[]]
+# Whether the trip table of each vehicle holds all its feasible trips, i.e. the search has not been stopped by the
+# budget and the vehicle is not rebalancing (its basic schedule only includes the drop-offs of the onboard orders).
+# Only such a table can be carried forward to the next epoch by fast_compute.
+FEASIBLE_TRIP_TABLE_IS_COMPLETE = [False] * FLEET_SIZE[0]
+PREV_FEASIBLE_TRIP_TABLE_IS_COMPLETE = [False] * FLEET_SIZE[0]
 
 
-def assign_orders_through_osp(new_received_rids: list[int], reqs: list[Req], vehs: list[Veh], system_time_sec: int,
+def assign_orders_through_osp(new_received_rids: list[int], reqs: ReqRegistry, vehs: list[Veh], system_time_sec: int,
                               value_func: ValueFunction, is_reoptimization: bool = True):
     t = timer_start()
     # Some general settings.
     #        Always turned on. Only turned off to show that without re-optimization (re-assigning picking orders),
     #        multi-to-one match only outperforms a little than one-to-one match.
     enable_reoptimization = is_reoptimization
-    #        A cutoff is set to avoid some potential bugs making the algorithm spends too much time on some dead loop.
-    #        30 s is considered as a sufficient large value. If this cutoff time is set too small, it may happens that
-    #        there are not enough feasible vehicle_trip_pairs found to support ensure_assigning_orders_that_are_picking.
-    cutoff_time_for_a_size_k_trip_search_per_veh_sec = 0.1
+    #        The search of trips of size k >= 2 of each vehicle is limited by a budget of insertion evaluations, rather
+    #        than by the running time, so that the results do not depend on the machine (load). If the budget is set
+    #        too small, the trips found may be too few to get a good assignment.
+    trip_search_budget_per_veh = min(OSP_TRIP_SEARCH_BUDGET_PER_VEH,
+                                     OSP_TRIP_SEARCH_BUDGET_PER_EPOCH // max(1, len(vehs)))
     #        Orders that have been assigned vehicles are guaranteed to be served to ensure a good user experience.
     #        The objective of assignment could be further improved if this guarantee is abandoned.
     ensure_ilp_assigning_reqs_that_are_picking = True
-    #        Fast_compute only computes combinations between the new requests and the previous ones, rather than
-    #        between all known unpicked-up requests, to make the algorithm more efficient. But some bugs exist now
-    #        and makes the results a little bit worse when enabling fast_compute.
-    enable_fast_compute = False
+    #        Fast_compute carries each vehicle's trips of the last epoch forward and only searches the combinations
+    #        including the new requests, rather than all combinations of the known unpicked-up requests, to make the
+    #        algorithm more efficient. The trip table of a vehicle is only carried forward if it is complete (see
+    #        FEASIBLE_TRIP_TABLE_IS_COMPLETE), and the vehicle is searched from scratch otherwise.
+    enable_fast_compute = True
 
     # 1. Get the list of considered orders, normally including all picking and pending orders.
     #    If re-assigning picking orders to different vehicles is not enabled, only new_received_orders are considered.
-    considered_rids = []
     if enable_reoptimization:
-        for req in reqs:
-            if req.status == OrderStatus.PICKING or req.status == OrderStatus.PENDING:
-                considered_rids.append(req.id)
+        considered_rids = reqs.get_rids_of_status(OrderStatus.PICKING, OrderStatus.PENDING)
     else:
         considered_rids = new_received_rids
 
@@ -47,8 +52,7 @@ def assign_orders_through_osp(new_received_rids: list[int], reqs: list[Req], veh
         enable_fast_compute = False
     candidate_veh_trip_pairs = \
         compute_candidate_veh_trip_pairs(new_received_rids, considered_rids, reqs, vehs, system_time_sec,
-                                         cutoff_time_for_a_size_k_trip_search_per_veh_sec,
-                                         enable_reoptimization, enable_fast_compute)
+                                         trip_search_budget_per_veh, enable_reoptimization, enable_fast_compute)
 
     # 3. Score the candidate vehicle_trip_pairs.
     if not ENABLE_VALUE_FUNCTION:
@@ -93,55 +97,239 @@ def assign_orders_through_osp(new_received_rids: list[int], reqs: list[Req], veh
 
 def compute_candidate_veh_trip_pairs(new_received_rids: list[int], considered_rids: list[int],
                                      reqs: list[Req], vehs: list[Veh], system_time_sec: int,
-                                     cutoff_time_for_a_size_k_trip_search_per_veh_sec: int,
-                                     enable_reoptimization: bool, enable_fast_compute: bool) \
-        -> list[[Veh, list[Req], list[(int, int, int, float)], float, float]]:
+                                     trip_search_budget_per_veh: int,
+                                     enable_reoptimization: bool, enable_fast_compute: bool) -> CandidateTable:
     t = timer_start()
     if DEBUG_PRINT:
         print("                *Computing feasible vehicle trip pairs...", end=" ")
 
     initialize_feasible_trip_table(enable_fast_compute)
 
-    # Each veh_req_pair = [veh, trip, sche, cost, score]
-    candidate_veh_trip_pairs = []
-    for veh in vehs:
-        basic_candidate_vt_pair = \
-            build_feasible_trip_table_for_one_veh(new_received_rids, considered_rids, reqs, veh, system_time_sec,
-                                                  cutoff_time_for_a_size_k_trip_search_per_veh_sec,
-                                                  enable_reoptimization, enable_fast_compute)
+    # Decide for each vehicle whether its trip table of the last epoch is carried forward. (If fast_compute is enabled.)
+    fast_compute_flags_of_vehs = [enable_fast_compute and PREV_FEASIBLE_TRIP_TABLE_IS_COMPLETE[veh.id]
+                                  and veh.status != VehicleStatus.REBALANCING for veh in vehs]
+
+    # Get the orders each vehicle can reach before their latest pickup times, through the reachability index.
+    # (Only new received orders are searched to generate new trips for the vehicles having their tables carried
+    #  forward, since the trips of the previous orders are updated from the previous table.)
+    veh_idxs, req_idxs = compute_pickup_feasible_veh_req_pairs(vehs, considered_rids, reqs, system_time_sec)
+    reachable_rids_of_vehs = np.array(considered_rids, dtype=np.int64)[req_idxs]
+    if any(fast_compute_flags_of_vehs):
+        is_pair_searched = ~np.array(fast_compute_flags_of_vehs, dtype=bool)[veh_idxs] \
+                           | np.isin(reachable_rids_of_vehs, np.array(new_received_rids, dtype=np.int64))
+        veh_idxs = veh_idxs[is_pair_searched]
+        reachable_rids_of_vehs = reachable_rids_of_vehs[is_pair_searched]
+    reachable_ptr = np.searchsorted(veh_idxs, np.arange(len(vehs) + 1), side="left")
+
+    # Search the feasible trips of each vehicle, by the worker processes if there are any.
+    if DISPATCH_NUM_OF_WORKERS > 1:
+        trip_search_results = \
+            build_feasible_trip_tables_for_vehs_in_parallel(new_received_rids, considered_rids, reachable_rids_of_vehs,
+                                                            reachable_ptr, reqs, vehs, system_time_sec,
+                                                            trip_search_budget_per_veh,
+                                                            enable_reoptimization, fast_compute_flags_of_vehs)
+    else:
+        trip_search_results = []
+        for i, veh in enumerate(vehs):
+            reachable_rids = reachable_rids_of_vehs[reachable_ptr[i]:reachable_ptr[i + 1]].tolist()
+            trip_search_results.append(
+                build_feasible_trip_table_for_one_veh(new_received_rids, considered_rids, reachable_rids, reqs, veh,
+                                                      system_time_sec, trip_search_budget_per_veh,
+                                                      enable_reoptimization, fast_compute_flags_of_vehs[i]))
+    for veh, [_, _, is_budget_exhausted] in zip(vehs, trip_search_results):
+        FEASIBLE_TRIP_TABLE_IS_COMPLETE[veh.id] = not is_budget_exhausted and veh.status != VehicleStatus.REBALANCING
+    num_of_budget_hits = sum(is_budget_exhausted for [_, _, is_budget_exhausted] in trip_search_results)
+    TRIP_SEARCH_STATS["num_of_searches"] += len(vehs)
+    TRIP_SEARCH_STATS["num_of_budget_hits"] += num_of_budget_hits
+    TRIP_SEARCH_STATS["num_of_insertion_evaluations"] += \
+        sum(num_of_insertion_evaluations for [_, num_of_insertion_evaluations, _] in trip_search_results)
+
+    # Each vt_pair = [veh, trip, sche, cost, score] is stored as a row of the table.
+    candidate_veh_trip_pairs = CandidateTable(vehs, reqs)
+    for veh, [basic_candidate_vt_pair, _, _] in zip(vehs, trip_search_results):
         # 1. Add the basic schedule of the vehicle, which denotes the "empty assign" option in ILP.
-        candidate_veh_trip_pairs.append(basic_candidate_vt_pair)
+        [_, _, basic_sche, basic_cost, _] = basic_candidate_vt_pair
+        candidate_veh_trip_pairs.add_pair(veh.id, [], basic_sche, basic_cost)
         # 2. Add all searched candidate vehicle-trip pairs.
         for feasible_trips_size_k in FEASIBLE_TRIP_TABLE[veh.id]:
             for [trip, best_sche, cost, feasible_sches] in feasible_trips_size_k:
-                candidate_veh_trip_pairs.append([veh, trip, best_sche, cost, 0.0])
+                candidate_veh_trip_pairs.add_pair(veh.id, [req.id for req in trip], best_sche, cost)
 
         # 3. Add the current working schedule to double satisfy ensure_ilp_assigning_orders_that_are_picking.
         if enable_reoptimization:
-            trip = []
-            for rid in veh.picking_rids:
-                trip.append(reqs[rid])
-            trip.sort(key=lambda r: r.id)
-            candidate_veh_trip_pairs.append([veh, trip, copy.copy(veh.sche), compute_sche_cost(veh, veh.sche), 0.0])
+            candidate_veh_trip_pairs.add_pair(veh.id, sorted(veh.picking_rids), veh.sche,
+                                              compute_sche_cost(veh, veh.sche))
+    candidate_veh_trip_pairs.build_arrays()
 
     if DEBUG_PRINT:
-        print(f"({timer_end(t)})")
+        print(f"(budget hit by {num_of_budget_hits}/{len(vehs)} vehicles) ({timer_end(t)})")
     return candidate_veh_trip_pairs
 
 
+class VehSnapshot(object):
+    """
+    VehSnapshot is a copy of the part of a vehicle's state needed to search its feasible trips,
+    which is shipped to the worker processes
+    Attributes:
+        id: id of the vehicle
+        status: idle, working and rebalancing
+        nid: current nearest node id in network
+        t_to_nid: travel time from current location (when veh is on an edge) to the sink node in network
+        load: number of passengers on board
+        sche: (schedule) a tuple of pick-up and drop-off points
+        onboard_rids: ids of requests currently on board
+        new_picked_rids: ids of requests newly picked up in current interval
+        new_dropped_rids: ids of requests newly dropped off in current interval
+    """
+
+    def __init__(self, veh: Veh):
+        self.id = veh.id
+        self.status = veh.status
+        self.nid = veh.nid
+        self.t_to_nid = veh.t_to_nid
+        self.load = veh.load
+        self.sche = veh.sche
+        self.onboard_rids = veh.onboard_rids
+        self.new_picked_rids = veh.new_picked_rids
+        self.new_dropped_rids = veh.new_dropped_rids
+
+
+class ReqSnapshot(object):
+    """
+    ReqSnapshot is a copy of the parameters of a request needed to search feasible trips,
+    which is shipped to the worker processes
+    Attributes:
+        id: id of the request
+        onid: nearest origin node id in network
+        dnid: nearest destination node id in network
+        Clp: constraint - latest pickup
+        Cld: constraint - latest dropoff
+    """
+
+    __slots__ = ("id", "onid", "dnid", "Clp", "Cld")
+
+    def __init__(self, id: int, onid: int, dnid: int, Clp: float, Cld: float):
+        self.id = id
+        self.onid = onid
+        self.dnid = dnid
+        self.Clp = Clp
+        self.Cld = Cld
+
+
+# The statistics of the vehicles' trip searches over the whole simulation: the number of searches, the number of
+# searches stopped by the search budget, and the number of insertion evaluations spent.
+TRIP_SEARCH_STATS = {"num_of_searches": 0, "num_of_budget_hits": 0, "num_of_insertion_evaluations": 0}
+
+
+# The persistent pool of worker processes, which is created the first time it is used.
+DISPATCH_WORKER_POOL = None
+
+
+def get_dispatch_worker_pool() -> multiprocessing.pool.Pool:
+    global DISPATCH_WORKER_POOL
+    if DISPATCH_WORKER_POOL is None:
+        DISPATCH_WORKER_POOL = multiprocessing.Pool(DISPATCH_NUM_OF_WORKERS, initializer=initialize_dispatch_worker,
+                                                    initargs=(get_road_network(), VEH_CAPACITY[0]))
+    return DISPATCH_WORKER_POOL
+
+
+def initialize_dispatch_worker(road_network: RoadNetwork, veh_capacity: int):
+    set_road_network(road_network)
+    VEH_CAPACITY[0] = veh_capacity
+
+
+# Search the feasible trips of all vehicles in the worker processes, where each worker takes a contiguous chunk of
+# vehicles with the parameters of the orders they need. The results are merged in the order of the vehicles, so that
+# the trip table is the same as if the vehicles were searched one by one in the main process.
+def build_feasible_trip_tables_for_vehs_in_parallel(new_received_rids: list[int], considered_rids: list[int],
+                                                    reachable_rids_of_vehs: np.ndarray, reachable_ptr: np.ndarray,
+                                                    reqs: ReqRegistry, vehs: list[Veh], system_time_sec: int,
+                                                    trip_search_budget_per_veh: int,
+                                                    enable_reoptimization: bool,
+                                                    fast_compute_flags_of_vehs: list[bool]) \
+        -> list[([Veh, list[Req], tuple[(int, int, int, float), ...], float, float], int, bool)]:
+    # 1. Split the vehicles into chunks (a few per worker, to balance the load) and pack a task for each chunk.
+    #    (The previous trip table is only shipped for the vehicles having it carried forward by fast_compute.)
+    num_of_chunks = min(len(vehs), DISPATCH_NUM_OF_WORKERS * 4)
+    chunk_bounds = np.linspace(0, len(vehs), num_of_chunks + 1).astype(np.int64)
+    tasks = []
+    for chunk_start, chunk_end in zip(chunk_bounds[:-1].tolist(), chunk_bounds[1:].tolist()):
+        chunk_vehs = vehs[chunk_start:chunk_end]
+        fast_compute_flags = fast_compute_flags_of_vehs[chunk_start:chunk_end]
+        reachable_rids = [reachable_rids_of_vehs[reachable_ptr[i]:reachable_ptr[i + 1]].tolist()
+                          for i in range(chunk_start, chunk_end)]
+        needed_rids = set(reachable_rids_of_vehs[reachable_ptr[chunk_start]:reachable_ptr[chunk_end]].tolist())
+        prev_trip_tables = [[[[[r.id for r in trip], best_sche, cost, sches]
+                              for [trip, best_sche, cost, sches] in trips_size_k]
+                             for trips_size_k in PREV_FEASIBLE_TRIP_TABLE[veh.id]] if enable_fast_compute else None
+                            for veh, enable_fast_compute in zip(chunk_vehs, fast_compute_flags)]
+        needed_rids.update(rid for table in prev_trip_tables if table is not None for trips_size_k in table
+                           for [trip_rids, best_sche, cost, sches] in trips_size_k for rid in trip_rids)
+        needed_rids = np.array(sorted(needed_rids), dtype=np.int64)
+        req_params = (needed_rids, reqs.onid[needed_rids], reqs.dnid[needed_rids],
+                      reqs.Clp[needed_rids], reqs.Cld[needed_rids])
+        tasks.append(([VehSnapshot(veh) for veh in chunk_vehs], reachable_rids, req_params, prev_trip_tables,
+                      new_received_rids, considered_rids, system_time_sec,
+                      trip_search_budget_per_veh, enable_reoptimization, fast_compute_flags))
+
+    # 2. Search the chunks in the worker processes and merge their trip tables into the one of the main process.
+    trip_search_results = []
+    for chunk_results in get_dispatch_worker_pool().map(build_feasible_trip_tables_for_vehs_in_worker, tasks):
+        for basic_sche, basic_cost, trip_table, num_of_insertion_evaluations, is_budget_exhausted in chunk_results:
+            veh = vehs[len(trip_search_results)]
+            trip_search_results.append(([veh, [], basic_sche, basic_cost, 0.0],
+                                        num_of_insertion_evaluations, is_budget_exhausted))
+            FEASIBLE_TRIP_TABLE[veh.id] = [[[[reqs[rid] for rid in trip_rids], best_sche, cost, sches]
+                                            for [trip_rids, best_sche, cost, sches] in trips_size_k]
+                                           for trips_size_k in trip_table]
+    return trip_search_results
+
+
+# (This is run by a worker process, where the trip table only holds the vehicles of the task, keyed by vehicle id.
+#  Each vehicle's basic schedule, its cost, its trip table (with the trips given as request ids) and its search
+#  statistics are returned.)
+def build_feasible_trip_tables_for_vehs_in_worker(task) -> list[(list, float, list, int, bool)]:
+    global FEASIBLE_TRIP_TABLE, PREV_FEASIBLE_TRIP_TABLE
+    [veh_snapshots, reachable_rids_of_vehs, req_params, prev_trip_tables, new_received_rids, considered_rids,
+     system_time_sec, trip_search_budget_per_veh, enable_reoptimization, fast_compute_flags] \
+        = task
+    reqs = {rid: ReqSnapshot(rid, onid, dnid, Clp, Cld)
+            for rid, onid, dnid, Clp, Cld in zip(*[params.tolist() for params in req_params])}
+    FEASIBLE_TRIP_TABLE = {veh.id: [[] for i in range(VEH_CAPACITY[0] + 4)] for veh in veh_snapshots}
+    PREV_FEASIBLE_TRIP_TABLE = {veh.id: [[[[reqs[rid] for rid in trip_rids], best_sche, cost, sches]
+                                          for [trip_rids, best_sche, cost, sches] in trips_size_k]
+                                         for trips_size_k in table]
+                                for veh, table in zip(veh_snapshots, prev_trip_tables) if table is not None}
+
+    chunk_results = []
+    for veh, reachable_rids, enable_fast_compute in zip(veh_snapshots, reachable_rids_of_vehs, fast_compute_flags):
+        [[_, _, basic_sche, basic_cost, _], num_of_insertion_evaluations, is_budget_exhausted] = \
+            build_feasible_trip_table_for_one_veh(new_received_rids, considered_rids, reachable_rids, reqs, veh,
+                                                  system_time_sec, trip_search_budget_per_veh,
+                                                  enable_reoptimization, enable_fast_compute)
+        trip_table = [[[[r.id for r in trip], best_sche, cost, sches]
+                       for [trip, best_sche, cost, sches] in trips_size_k]
+                      for trips_size_k in FEASIBLE_TRIP_TABLE[veh.id]]
+        chunk_results.append((basic_sche, basic_cost, trip_table, num_of_insertion_evaluations, is_budget_exhausted))
+    return chunk_results
+
+
+# ("reachable_rids" are the searched orders that the vehicle can reach before their latest pickup times.
+#  Besides the basic candidate vt_pair, the number of insertion evaluations spent on the search and whether the search
+#  has been stopped by the budget are returned.)
 def build_feasible_trip_table_for_one_veh(new_received_rids: list[int], considered_rids: list[int],
-                                          reqs: list[Req], veh: Veh, system_time_sec: int,
-                                          cutoff_time_for_a_size_k_trip_search_per_veh_sec: int,
+                                          reachable_rids: list[int], reqs: list[Req], veh: Veh, system_time_sec: int,
+                                          trip_search_budget_per_veh: int,
                                           enable_reoptimization: bool, enable_fast_compute: bool) \
-        -> [Veh, list[Req], list[(int, int, int, float)], float, float]:
+        -> ([Veh, list[Req], tuple[(int, int, int, float), ...], float, float], int, bool):
+
+    search_start_num_of_insertion_evaluations = NUM_OF_INSERTION_EVALUATIONS[0]
 
-    # 0. Set the search list of requests and other parameters added for fast compute. (If fast_compute is enabled.)
-    search_rids = considered_rids
+    # 0. Set the parameters added for fast compute. (If fast_compute is enabled.)
     prev_rids_set = None
     n_prev_trips_of_size_k = 0
     if enable_fast_compute:
         prev_rids_set = set(considered_rids) - set(new_received_rids)
-        search_rids = new_received_rids
 
     # 1. Get the basic schedules of the vehicle.
     basic_sches = compute_basic_sches_of_one_veh(veh, system_time_sec, enable_reoptimization)
@@ -150,28 +338,31 @@ def build_feasible_trip_table_for_one_veh(new_received_rids: list[int], consider
     # 2. Compute trips of size 1.
     #      Update previous trips. (If fast_compute is enabled.)
     if enable_fast_compute:
-        upd_prev_feasible_trip_table_to_generate_size_k_trips_for_one_veh(prev_rids_set, veh, 1, T)
+        upd_prev_feasible_trip_table_to_generate_size_k_trips_for_one_veh(prev_rids_set, veh, 1, system_time_sec)
         n_prev_trips_of_size_k = len(FEASIBLE_TRIP_TABLE[veh.id][0])  # k = 1
     #      Add new trips.
     veh_params = [veh.nid, veh.t_to_nid, veh.load]
-    for rid in search_rids:
+    for rid in reachable_rids:
         req = reqs[rid]
         req_params = [req.id, req.onid, req.dnid, req.Clp, req.Cld]
-        if get_duration_from_origin_to_dest(veh.nid, req.onid) + veh.t_to_nid + system_time_sec > req.Clp:
-            continue
         best_sche, cost, feasible_sches = compute_schedule(veh_params, basic_sches, req_params, system_time_sec)
         if best_sche:
             FEASIBLE_TRIP_TABLE[veh.id][0].append([[req], best_sche, cost, feasible_sches])
 
-    # 3. Compute trips of size k (k >= 2).
+    # 3. Compute trips of size k (k >= 2), until all of them are found or the search budget is used up.
+    #    A trip is keyed by the tuple of its request ids in ascending order. A trip of size k is searched only if all
+    #    its sub-trips of size k-1 are feasible, so it is generated once, by joining its two sub-trips that share the
+    #    k-2 smaller ids (the "prefix"). The trips of size k-1 are therefore grouped by prefix and only joined within
+    #    their groups, and the other sub-trips are looked up in a hash set. The most promising trips, of which the two
+    #    joined sub-trips have the lowest total cost, are searched first.
+    size_k_search_start_num_of_insertion_evaluations = NUM_OF_INSERTION_EVALUATIONS[0]
+    is_budget_exhausted = False
     feasible_trips_of_size_k_minus_1 = FEASIBLE_TRIP_TABLE[veh.id][0]
-    while len(feasible_trips_of_size_k_minus_1) != 0:
-        search_start_time_datetime = get_time_stamp_datetime()
-        n_all_trips_of_size_k_minus_1 = len(feasible_trips_of_size_k_minus_1)
+    while len(feasible_trips_of_size_k_minus_1) != 0 and not is_budget_exhausted:
         k = len(feasible_trips_of_size_k_minus_1[0][0]) + 1
-        searched_trip_ids_of_size_k = []
         feasible_trip_ids_of_size_k_minus_1 = \
-            [[r.id for r in trip_info[0]] for trip_info in feasible_trips_of_size_k_minus_1]
+            [tuple(r.id for r in trip_info[0]) for trip_info in feasible_trips_of_size_k_minus_1]
+        feasible_trip_ids_set_of_size_k_minus_1 = set(feasible_trip_ids_of_size_k_minus_1)
         #      Update previous trips. (If fast_compute is enabled.)
         if enable_fast_compute:
             n_prev_trips_of_size_k_minus_1 = n_prev_trips_of_size_k
@@ -179,103 +370,98 @@ def build_feasible_trip_table_for_one_veh(new_received_rids: list[int], consider
             n_prev_trips_of_size_k = len(FEASIBLE_TRIP_TABLE[veh.id][k - 1])
         else:
             n_prev_trips_of_size_k_minus_1 = 0
-        #       Add new trips
-        for i in range(0, n_all_trips_of_size_k_minus_1 - 1):
-            trip1 = feasible_trips_of_size_k_minus_1[i][0]
-            for j in range(max(i + 1, n_prev_trips_of_size_k_minus_1), n_all_trips_of_size_k_minus_1):
-                trip2 = feasible_trips_of_size_k_minus_1[j][0]
-                new_trip_k = sorted(set(trip1).union(set(trip2)), key=lambda r: r.id)
-                if k > 2:
-                    new_trip_k_ids = [r.id for r in new_trip_k]
-                    # Check if the new trip size is not k.
-                    if len(new_trip_k_ids) != k:
-                        continue
-                    # Check if the trip has been already computed.
-                    if new_trip_k_ids in searched_trip_ids_of_size_k:
+        #      Group the trips of size k-1 by prefix.
+        trip_indices_of_prefix = {}
+        for idx, trip_ids in enumerate(feasible_trip_ids_of_size_k_minus_1):
+            trip_indices_of_prefix.setdefault(trip_ids[:-1], []).append(idx)
+        #      Get the new trips to search, each as (priority, trip ids, index of trip1, index of trip2).
+        size_k_trips_to_search = []
+        for trip_indices in trip_indices_of_prefix.values():
+            trip_indices.sort(key=lambda idx: feasible_trip_ids_of_size_k_minus_1[idx][-1])
+            for a in range(len(trip_indices) - 1):
+                i = trip_indices[a]
+                for b in range(a + 1, len(trip_indices)):
+                    j = trip_indices[b]
+                    # Both trips are previous ones, whose combinations have been updated from the previous table.
+                    if i < n_prev_trips_of_size_k_minus_1 and j < n_prev_trips_of_size_k_minus_1:
                         continue
-                    # Check if any sub-trip is not feasible.
+                    new_trip_k_ids = \
+                        feasible_trip_ids_of_size_k_minus_1[i] + feasible_trip_ids_of_size_k_minus_1[j][-1:]
+                    # Check if any sub-trip is not feasible. (The sub-trips without the last two ids are trip1, trip2.)
                     flag_at_least_one_subtrip_is_not_feasible = False
-                    for idx in range(k):
-                        sub_trip_ids = copy.copy(new_trip_k_ids)
-                        sub_trip_ids.pop(idx)
-                        assert (len(sub_trip_ids) == k - 1)
-                        if sub_trip_ids not in feasible_trip_ids_of_size_k_minus_1:
+                    for idx in range(k - 2):
+                        if new_trip_k_ids[:idx] + new_trip_k_ids[idx + 1:] \
+                                not in feasible_trip_ids_set_of_size_k_minus_1:
                             flag_at_least_one_subtrip_is_not_feasible = True
                             break
                     if flag_at_least_one_subtrip_is_not_feasible:
                         continue
-                    searched_trip_ids_of_size_k.append(new_trip_k_ids)
-                # The schedules of the new trip is computed as inserting an order into vehicle's schedules of serving
-                # trip1. This inserted order is included in trip2 and not included in trip1.
-                sub_sches = feasible_trips_of_size_k_minus_1[i][3]
-                insertion_reqs = list(set(new_trip_k) - set(trip1))
-                assert (len(insertion_reqs) == 1)
-                insert_req = insertion_reqs[0]
-                insert_req_params = [insert_req.id, insert_req.onid, insert_req.dnid, insert_req.Clp, insert_req.Cld]
-                best_sche_k, cost, feasible_sches_k = compute_schedule(veh_params, sub_sches, insert_req_params,
-                                                                       system_time_sec)
-                if best_sche_k:
-                    FEASIBLE_TRIP_TABLE[veh.id][k - 1].append([new_trip_k, best_sche_k, cost, feasible_sches_k])
-                if get_runtime_sec_from_t_to_now(search_start_time_datetime) \
-                        > cutoff_time_for_a_size_k_trip_search_per_veh_sec / 10:
-                    break
-            if get_runtime_sec_from_t_to_now(search_start_time_datetime) \
-                    > cutoff_time_for_a_size_k_trip_search_per_veh_sec:
+                    priority = feasible_trips_of_size_k_minus_1[i][2] + feasible_trips_of_size_k_minus_1[j][2]
+                    size_k_trips_to_search.append((priority, new_trip_k_ids, i, j))
+        size_k_trips_to_search.sort()
+        #      Add new trips
+        for (priority, new_trip_k_ids, i, j) in size_k_trips_to_search:
+            if NUM_OF_INSERTION_EVALUATIONS[0] - size_k_search_start_num_of_insertion_evaluations \
+                    >= trip_search_budget_per_veh:
+                is_budget_exhausted = True
                 break
+            # The schedules of the new trip is computed as inserting an order into vehicle's schedules of serving
+            # trip1. This inserted order is the last one of trip2, which is not included in trip1.
+            sub_sches = feasible_trips_of_size_k_minus_1[i][3]
+            insert_req = feasible_trips_of_size_k_minus_1[j][0][-1]
+            new_trip_k = feasible_trips_of_size_k_minus_1[i][0] + [insert_req]
+            insert_req_params = [insert_req.id, insert_req.onid, insert_req.dnid, insert_req.Clp, insert_req.Cld]
+            best_sche_k, cost, feasible_sches_k = compute_schedule(veh_params, sub_sches, insert_req_params,
+                                                                   system_time_sec)
+            if best_sche_k:
+                FEASIBLE_TRIP_TABLE[veh.id][k - 1].append([new_trip_k, best_sche_k, cost, feasible_sches_k])
 
         feasible_trips_of_size_k_minus_1 = FEASIBLE_TRIP_TABLE[veh.id][k - 1]
 
-    return basic_candidate_vt_pair
+    num_of_insertion_evaluations = NUM_OF_INSERTION_EVALUATIONS[0] - search_start_num_of_insertion_evaluations
+    return basic_candidate_vt_pair, num_of_insertion_evaluations, is_budget_exhausted
 
 
-# find out which trips from the last interval can be considered feasible size k trips in the current interval
+# Find out which trips of the last epoch are still feasible trips of size k in the current epoch, and add them to the
+# trip table. A trip of size k+n of the last epoch is updated to a trip of size k, if it includes all n orders picked up
+# by the vehicle since then and its other orders are still waiting to be picked up (neither new received nor picked up
+# by other vehicles or walked away). Its schedules starting with the pickups and drop-offs executed since then are
+# kept, with these executed stops removed, and are re-validated against the current state of the vehicle.
 def upd_prev_feasible_trip_table_to_generate_size_k_trips_for_one_veh(prev_rids_set: set[int],
                                                                       veh: Veh, k: int, system_time_sec: int):
     new_pick_rids_set = set(veh.new_picked_rids)
-    new_drop_rids_set = set(veh.new_dropped_rids)
-    new_both_rids_set = new_pick_rids_set.union(new_drop_rids_set)
-    n_new_pick = len(new_pick_rids_set)
-    n_new_drop = len(new_drop_rids_set)
+    # (The executed stops are given as (rid, pod), since an order can be both picked up and dropped off since then.)
+    new_both_stops_set = {(rid, 1) for rid in veh.new_picked_rids}.union((rid, -1) for rid in veh.new_dropped_rids)
+    n_new_pick = len(veh.new_picked_rids)
+    n_new_drop = len(veh.new_dropped_rids)
     n_new_both = n_new_pick + n_new_drop
 
     veh_params = [veh.nid, veh.t_to_nid, veh.load]
     k_prev_table = k + n_new_pick
-    if not PREV_FEASIBLE_TRIP_TABLE[veh.id][k - 1]:
+    if k_prev_table > len(PREV_FEASIBLE_TRIP_TABLE[veh.id]) or not PREV_FEASIBLE_TRIP_TABLE[veh.id][k_prev_table - 1]:
         return
 
-    if n_new_pick == 0:
-        trip_ids_sub_set = set()
-        trip_ids_sup_set = prev_rids_set
-    else:
-        trip_ids_sub_set = new_pick_rids_set
-        trip_ids_sup_set = prev_rids_set.union(new_pick_rids_set)
+    trip_ids_sub_set = new_pick_rids_set
+    trip_ids_sup_set = prev_rids_set.union(new_pick_rids_set)
 
     for [prev_trip, prev_best_sche, prev_cost, prev_all_sches] in PREV_FEASIBLE_TRIP_TABLE[veh.id][k_prev_table - 1]:
-        if not trip_ids_sub_set < {r.id for r in prev_trip} <= trip_ids_sup_set :
+        if not trip_ids_sub_set < {r.id for r in prev_trip} <= trip_ids_sup_set:
             continue
         best_sche_k = None
         min_cost_k = np.inf
         feasible_sches_k = []
-        if n_new_pick != 0:
-            # remove picked req in trip
-            trip_k = copy.copy(prev_trip)
-            for req in prev_trip:
-                if req.id in new_pick_rids_set:
-                    trip_k.remove(req)
-        else:
-            trip_k = prev_trip
+        # Remove the picked orders from the trip.
+        trip_k = [req for req in prev_trip if req.id not in new_pick_rids_set]
         for sche in prev_all_sches:
             if n_new_both != 0:
-                if {sche[i][0] for i in range(n_new_both)} != new_both_rids_set:
+                if {(sche[i][0], sche[i][1]) for i in range(n_new_both)} != new_both_stops_set:
                     continue
-                else:
-                    assert sum([sche[i][1] for i in range(n_new_both)]) == n_new_pick - 1 * n_new_drop
-                    del sche[0:n_new_both]
+                sche = sche[n_new_both:]
             flag, c, viol = test_constraints_get_cost(veh_params, sche, 0, 0, 0, system_time_sec)
             if flag:
                 feasible_sches_k.append(sche)
                 if c < min_cost_k:
-                    best_sche_k = copy.copy(sche)
+                    best_sche_k = sche
                     min_cost_k = c
         if best_sche_k:
             trip_k_ids_set = {r.id for r in trip_k}
@@ -287,41 +473,74 @@ def upd_prev_feasible_trip_table_to_generate_size_k_trips_for_one_veh(prev_rids_
 
 def initialize_feasible_trip_table(enable_fast_compute: bool):
     global FEASIBLE_TRIP_TABLE, PREV_FEASIBLE_TRIP_TABLE
+    global FEASIBLE_TRIP_TABLE_IS_COMPLETE, PREV_FEASIBLE_TRIP_TABLE_IS_COMPLETE
     if enable_fast_compute:
         PREV_FEASIBLE_TRIP_TABLE = FEASIBLE_TRIP_TABLE
+        PREV_FEASIBLE_TRIP_TABLE_IS_COMPLETE = FEASIBLE_TRIP_TABLE_IS_COMPLETE
     FEASIBLE_TRIP_TABLE = [[[] for i in range(VEH_CAPACITY[0] + 4)] for j in range(FLEET_SIZE[0])]
+    FEASIBLE_TRIP_TABLE_IS_COMPLETE = [False] * FLEET_SIZE[0]
 
 
 def compute_basic_sches_of_one_veh(veh: Veh, system_time_sec: int,
-                                   enable_reoptimization: bool) -> list[list[(int, int, int, float)]]:
+                                   enable_reoptimization: bool) -> list[tuple[(int, int, int, float), ...]]:
     basic_sches = []
 
     # If the vehicle is rebalancing, just return its current full schedule to ensure its rebalancing task.
     # If the vehicle is idle, then the basic schedule is an empty schedule.
     if veh.status == VehicleStatus.REBALANCING or veh.status == VehicleStatus.IDLE or not enable_reoptimization:
-        basic_sches.append(copy.copy(veh.sche))
+        basic_sches.append(veh.sche)
         return basic_sches
 
     # If the vehicle is working, return the sub-schedule only including the drop-off tasks.
-    veh_params = [veh.nid, veh.t_to_nid, veh.load]
-    basic_sche = []
-    for leg in veh.route:
-        if leg.rid in veh.onboard_rids:
-            basic_sche.append((leg.rid, leg.pod, leg.tnid, leg.ddl))
+    basic_sche = tuple((rid, pod, tnid, ddl) for (rid, pod, tnid, ddl) in veh.sche if rid in veh.onboard_rids)
     assert (len(basic_sche) == veh.load)
     basic_sches.append(basic_sche)
 
-    # Consider permutations of basic_schedule to make sure we search all possible schedules later.
-    for sche in permutations(basic_sche):
-        sche = list(sche)
+    # Consider the other feasible orders of basic_schedule to make sure we search all possible schedules later.
+    # (They are found in the same order as testing all permutations of basic_schedule.)
+    feasible_sches = []
+    search_feasible_orders_of_stops(veh.nid, veh.t_to_nid, basic_sche, [], (1 << len(basic_sche)) - 1,
+                                    system_time_sec, {}, feasible_sches)
+    for sche in feasible_sches:
         if sche != basic_sche:
-            flag, c, viol = test_constraints_get_cost(veh_params, sche, 0, 0, 0, system_time_sec)
-            if flag:
-                basic_sches.append(sche)
+            basic_sches.append(sche)
     assert (len(basic_sches) > 0)
     return basic_sches
 
 
+# Search the orders of the "stops" (the ones in "remaining_mask", after the ones in "prefix"), in which no stop is late,
+# and add them to "feasible_sches". It is a depth-first search in the order of itertools.permutations, which abandons a
+# prefix as soon as its last stop is late. If no feasible order is found for the remaining stops from a node at some
+# time, none will be found at any later time, so the earliest such time of each (node, remaining stops) is kept in
+# "late_times" to prune the search. (Return whether any feasible order has been found.)
+def search_feasible_orders_of_stops(nid: int, accumulated_time_sec: float, stops: tuple[(int, int, int, float), ...],
+                                    prefix: list[(int, int, int, float)], remaining_mask: int, system_time_sec: int,
+                                    late_times: dict[(int, int), float],
+                                    feasible_sches: list[tuple[(int, int, int, float), ...]]) -> bool:
+    if remaining_mask == 0:
+        feasible_sches.append(tuple(prefix))
+        return True
+    if accumulated_time_sec >= late_times.get((nid, remaining_mask), np.inf):
+        return False
+
+    is_any_order_found = False
+    for idx, (rid, pod, tnid, ddl) in enumerate(stops):
+        if not remaining_mask & (1 << idx):
+            continue
+        arrival_time_sec = accumulated_time_sec + get_duration_from_origin_to_dest(nid, tnid)
+        if system_time_sec + arrival_time_sec > ddl:
+            continue
+        prefix.append(stops[idx])
+        if search_feasible_orders_of_stops(tnid, arrival_time_sec, stops, prefix, remaining_mask & ~(1 << idx),
+                                           system_time_sec, late_times, feasible_sches):
+            is_any_order_found = True
+        prefix.pop()
+
+    if not is_any_order_found:
+        late_times[(nid, remaining_mask)] = accumulated_time_sec
+    return is_any_order_found
+
+
 def upd_sche_for_vehs_having_reqs_removed(vehs: list[Veh]):
     t = timer_start()
     if DEBUG_PRINT:
@@ -335,10 +554,8 @@ def upd_sche_for_vehs_having_reqs_removed(vehs: list[Veh]):
         for veh in vehs:
             if not veh.sche_has_been_updated_at_current_epoch and veh.status == VehicleStatus.WORKING \
                     and len(veh.sche) != veh.load:
-                basic_sche = []
-                for (rid, pod, tnid, ddl) in veh.sche:
-                    if rid in veh.onboard_rids:
-                        basic_sche.append((rid, pod, tnid, ddl))
+                basic_sche = tuple((rid, pod, tnid, ddl) for (rid, pod, tnid, ddl) in veh.sche
+                                   if rid in veh.onboard_rids)
                 veh.build_route(basic_sche)
                 veh.sche_has_been_updated_at_current_epoch = True
 
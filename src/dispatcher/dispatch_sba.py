@@ -21,7 +21,9 @@ def assign_orders_through_sba(new_received_rids: list[int], reqs: list[Req], veh
     #                                                                    system_time_sec)
 
     # 3. Compute the assignment policy, indicating which vehicle to pick which request.
-    selected_veh_req_pair_indices = ilp_assignment(candidate_veh_req_pairs, new_received_rids, reqs, vehs)
+    #    (Each vehicle takes at most one request, so the optimal assignment is found as a matching without the ILP.)
+    selected_veh_req_pair_indices = one_to_one_assignment(candidate_veh_req_pairs)
+    # selected_veh_req_pair_indices = ilp_assignment(candidate_veh_req_pairs, new_received_rids, reqs, vehs)
     # selected_veh_req_pair_indices = greedy_assignment(feasible_veh_req_pairs)
 
     # 000. Convert and store the vehicles' states at current epoch and their post-decision states as an experience.
@@ -42,31 +44,32 @@ def assign_orders_through_sba(new_received_rids: list[int], reqs: list[Req], veh
 
 
 def compute_candidate_veh_req_pairs(new_received_rids: list[int], reqs: list[Req], vehs: list[Veh],
-                                    system_time_sec: int) \
-        -> list[[Veh, list[Req], list[(int, int, int, float)], float, float]]:
+                                    system_time_sec: int) -> CandidateTable:
     t = timer_start()
     if DEBUG_PRINT:
         print("                *Computing candidate vehicle order pairs...", end=" ")
 
-    # Each veh_req_pair = [veh, trip, sche, cost, score]
-    candidate_veh_req_pairs = []
+    # Each veh_req_pair = [veh, trip, sche, cost, score] is stored as a row of the table.
+    candidate_veh_req_pairs = CandidateTable(vehs, reqs)
 
     # 1. Compute the feasible veh-req pairs for new received requests.
-    for rid in new_received_rids:
-        req = reqs[rid]
+    #    (Only the vehicles that can reach the request's origin in time are found, through the reachability index.)
+    veh_idxs, req_idxs = compute_pickup_feasible_veh_req_pairs(vehs, new_received_rids, reqs, system_time_sec)
+    order = np.lexsort((veh_idxs, req_idxs))
+    for i, j in zip(veh_idxs[order].tolist(), req_idxs[order].tolist()):
+        req = reqs[new_received_rids[j]]
         req_params = [req.id, req.onid, req.dnid, req.Clp, req.Cld]
-        for veh in vehs:
-            if get_duration_from_origin_to_dest(veh.nid, req.onid) + veh.t_to_nid + system_time_sec > req.Clp:
-                continue
-            veh_params = [veh.nid, veh.t_to_nid, veh.load]
-            sub_sche = veh.sche
-            best_sche, cost, feasible_sches = compute_schedule(veh_params, [sub_sche], req_params, system_time_sec)
-            if best_sche:
-                candidate_veh_req_pairs.append([veh, [req], best_sche, cost, 0.0])
+        veh = vehs[i]
+        veh_params = [veh.nid, veh.t_to_nid, veh.load]
+        sub_sche = veh.sche
+        best_sche, cost, feasible_sches = compute_schedule(veh_params, [sub_sche], req_params, system_time_sec)
+        if best_sche:
+            candidate_veh_req_pairs.add_pair(veh.id, [req.id], best_sche, cost)
 
     # 2. Add the basic schedule of each vehicle, which denotes the "empty assign" option in ILP.
     for veh in vehs:
-        candidate_veh_req_pairs.append([veh, [], copy.copy(veh.sche), compute_sche_cost(veh, veh.sche), 0.0])
+        candidate_veh_req_pairs.add_pair(veh.id, [], veh.sche, compute_sche_cost(veh, veh.sche))
+    candidate_veh_req_pairs.build_arrays()
 
     if DEBUG_PRINT:
         print(f"({timer_end(t)})")
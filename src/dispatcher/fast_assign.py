@@ -0,0 +1,126 @@
+"""
+compute an assignment plan from all possible matches without any MILP solver
+"""
+
+from src.dispatcher.candidate_table import *
+import scipy.sparse
+import scipy.sparse.csgraph
+
+
+# Select the pairs greedily from the one of the highest score, skipping those sharing a vehicle or a request with the
+# selected ones, in O(P log P) for P pairs. (The pairs given by preselected_pair_indices, which share no vehicle or
+# request, are selected first.)
+def greedy_assignment(veh_trip_pairs: CandidateTable, preselected_pair_indices: list[int] = None) -> list[int]:
+    t = timer_start()
+    if DEBUG_PRINT:
+        print(f"                *Greedy assignment with {len(veh_trip_pairs)} pairs...", end=" ")
+
+    selected_veh_trip_pair_indices = []
+    if len(veh_trip_pairs) == 0:
+        return selected_veh_trip_pair_indices
+
+    # (The masks are lists, which are faster than arrays to access by single elements.)
+    is_veh_selected = [False] * len(veh_trip_pairs.vehs)
+    is_req_selected = [False] * len(veh_trip_pairs.reqs)
+    veh_ids = veh_trip_pairs.veh_ids.tolist()
+    trip_ptr = veh_trip_pairs.trip_ptr.tolist()
+    trip_rids = veh_trip_pairs.trip_rids.tolist()
+    if preselected_pair_indices is not None:
+        for idx in preselected_pair_indices:
+            is_veh_selected[veh_ids[idx]] = True
+            for rid in trip_rids[trip_ptr[idx]:trip_ptr[idx + 1]]:
+                is_req_selected[rid] = True
+            selected_veh_trip_pair_indices.append(idx)
+
+    for idx in np.argsort(-veh_trip_pairs.scores, kind="stable").tolist():
+        # Check if the vehicle has been selected.
+        if is_veh_selected[veh_ids[idx]]:
+            continue
+        # Check if any request in the trip has been selected.
+        T_id = trip_rids[trip_ptr[idx]:trip_ptr[idx + 1]]
+        if any([is_req_selected[rid] for rid in T_id]):
+            continue
+        # The current vehicle_trip_pair is selected.
+        is_veh_selected[veh_ids[idx]] = True
+        for rid in T_id:
+            is_req_selected[rid] = True
+        selected_veh_trip_pair_indices.append(idx)
+
+    if DEBUG_PRINT:
+        print(f"({timer_end(t)})")
+
+    return selected_veh_trip_pair_indices
+
+
+# Compute the optimal assignment of the pairs where each vehicle takes at most one request (e.g. in SBA), as the
+# maximum weight matching between the requests and the vehicles, which gives the same objective as "ilp_assignment".
+# Each vehicle needs a pair of an empty trip (its basic schedule), which is selected if the vehicle gets no request.
+def one_to_one_assignment(veh_trip_pairs: CandidateTable) -> list[int]:
+    t = timer_start()
+    if DEBUG_PRINT:
+        print(f"                *One-to-one assignment with {len(veh_trip_pairs)} pairs...", end=" ")
+
+    selected_veh_trip_pair_indices = []
+    if len(veh_trip_pairs) == 0:
+        return selected_veh_trip_pair_indices
+    trip_sizes = veh_trip_pairs.get_trip_sizes()
+    assert (trip_sizes.max() <= 1 and "[ERROR] One-to-one assignment only takes the trips of at most one request!")
+
+    # 1. Get the pair of the empty trip of each vehicle.
+    num_of_vehs = len(veh_trip_pairs.vehs)
+    empty_trip_pair_idxs = np.flatnonzero(trip_sizes == 0)
+    vids, first_idxs = np.unique(veh_trip_pairs.veh_ids[empty_trip_pair_idxs], return_index=True)
+    assert (len(vids) == num_of_vehs and "[ERROR] Each vehicle needs a pair of the empty trip!")
+    empty_trip_pair_idx_of_vehs = empty_trip_pair_idxs[first_idxs]
+
+    # 2. Get the gain of each veh-req pair over the vehicle's empty trip, where only the positive ones are kept, and
+    #    the best one is kept if there are several pairs of the same vehicle and request.
+    pair_idxs = np.flatnonzero(trip_sizes == 1)
+    pair_vids = veh_trip_pairs.veh_ids[pair_idxs]
+    pair_rids = veh_trip_pairs.trip_rids[veh_trip_pairs.trip_ptr[pair_idxs]]
+    gains = veh_trip_pairs.scores[pair_idxs] - veh_trip_pairs.scores[empty_trip_pair_idx_of_vehs[pair_vids]]
+    is_gainful = gains > 0
+    [pair_idxs, pair_vids, pair_rids, gains] = [pair_idxs[is_gainful], pair_vids[is_gainful],
+                                                pair_rids[is_gainful], gains[is_gainful]]
+    order = np.lexsort((-gains, pair_vids, pair_rids))
+    [pair_idxs, pair_vids, pair_rids, gains] = [pair_idxs[order], pair_vids[order], pair_rids[order], gains[order]]
+    is_first = np.ones(len(pair_idxs), dtype=bool)
+    is_first[1:] = (pair_rids[1:] != pair_rids[:-1]) | (pair_vids[1:] != pair_vids[:-1])
+    [pair_idxs, pair_vids, pair_rids, gains] = [pair_idxs[is_first], pair_vids[is_first],
+                                                pair_rids[is_first], gains[is_first]]
+
+    # 3. Solve the maximum weight matching between the requests and the vehicles.
+    selected_pair_idx_of_vehs = empty_trip_pair_idx_of_vehs.copy()
+    rids, rows = np.unique(pair_rids, return_inverse=True)
+    match_vids, cols = np.unique(pair_vids, return_inverse=True)
+    matched_pair_idxs = pair_idxs[max_weight_bipartite_matching(rows, cols, gains, len(rids), len(match_vids))]
+    selected_pair_idx_of_vehs[veh_trip_pairs.veh_ids[matched_pair_idxs]] = matched_pair_idxs
+    selected_veh_trip_pair_indices = sorted(selected_pair_idx_of_vehs.tolist())
+
+    if DEBUG_PRINT:
+        print(f"({timer_end(t)})")
+
+    return selected_veh_trip_pair_indices
+
+
+# Compute the maximum weight matching of a bipartite graph, given by its edges (rows[k], cols[k]) of weights[k] > 0
+# between num_of_rows and num_of_cols nodes, where each edge appears once, and return the indices of the matched edges.
+# It is solved as a min weight full matching of the rows to the columns and a dummy column of each row (matching the
+# dummy one means leaving the row unmatched). (The weights are shifted to be positive, as zero entries are not edges
+# in the sparse biadjacency matrix.)
+def max_weight_bipartite_matching(rows: np.ndarray, cols: np.ndarray, weights: np.ndarray, num_of_rows: int,
+                                  num_of_cols: int) -> np.ndarray:
+    if len(weights) == 0:
+        return np.zeros(0, dtype=np.int64)
+    weight_shift = weights.max() + 1.0
+    biadjacency_matrix = scipy.sparse.csr_matrix(
+        (np.concatenate([weight_shift - weights, np.full(num_of_rows, weight_shift)]),
+         (np.concatenate([rows, np.arange(num_of_rows)]), np.concatenate([cols, num_of_cols + np.arange(num_of_rows)]))),
+        shape=(num_of_rows, num_of_cols + num_of_rows))
+    matched_rows, matched_cols = scipy.sparse.csgraph.min_weight_full_bipartite_matching(biadjacency_matrix)
+    is_edge_matched = matched_cols < num_of_cols
+    # (A matched edge is found by binary search in the edges sorted by rows and then columns.)
+    edge_order = np.lexsort((cols, rows))
+    edge_keys = rows[edge_order] * num_of_cols + cols[edge_order]
+    return edge_order[np.searchsorted(edge_keys, matched_rows[is_edge_matched] * num_of_cols
+                                      + matched_cols[is_edge_matched])]
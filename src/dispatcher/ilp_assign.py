@@ -3,13 +3,35 @@ compute an assignment plan from all possible matches
 """
 
 from src.dispatcher.scheduling import *
-import gurobipy as gp
-from gurobipy import GRB
+from src.dispatcher.fast_assign import *
+import abc
+from collections import deque
+import multiprocessing
+import multiprocessing.pool
+import scipy.sparse
+import scipy.sparse.csgraph
+# (The solvers are optional. The assignment ILP is solved by any of them that is installed, see ASSIGNMENT_BACKEND.)
+try:
+    import gurobipy as gp
+    from gurobipy import GRB
+except ImportError:
+    gp = None
+try:
+    import highspy
+except ImportError:
+    highspy = None
 
 
-def ilp_assignment(veh_trip_pairs: list[[Veh, list[Req], list[(int, int, int, float)], float, float]],
+# The report of each assignment, as a dict of the backend, the mode ("ILP" or "LP" for the LP relaxation plus
+# rounding), the problem size, the number of independent components of the model, the time spent on building and
+# solving the model (of which the initial solution takes start_time_sec), the objective value, its best bound and the
+# optimality gap between them.
+ASSIGNMENT_REPORTS = []
+
+
+def ilp_assignment(veh_trip_pairs: CandidateTable,
                    considered_rids: list[int],
-                   reqs: list[Req],
+                   reqs: ReqRegistry,
                    vehs: list[Veh],
                    ensure_assigning_orders_that_are_picking: bool = True) -> list[int]:
     t = timer_start()
@@ -20,111 +42,664 @@ def ilp_assignment(veh_trip_pairs: list[[Veh, list[Req], list[(int, int, int, fl
     if len(veh_trip_pairs) == 0:
         return selected_veh_trip_pair_indices
     # The order in which the vt-pairs are arranged can slightly affect the results. Reordering aims to eliminate it.
-    veh_trip_pairs.sort(key=lambda e: e[0].id)
-
-    try:
-        # 1. Create a new model
-        model = gp.Model("ilp")
-        model.setParam("LogToConsole", 0)
-        # model.setParam("Threads", 6)
-
-        # 2. Create variables
-        var_vt_pair = []  # var_vt_pair[i] = 1 indicates selecting the i_th vehicle_trip_pair.
-        for i in range(len(veh_trip_pairs)):
-            var_vt_pair.append(model.addVar(vtype=GRB.BINARY))
-        var_order = []  # var_order[j] = 0 indicates assigning the i_th order in the list.
-        for j in range(len(considered_rids)):
-            var_order.append(model.addVar(vtype=GRB.BINARY))
-
-        # 3. Set objective: maximize Σ var_vt_pair[i] * score(vt_pair).
-        obj_expr = 0.0
-        for i in range(len(veh_trip_pairs)):
-            obj_expr += var_vt_pair[i] * veh_trip_pairs[i][4]
-        model.setObjective(obj_expr, GRB.MAXIMIZE)
-
-        # 4. Add constraints.
-        #   (0) Get the pairs' indices for each vehicle and request
-        vt_idx = [[] for v in range(len(vehs))]
-        rt_idx = [[] for j in range(len(considered_rids))]
-        for idx, [veh, trip, sche, cost, score] in enumerate(veh_trip_pairs):
-            vt_idx[veh.id].append(idx)
-            for req in trip:
-                # DEBUG codes
-                if req.id not in considered_rids:
-                    print(f"[DEBUG2] req {req.id} {req.status}, "
-                          f"request time {req.Tr}, latest pickup {req.Clp}, pickup time {req.Tp}")
-                    print(f"veh {veh.id}, at {veh.state_time}s, onboard_rids {veh.onboard_rids}")
-                    print(f"sche {sche}")
-                    continue
-                rt_idx[considered_rids.index(req.id)].append(idx)
-        #   (1) Add constraint 1: each vehicle (v) can only be assigned at most one schedule (trip).
-        #     Σ var_vt_pair[i] * Θ_vt(v) = 1, ∀ v ∈ V (Θ_vt(v) = 1 if v is in vt).
-        for indices in vt_idx:
-            con_this_veh = 0.0
-            for i in indices:
-                con_this_veh += var_vt_pair[i]
-            model.addConstr(con_this_veh == 1)
-        #   (2) Add constraint 2: each order/request (r) can only be assigned to at most one vehicle.
-        #     Σ var_vt_pair[i] * Θ_vt(r) + var_order[j] = 1, ∀ r ∈ R. (Θ_vt(order) = 1 if r is in vt).
-        for j, indices in enumerate(rt_idx):
-            con_this_req = 0.0
-            for i in indices:
-                con_this_req += var_vt_pair[i]
-            con_this_req += var_order[j]
-            model.addConstr(con_this_req == 1)
-        #   (3) Add constraint 3: no currently picking order is ignored.
-        #     var_order[j] = 0, ∀ r ∈ R_picking
-        if ensure_assigning_orders_that_are_picking:
-            for j in range(len(considered_rids)):
-                if reqs[considered_rids[j]].status == OrderStatus.PICKING:
-                    model.addConstr(var_order[j] == 0)
-
-        # 5. Optimize model.
-        model.optimize()
-
-        # 6. Get the result.
-        for i, var_vt in enumerate(var_vt_pair):
-            if var_vt.getAttr(GRB.Attr.X) == 1:
-                selected_veh_trip_pair_indices.append(i)
-
-    except gp.GurobiError as e:
-        print(f"\n[GUROBI] Error code = {str(e.message)} ({str(e)}).")
-    except AttributeError:
-        print("Encountered an attribute error")
+    # (The i-th variable corresponds to the pair order[i] in the table.)
+    order = np.argsort(veh_trip_pairs.veh_ids, kind="stable")
+
+    # 1. Build the model in matrix form.
+    t_build = timer_start()
+    [obj_coefs, con_matrix, con_rhs, var_ubs] = \
+        build_assignment_ilp_in_matrix_form(veh_trip_pairs, order, considered_rids, reqs, vehs,
+                                            ensure_assigning_orders_that_are_picking)
+    build_time_sec = get_runtime_sec_from_t_to_now(t_build)
+
+    # 2. Get the initial solution (see "compute_initial_veh_trip_pair_indices"), which is used as the MIP start, and
+    #    as the result if the solver finds no solution (e.g. within the time limit). It counts towards the time limit.
+    #    (The LP relaxation takes no start, and its unsolved components are left to the rounding.)
+    t_solve = timer_start()
+    deadline = None
+    if ASSIGNMENT_TIME_LIMIT_SEC is not None:
+        deadline = t_solve + timedelta(seconds=ASSIGNMENT_TIME_LIMIT_SEC)
+    var_starts = np.zeros(len(obj_coefs))
+    if not ASSIGNMENT_LP_RELAXATION:
+        start_pair_indices = compute_initial_veh_trip_pair_indices(veh_trip_pairs, considered_rids, reqs, vehs,
+                                                                   ensure_assigning_orders_that_are_picking)
+        var_starts[rank_pairs(order)[start_pair_indices]] = 1.0
+        var_starts[len(order):] = 1.0 - con_matrix[len(vehs):, :len(order)] @ var_starts[:len(order)]
+    start_time_sec = get_runtime_sec_from_t_to_now(t_solve)
+
+    # 3. Solve the model (or its LP relaxation) by its independent components.
+    [var_values, bound, num_of_components] = \
+        solve_assignment_ilp_by_components(obj_coefs, con_matrix, con_rhs, var_ubs, var_starts, len(order), len(vehs),
+                                           ASSIGNMENT_LP_RELAXATION, deadline)
+    objective = float(obj_coefs @ var_values)
+
+    # 4. Get the result (as indices into the table).
+    if ASSIGNMENT_LP_RELAXATION:
+        pair_values = np.empty(len(order), dtype=np.float64)
+        pair_values[order] = var_values[:len(order)]
+        selected_veh_trip_pair_indices = \
+            round_lp_relaxed_assignment(veh_trip_pairs, pair_values, considered_rids, reqs, vehs,
+                                        ensure_assigning_orders_that_are_picking)
+        objective = float(veh_trip_pairs.scores[selected_veh_trip_pair_indices].sum())
+    else:
+        selected_veh_trip_pair_indices = order[var_values[:len(order)] > 0.5].tolist()
+    solve_time_sec = get_runtime_sec_from_t_to_now(t_solve)
+
+    # 5. Report the running time and the optimality gap.
+    gap = abs(bound - objective) / max(abs(objective), 1e-10)
+    ASSIGNMENT_REPORTS.append({"backend": get_assignment_backend_type().name,
+                               "mode": "LP" if ASSIGNMENT_LP_RELAXATION else "ILP",
+                               "num_of_pairs": len(order), "num_of_reqs": len(considered_rids),
+                               "num_of_components": num_of_components,
+                               "build_time_sec": build_time_sec, "start_time_sec": start_time_sec,
+                               "solve_time_sec": solve_time_sec,
+                               "objective": objective, "bound": bound, "gap": gap})
 
     if DEBUG_PRINT:
-        print(f"({timer_end(t)})")
+        print(f"({num_of_components} components, build {build_time_sec:.3f}s, solve {solve_time_sec:.3f}s "
+              f"(start {start_time_sec:.3f}s), "
+              f"gap {100.0 * gap:.2f}%) ({timer_end(t)})")
 
     return selected_veh_trip_pair_indices
 
 
-def greedy_assignment(veh_trip_pairs: list[[Veh, list[Req], list[(int, int, int, float)], float, float]]) -> list[int]:
-    t = timer_start()
-    if DEBUG_PRINT:
-        print(f"                *Greedy assignment with {len(veh_trip_pairs)} pairs...", end=" ")
+# Build the assignment ILP as
+#     max c·z, s.t. A z = b, 0 <= z <= ub, z binary,
+# where z = [var_vt_pair, var_order]:
+#     var_vt_pair[i] = 1 indicates selecting the pair order[i] in the table,
+#     var_order[j] = 0 indicates assigning the j_th order in considered_rids.
+# The rows of A are the constraints of the vehicles followed by those of the orders:
+#   (1) Constraint 1: each vehicle (v) can only be assigned at most one schedule (trip).
+#     Σ var_vt_pair[i] * Θ_vt(v) = 1, ∀ v ∈ V (Θ_vt(v) = 1 if v is in vt).
+#   (2) Constraint 2: each order/request (r) can only be assigned to at most one vehicle.
+#     Σ var_vt_pair[i] * Θ_vt(r) + var_order[j] = 1, ∀ r ∈ R. (Θ_vt(order) = 1 if r is in vt).
+#   (3) Constraint 3: no currently picking order is ignored, given by the upper bounds.
+#     var_order[j] = 0, ∀ r ∈ R_picking
+def build_assignment_ilp_in_matrix_form(veh_trip_pairs: CandidateTable, order: np.ndarray, considered_rids: list[int],
+                                        reqs: ReqRegistry, vehs: list[Veh],
+                                        ensure_assigning_orders_that_are_picking: bool) \
+        -> (np.ndarray, scipy.sparse.csr_matrix, np.ndarray, np.ndarray):
+    num_of_pairs = len(order)
+    num_of_reqs = len(considered_rids)
+    rank = rank_pairs(order)
 
-    selected_veh_trip_pair_indices = []
-    if len(veh_trip_pairs) == 0:
-        return selected_veh_trip_pair_indices
-    veh_trip_pairs.sort(key=lambda e: -e[4])
+    # 1. Get the objective coefficients: maximize Σ var_vt_pair[i] * score(vt_pair).
+    obj_coefs = np.concatenate([veh_trip_pairs.scores[order], np.zeros(num_of_reqs)])
+
+    # 2. Get the entries of the vehicles' rows and the orders' rows.
+    veh_rows = veh_trip_pairs.veh_ids[order]
+    veh_cols = np.arange(num_of_pairs)
+    req_idx_of_rids = np.full(len(reqs), -1, dtype=np.int64)
+    req_idx_of_rids[considered_rids] = np.arange(num_of_reqs)
+    req_idxs = req_idx_of_rids[veh_trip_pairs.trip_rids]
+    is_considered = req_idxs != -1
+    req_cols = rank[veh_trip_pairs.get_pair_idxs_of_trip_rids()]
+    # DEBUG codes
+    for k in np.flatnonzero(~is_considered).tolist():
+        req = reqs[int(veh_trip_pairs.trip_rids[k])]
+        idx = int(order[req_cols[k]])
+        veh = vehs[veh_trip_pairs.veh_ids[idx]]
+        print(f"[DEBUG2] req {req.id} {req.status}, "
+              f"request time {req.Tr}, latest pickup {req.Clp}, pickup time {req.Tp}")
+        print(f"veh {veh.id}, at {veh.state_time}s, onboard_rids {veh.onboard_rids}")
+        print(f"sche {veh_trip_pairs.sches[idx]}")
+    req_rows = len(vehs) + req_idxs[is_considered]
+    req_cols = req_cols[is_considered]
+
+    # 3. Get the constraint matrix, with the var_order of each order in its row.
+    rows = np.concatenate([veh_rows, req_rows, len(vehs) + np.arange(num_of_reqs)])
+    cols = np.concatenate([veh_cols, req_cols, num_of_pairs + np.arange(num_of_reqs)])
+    con_matrix = scipy.sparse.csr_matrix((np.ones(len(rows)), (rows, cols)),
+                                         shape=(len(vehs) + num_of_reqs, num_of_pairs + num_of_reqs))
+    con_rhs = np.ones(len(vehs) + num_of_reqs)
+
+    # 4. Get the upper bounds of the variables.
+    var_ubs = np.ones(num_of_pairs + num_of_reqs)
+    if ensure_assigning_orders_that_are_picking:
+        is_req_picking = reqs.status[np.array(considered_rids, dtype=np.int64)] == OrderStatus.PICKING.value
+        var_ubs[num_of_pairs:][is_req_picking] = 0.0
+
+    return obj_coefs, con_matrix, con_rhs, var_ubs
+
+
+# Solve the assignment ILP built by "build_assignment_ilp_in_matrix_form" by its connected components, i.e. the groups
+# of vehicles and orders sharing no candidate pair with other groups, which are independent of each other. A component
+# of a single vehicle is solved in closed form by selecting its best pair covering all orders that must be assigned
+# (of which var_order has an upper bound of 0). The other components are solved by the backend, in the worker
+# processes if ASSIGNMENT_NUM_OF_WORKERS > 1, each starting from its part of the initial solution, which is also used
+# for the components where no solution is found (e.g. when the deadline is reached).
+# Return [z, bound, num_of_components], where bound is the best bound of the objective. (The loose bound of each
+# component given by "compute_loose_bounds_of_components" is used if the backend proves no better one, e.g. when it
+# stops at the deadline before any bound is found, or finds no solution.)
+def solve_assignment_ilp_by_components(obj_coefs: np.ndarray, con_matrix: scipy.sparse.csr_matrix,
+                                       con_rhs: np.ndarray, var_ubs: np.ndarray, var_starts: np.ndarray,
+                                       num_of_pairs: int, num_of_vehs: int, is_lp_relaxation: bool,
+                                       deadline: datetime) -> (np.ndarray, float, int):
+    # 1. Label the rows and the columns (variables) of the model by its connected components, of the bipartite graph
+    #    where a row and a column are connected if the column has a nonzero entry in the row.
+    num_of_rows, num_of_cols = con_matrix.shape
+    graph = scipy.sparse.bmat([[None, con_matrix], [con_matrix.T, None]], format="csr")
+    num_of_components, labels = scipy.sparse.csgraph.connected_components(graph, directed=False)
+    row_labels = labels[:num_of_rows]
+    col_labels = labels[num_of_rows:]
+    num_of_vehs_of_components = np.bincount(row_labels[:num_of_vehs], minlength=num_of_components)
+    var_values = np.zeros(num_of_cols)
+    bound = 0.0
+    loose_bounds_of_components = compute_loose_bounds_of_components(obj_coefs, con_matrix, num_of_pairs, num_of_vehs,
+                                                                    row_labels, num_of_components)
+
+    # 2. Solve the components of a single vehicle in closed form.
+    is_order_must_assigned = var_ubs[num_of_pairs:] == 0.0
+    num_of_must_assigned_orders_of_components = \
+        np.bincount(row_labels[num_of_vehs:][is_order_must_assigned], minlength=num_of_components)
+    num_of_must_assigned_orders_of_pairs = \
+        con_matrix[num_of_vehs:, :num_of_pairs].T @ is_order_must_assigned.astype(np.float64)
+    pair_labels = col_labels[:num_of_pairs]
+    is_trivial_component = num_of_vehs_of_components == 1
+    is_feasible_trivial_pair = is_trivial_component[pair_labels] & (var_ubs[:num_of_pairs] > 0.0) \
+        & (num_of_must_assigned_orders_of_pairs == num_of_must_assigned_orders_of_components[pair_labels])
+    trivial_pair_cols = np.flatnonzero(is_feasible_trivial_pair)
+    trivial_pair_cols = trivial_pair_cols[np.lexsort((-obj_coefs[trivial_pair_cols], pair_labels[trivial_pair_cols]))]
+    solved_labels, first_idxs = np.unique(pair_labels[trivial_pair_cols], return_index=True)
+    var_values[trivial_pair_cols[first_idxs]] = 1.0
+    bound += float(obj_coefs[trivial_pair_cols[first_idxs]].sum())
+    # (A single vehicle component without any feasible pair takes its initial solution.)
+    is_start_used = is_trivial_component.copy()
+    is_start_used[solved_labels] = False
+
+    # 3. Solve the other components by the backend, where the rows and the columns of each component are made
+    #    contiguous by sorting them by the labels. (Larger components are solved first to balance the workers' load.)
+    row_order = np.argsort(row_labels, kind="stable")
+    col_order = np.argsort(col_labels, kind="stable")
+    row_ptr = np.searchsorted(row_labels[row_order], np.arange(num_of_components + 1))
+    col_ptr = np.searchsorted(col_labels[col_order], np.arange(num_of_components + 1))
+    sorted_con_matrix = con_matrix[row_order][:, col_order]
+    nontrivial_labels = np.flatnonzero(num_of_vehs_of_components >= 2)
+    nontrivial_labels = nontrivial_labels[np.argsort(-np.diff(col_ptr)[nontrivial_labels], kind="stable")].tolist()
+    tasks = []
+    for label in nontrivial_labels:
+        rows = row_order[row_ptr[label]:row_ptr[label + 1]]
+        cols = col_order[col_ptr[label]:col_ptr[label + 1]]
+        tasks.append((obj_coefs[cols],
+                      sorted_con_matrix[row_ptr[label]:row_ptr[label + 1], col_ptr[label]:col_ptr[label + 1]],
+                      con_rhs[rows], var_ubs[cols], is_lp_relaxation, var_starts[cols], deadline))
+    if ASSIGNMENT_NUM_OF_WORKERS > 1 and len(tasks) > 1:
+        solutions = get_assignment_worker_pool().map(solve_assignment_ilp_component, tasks, chunksize=1)
+    else:
+        solutions = [solve_assignment_ilp_component(task) for task in tasks]
+    for label, solution in zip(nontrivial_labels, solutions):
+        if solution is None:
+            is_start_used[label] = True
+            continue
+        [component_var_values, component_objective, component_bound] = solution
+        var_values[col_order[col_ptr[label]:col_ptr[label + 1]]] = component_var_values
+        bound += float(np.fmin(component_bound, loose_bounds_of_components[label]))
+
+    # 4. Use the initial solution for the unsolved components, of which the bound is the loose one.
+    if is_start_used.any():
+        print(f"\n[{get_assignment_backend_type().name}] No assignment is found for {int(is_start_used.sum())} "
+              f"components. The initial solution is used for them.")
+        is_start_used_col = is_start_used[col_labels]
+        var_values[is_start_used_col] = var_starts[is_start_used_col]
+        bound += float(loose_bounds_of_components[is_start_used].sum())
+
+    # 5. Get the values of var_order from those of var_vt_pair. (Each var_order[j] is in the (num_of_vehs + j)-th row.)
+    var_values[num_of_pairs:] = 1.0 - con_matrix[num_of_vehs:, :num_of_pairs] @ var_values[:num_of_pairs]
+
+    return var_values, bound, num_of_components
+
+
+# Compute a bound of the objective of each component, which is cheap but loose, from the dual of the LP relaxation:
+# any values y of the rows give the bound Σ y + Σ ub · max(0, c - A^T y). Two choices of y are taken, and the better
+# bound of each component is used: (1) y of each vehicle is its best pair score, and y of each order is 0, and (2) y of
+# each order is its best share of the scores of the pairs including it (i.e. a pair's score divided by its number of
+# orders), and y of each vehicle is its best pair score minus the orders' shares. Both make the max(...) terms 0.
+def compute_loose_bounds_of_components(obj_coefs: np.ndarray, con_matrix: scipy.sparse.csr_matrix, num_of_pairs: int,
+                                       num_of_vehs: int, row_labels: np.ndarray, num_of_components: int) -> np.ndarray:
+    pair_obj_coefs = obj_coefs[:num_of_pairs]
+    # (Each var_vt_pair has a single entry in the vehicles' rows.)
+    veh_of_pairs = con_matrix[:num_of_vehs, :num_of_pairs].tocsc().indices
+    order_matrix = con_matrix[num_of_vehs:, :num_of_pairs].tocsr()
+    num_of_orders_of_pairs = np.asarray(order_matrix.sum(axis=0)).ravel()
+
+    def get_best_of_vehs(values_of_pairs: np.ndarray) -> np.ndarray:
+        best_values = np.full(num_of_vehs, -np.inf)
+        np.maximum.at(best_values, veh_of_pairs, values_of_pairs)
+        best_values[~np.isfinite(best_values)] = 0.0
+        return best_values
+
+    # 1. Get the bounds of the first choice.
+    bounds_1 = np.bincount(row_labels[:num_of_vehs], weights=get_best_of_vehs(pair_obj_coefs),
+                           minlength=num_of_components)
+
+    # 2. Get the bounds of the second choice.
+    shares_of_pairs = pair_obj_coefs / np.maximum(num_of_orders_of_pairs, 1)
+    y_orders = np.zeros(order_matrix.shape[0])
+    np.maximum.at(y_orders, np.repeat(np.arange(order_matrix.shape[0]), np.diff(order_matrix.indptr)),
+                  shares_of_pairs[order_matrix.indices])
+    y_vehs = get_best_of_vehs(pair_obj_coefs - order_matrix.T @ y_orders)
+    bounds_2 = np.bincount(row_labels[:num_of_vehs], weights=y_vehs, minlength=num_of_components) \
+        + np.bincount(row_labels[num_of_vehs:], weights=y_orders, minlength=num_of_components)
+
+    return np.minimum(bounds_1, bounds_2)
+
+
+def solve_assignment_ilp_component(task: (np.ndarray, scipy.sparse.csr_matrix, np.ndarray, np.ndarray, bool,
+                                          np.ndarray, datetime)) -> [np.ndarray, float, float]:
+    [obj_coefs, con_matrix, con_rhs, var_ubs, is_lp_relaxation, var_starts, deadline] = task
+    if deadline is not None and datetime.now() >= deadline:
+        return None
+    return get_assignment_backend().solve(obj_coefs, con_matrix, con_rhs, var_ubs, is_lp_relaxation, var_starts,
+                                          deadline)
+
+
+# The persistent pool of worker processes solving the components, which is created the first time it is used.
+# (Each worker creates its own backend.)
+ASSIGNMENT_WORKER_POOL = None
+
+
+def get_assignment_worker_pool() -> multiprocessing.pool.Pool:
+    global ASSIGNMENT_WORKER_POOL
+    if ASSIGNMENT_WORKER_POOL is None:
+        ASSIGNMENT_WORKER_POOL = multiprocessing.Pool(ASSIGNMENT_NUM_OF_WORKERS)
+    return ASSIGNMENT_WORKER_POOL
+
+
+# (The variable of the i-th pair in the table is the rank[i]-th one, i.e. the inverse of "order".)
+def rank_pairs(order: np.ndarray) -> np.ndarray:
+    rank = np.empty(len(order), dtype=np.int64)
+    rank[order] = np.arange(len(order))
+    return rank
+
+
+# Get the pair of each vehicle where the vehicle keeps its current trip, i.e. the trip of the considered orders that
+# the vehicle is picking (e.g. the working schedule added in OSP, or the basic schedule if the vehicle is picking none
+# of the considered orders). The pair of the highest score is chosen if there are several ones. None is returned if
+# any vehicle has no such pair.
+def compute_incumbent_veh_trip_pair_indices(veh_trip_pairs: CandidateTable, considered_rids: list[int],
+                                            reqs: ReqRegistry, vehs: list[Veh]) -> np.ndarray:
+    is_considered = np.zeros(len(reqs), dtype=bool)
+    is_considered[considered_rids] = True
+    vid_of_picking_rids = np.full(len(reqs), -1, dtype=np.int64)
+    num_of_picking_rids_of_vehs = np.zeros(len(vehs), dtype=np.int64)
+    for veh in vehs:
+        picking_rids = [rid for rid in veh.picking_rids if is_considered[rid]]
+        vid_of_picking_rids[picking_rids] = veh.id
+        num_of_picking_rids_of_vehs[veh.id] = len(picking_rids)
 
-    selected_vids = []
-    selected_rids = []
+    pair_idxs_of_trip_rids = veh_trip_pairs.get_pair_idxs_of_trip_rids()
+    is_rid_picked_by_veh = \
+        vid_of_picking_rids[veh_trip_pairs.trip_rids] == veh_trip_pairs.veh_ids[pair_idxs_of_trip_rids]
+    num_of_picking_rids_of_pairs = np.bincount(pair_idxs_of_trip_rids, weights=is_rid_picked_by_veh,
+                                               minlength=len(veh_trip_pairs))
+    trip_sizes = veh_trip_pairs.get_trip_sizes()
+    is_incumbent = (num_of_picking_rids_of_pairs == trip_sizes) \
+        & (trip_sizes == num_of_picking_rids_of_vehs[veh_trip_pairs.veh_ids])
+    incumbent_pair_idxs = np.flatnonzero(is_incumbent)
+    incumbent_pair_idxs = incumbent_pair_idxs[np.lexsort((-veh_trip_pairs.scores[incumbent_pair_idxs],
+                                                          veh_trip_pairs.veh_ids[incumbent_pair_idxs]))]
+    vids, first_idxs = np.unique(veh_trip_pairs.veh_ids[incumbent_pair_idxs], return_index=True)
+    if len(vids) < len(vehs):
+        return None
+    return incumbent_pair_idxs[first_idxs]
 
-    for idx, [veh, trip, sche, cost, score] in enumerate(veh_trip_pairs):
-        # Check if the vehicle has been selected.
-        if veh.id in selected_vids:
+
+# Compute the initial solution of the assignment (as indices into the table) by the greedy assignment, with the
+# unassigned orders then inserted into its trips. If a picking order is left unassigned (and it is ensured), the
+# vehicle picking it keeps its current trip (its pair of the incumbent, where each vehicle keeps its current trip),
+# which is selected first in the greedy assignment redone, until no picking order is left unassigned. The better one
+# of the result and the incumbent is taken. (If there is no incumbent, e.g. the current trips are not in the pairs,
+# and the greedy assignment is not feasible, it is repaired by rounding a zero LP solution instead.)
+def compute_initial_veh_trip_pair_indices(veh_trip_pairs: CandidateTable, considered_rids: list[int],
+                                          reqs: ReqRegistry, vehs: list[Veh],
+                                          ensure_assigning_orders_that_are_picking: bool) -> np.ndarray:
+    incumbent_pair_indices = compute_incumbent_veh_trip_pair_indices(veh_trip_pairs, considered_rids, reqs, vehs)
+    considered_rids = np.array(considered_rids, dtype=np.int64)
+    picking_rids = considered_rids[reqs.status[considered_rids] == OrderStatus.PICKING.value]
+    if not ensure_assigning_orders_that_are_picking:
+        picking_rids = picking_rids[:0]
+    vid_of_rids = np.full(len(reqs), -1, dtype=np.int64)
+    for veh in vehs:
+        vid_of_rids[veh.picking_rids] = veh.id
+
+    # 1. Get the greedy assignment, until it assigns all picking orders.
+    is_veh_keeping_current_trip = np.zeros(len(vehs), dtype=bool)
+    while True:
+        preselected_pair_indices = None
+        if incumbent_pair_indices is not None:
+            preselected_pair_indices = incumbent_pair_indices[is_veh_keeping_current_trip].tolist()
+        greedy_pair_indices = np.array(greedy_assignment(veh_trip_pairs, preselected_pair_indices), dtype=np.int64)
+        is_greedy_feasible = len(np.unique(veh_trip_pairs.veh_ids[greedy_pair_indices])) == len(vehs)
+        if not is_greedy_feasible:
+            break
+        is_rid_assigned = np.zeros(len(reqs), dtype=bool)
+        is_rid_assigned[veh_trip_pairs.trip_rids[np.isin(veh_trip_pairs.get_pair_idxs_of_trip_rids(),
+                                                         greedy_pair_indices)]] = True
+        unassigned_picking_rids = picking_rids[~is_rid_assigned[picking_rids]]
+        is_greedy_feasible = len(unassigned_picking_rids) == 0
+        vids_to_keep_current_trips = vid_of_rids[unassigned_picking_rids]
+        if is_greedy_feasible or incumbent_pair_indices is None \
+                or is_veh_keeping_current_trip[vids_to_keep_current_trips].all():
+            break
+        is_veh_keeping_current_trip[vids_to_keep_current_trips] = True
+
+    # 2. Insert the unassigned orders into its trips, and take the better one of it and the incumbent.
+    if is_greedy_feasible:
+        greedy_pair_indices = insert_unassigned_orders_into_selected_trips(veh_trip_pairs, greedy_pair_indices,
+                                                                           considered_rids, reqs, vehs)
+    if incumbent_pair_indices is None:
+        if is_greedy_feasible:
+            return greedy_pair_indices
+        return np.array(round_lp_relaxed_assignment(veh_trip_pairs, np.zeros(len(veh_trip_pairs)),
+                                                    considered_rids.tolist(), reqs, vehs,
+                                                    ensure_assigning_orders_that_are_picking), dtype=np.int64)
+    if is_greedy_feasible and \
+            veh_trip_pairs.scores[greedy_pair_indices].sum() > veh_trip_pairs.scores[incumbent_pair_indices].sum():
+        return greedy_pair_indices
+    return incumbent_pair_indices
+
+
+# Insert the unassigned orders into the trips of the selected pairs (one per vehicle), where an order is inserted into
+# the trip of a vehicle if the vehicle has a pair of the trip with the order added, the picking orders first and then
+# the pairs of higher scores, in rounds until no more order can be inserted (as "round_lp_relaxed_assignment" does,
+# but in arrays). Each trip is hashed by the sum of the random keys of its orders, so that the pairs of the trips with
+# an order added are found by the differences of their hashes from those of the selected trips. (A false match needs
+# a collision of 64-bit hashes, which is very unlikely.)
+def insert_unassigned_orders_into_selected_trips(veh_trip_pairs: CandidateTable, selected_pair_indices: np.ndarray,
+                                                 considered_rids: list[int], reqs: ReqRegistry,
+                                                 vehs: list[Veh]) -> np.ndarray:
+    # 1. Hash the trips.
+    keys = np.random.default_rng(0).integers(0, np.iinfo(np.int64).max, size=len(reqs), dtype=np.int64) \
+        .astype(np.uint64)
+    cum_keys = np.zeros(len(veh_trip_pairs.trip_rids) + 1, dtype=np.uint64)
+    np.cumsum(keys[veh_trip_pairs.trip_rids], out=cum_keys[1:])
+    pair_hashes = cum_keys[veh_trip_pairs.trip_ptr[1:]] - cum_keys[veh_trip_pairs.trip_ptr[:-1]]
+    key_order = np.argsort(keys)
+    sorted_keys = keys[key_order]
+    trip_sizes = veh_trip_pairs.get_trip_sizes()
+
+    # 2. Get the unassigned orders.
+    selected_pair_idx_of_vehs = np.full(len(vehs), -1, dtype=np.int64)
+    selected_pair_idx_of_vehs[veh_trip_pairs.veh_ids[selected_pair_indices]] = selected_pair_indices
+    is_rid_unassigned = np.zeros(len(reqs), dtype=bool)
+    is_rid_unassigned[considered_rids] = True
+    is_rid_unassigned[veh_trip_pairs.trip_rids[np.isin(veh_trip_pairs.get_pair_idxs_of_trip_rids(),
+                                                       selected_pair_indices)]] = False
+    is_rid_picking = reqs.status[:len(reqs)] == OrderStatus.PICKING.value
+
+    # 3. Insert the orders round by round, where each vehicle and each order take at most one insertion per round.
+    while is_rid_unassigned.any():
+        selected_pair_idxs = selected_pair_idx_of_vehs[veh_trip_pairs.veh_ids]
+        hash_diffs = pair_hashes - pair_hashes[selected_pair_idxs]
+        key_idxs = np.minimum(np.searchsorted(sorted_keys, hash_diffs), len(sorted_keys) - 1)
+        inserted_rids = key_order[key_idxs]
+        is_insertion = (trip_sizes == trip_sizes[selected_pair_idxs] + 1) & (sorted_keys[key_idxs] == hash_diffs) \
+            & is_rid_unassigned[inserted_rids]
+        insertion_idxs = np.flatnonzero(is_insertion)
+        if len(insertion_idxs) == 0:
+            break
+        insertion_idxs = insertion_idxs[np.lexsort((-veh_trip_pairs.scores[insertion_idxs],
+                                                    ~is_rid_picking[inserted_rids[insertion_idxs]]))]
+        is_veh_inserted = np.zeros(len(vehs), dtype=bool)
+        for idx in insertion_idxs.tolist():
+            vid = veh_trip_pairs.veh_ids[idx]
+            rid = inserted_rids[idx]
+            if is_veh_inserted[vid] or not is_rid_unassigned[rid]:
+                continue
+            is_veh_inserted[vid] = True
+            is_rid_unassigned[rid] = False
+            selected_pair_idx_of_vehs[vid] = idx
+
+    return np.sort(selected_pair_idx_of_vehs)
+
+
+# Round the solution of the LP relaxation to an assignment (as indices into the table).
+# (The vehicles pick their pairs greedily in descending order of the pairs' values in the LP solution, and vehicles
+#  that pick nothing are given their pairs of empty trips. Each order left unassigned is then inserted into the trip of
+#  a vehicle, if the vehicle has a pair of the trip with the order added. If a picking order still cannot be assigned,
+#  the vehicle picking it takes back its current orders (and no order is inserted into its trip later), which may
+#  displace the orders of other vehicles, and so on. In the worst case, all vehicles keep their current trips, which is
+#  always a feasible assignment.)
+def round_lp_relaxed_assignment(veh_trip_pairs: CandidateTable, pair_values: np.ndarray, considered_rids: list[int],
+                                reqs: ReqRegistry, vehs: list[Veh],
+                                ensure_assigning_orders_that_are_picking: bool) -> list[int]:
+    veh_ids = veh_trip_pairs.veh_ids.tolist()
+    trip_ptr = veh_trip_pairs.trip_ptr.tolist()
+    trip_rids = veh_trip_pairs.trip_rids.tolist()
+    selected_pair_idx_of_vehs = [-1] * len(vehs)
+    vid_of_assigned_rids = {}
+    is_veh_keeping_current_trip = [False] * len(vehs)
+
+    # 0. Index the pairs by their vehicles and trips, and the vehicles that can serve each order.
+    pair_idx_of_veh_trips = {}
+    vids_of_rids = {}
+    for idx in range(len(veh_ids)):
+        trip = trip_rids[trip_ptr[idx]:trip_ptr[idx + 1]]
+        pair_idx_of_veh_trips.setdefault((veh_ids[idx], frozenset(trip)), idx)
+        for rid in trip:
+            vids_of_rids.setdefault(rid, {})[veh_ids[idx]] = None
+
+    def get_trip(idx: int) -> list[int]:
+        return trip_rids[trip_ptr[idx]:trip_ptr[idx + 1]] if idx != -1 else []
+
+    def assign_pair(idx: int):
+        unassign_pair_of_veh(veh_ids[idx])
+        selected_pair_idx_of_vehs[veh_ids[idx]] = idx
+        for rid in get_trip(idx):
+            vid_of_assigned_rids[rid] = veh_ids[idx]
+
+    def unassign_pair_of_veh(vid: int) -> list[int]:
+        released_rids = get_trip(selected_pair_idx_of_vehs[vid])
+        selected_pair_idx_of_vehs[vid] = -1
+        for rid in released_rids:
+            del vid_of_assigned_rids[rid]
+        return released_rids
+
+    def insert_unassigned_reqs(rids: list[int]):
+        for rid in rids:
+            if rid in vid_of_assigned_rids:
+                continue
+            for vid in vids_of_rids.get(rid, {}):
+                if is_veh_keeping_current_trip[vid]:
+                    continue
+                trip = frozenset(get_trip(selected_pair_idx_of_vehs[vid])) | {rid}
+                if (vid, trip) in pair_idx_of_veh_trips:
+                    assign_pair(pair_idx_of_veh_trips[(vid, trip)])
+                    break
+
+    # 1. Select the pairs greedily, from the one with the largest value (and then the largest score).
+    for idx in np.lexsort((-veh_trip_pairs.scores, -pair_values)).tolist():
+        if selected_pair_idx_of_vehs[veh_ids[idx]] != -1:
             continue
-        # Check if any request in the trip has been selected.
-        T_id = [r.id for r in trip]
-        if np.any([rid in selected_rids for rid in T_id]):
+        if any(rid in vid_of_assigned_rids for rid in get_trip(idx)):
             continue
-        # The current vehicle_trip_pair is selected.
-        selected_vids.append(veh.id)
-        selected_rids.extend(T_id)
-        selected_veh_trip_pair_indices.append(idx)
+        assign_pair(idx)
+    for vid in range(len(vehs)):
+        if selected_pair_idx_of_vehs[vid] == -1:
+            assign_pair(pair_idx_of_veh_trips[(vid, frozenset())])
 
-    if DEBUG_PRINT:
-        print(f"({timer_end(t)})")
+    # 2. Insert the unassigned orders, the picking ones first.
+    is_req_picking = reqs.status[np.array(considered_rids, dtype=np.int64)] == OrderStatus.PICKING.value
+    picking_rids = np.array(considered_rids, dtype=np.int64)[is_req_picking].tolist()
+    insert_unassigned_reqs(picking_rids)
 
-    return selected_veh_trip_pair_indices
+    # 3. Make sure that no picking order is ignored.
+    if ensure_assigning_orders_that_are_picking:
+        vid_of_picking_rids = {rid: veh.id for veh in vehs for rid in veh.picking_rids}
+        vids_to_keep_current_trips = deque(vid_of_picking_rids[rid] for rid in picking_rids
+                                           if rid not in vid_of_assigned_rids)
+        while vids_to_keep_current_trips:
+            vid = vids_to_keep_current_trips.popleft()
+            if is_veh_keeping_current_trip[vid]:
+                continue
+            is_veh_keeping_current_trip[vid] = True
+            current_trip = frozenset(vehs[vid].picking_rids)
+            # The other vehicles assigned the vehicle's current orders drop them (or the rest of their trips as well,
+            # if they have no pairs of the remaining trips), and the vehicle adds its current orders to its trip (or
+            # drops its trip).
+            released_rids = []
+            for other_vid in {vid_of_assigned_rids[rid] for rid in current_trip if rid in vid_of_assigned_rids} - {vid}:
+                remaining_trip = frozenset(get_trip(selected_pair_idx_of_vehs[other_vid])) - current_trip
+                if (other_vid, remaining_trip) not in pair_idx_of_veh_trips:
+                    kept_trip = frozenset(vehs[other_vid].picking_rids) if is_veh_keeping_current_trip[other_vid] \
+                        else frozenset()
+                    released_rids += list(remaining_trip - kept_trip)
+                    remaining_trip = kept_trip
+                assign_pair(pair_idx_of_veh_trips[(other_vid, remaining_trip)])
+            trip = frozenset(get_trip(selected_pair_idx_of_vehs[vid])) | current_trip
+            if (vid, trip) not in pair_idx_of_veh_trips:
+                released_rids += list(trip - current_trip)
+                trip = current_trip
+            assign_pair(pair_idx_of_veh_trips[(vid, trip)])
+            # The vehicles picking the released orders keep their current trips, if the orders are still unassigned.
+            insert_unassigned_reqs(released_rids)
+            for rid in released_rids:
+                if rid not in vid_of_assigned_rids and rid in vid_of_picking_rids:
+                    vids_to_keep_current_trips.append(vid_of_picking_rids[rid])
+
+    # 4. Insert the other unassigned orders.
+    insert_unassigned_reqs(considered_rids)
+
+    return sorted(selected_pair_idx_of_vehs)
+
+
+class AssignmentBackend(abc.ABC):
+    """
+    AssignmentBackend is the interface of the solvers of the assignment ILP. A backend keeps its model between
+    epochs, of which the contents are replaced in bulk by the problem of each epoch.
+    Attributes:
+        name: name of the backend
+    """
+
+    name = "NONE"
+
+    # Solve max c·z, s.t. A z = b, 0 <= z <= ub, z binary (or continuous if it is the LP relaxation), starting from
+    # the given feasible solution if any, and return [z, objective, bound], where bound is the best bound of the
+    # objective (the LP optimum for the relaxation, inf if no bound is proven), or None if no solution is found. If
+    # the deadline is reached, the best solution found so far is returned. (The solver gets the time left after the
+    # model is loaded, so that loading the model counts towards the deadline.)
+    @abc.abstractmethod
+    def solve(self, obj_coefs: np.ndarray, con_matrix: scipy.sparse.csr_matrix, con_rhs: np.ndarray,
+              var_ubs: np.ndarray, is_lp_relaxation: bool, var_starts: np.ndarray = None,
+              deadline: datetime = None) -> [np.ndarray, float, float]:
+        pass
+
+
+class GurobiBackend(AssignmentBackend):
+    """
+    GurobiBackend solves the assignment by Gurobi (needs a licensed gurobipy)
+    Attributes:
+        model: the Gurobi model, kept with its environment and parameters between epochs
+    """
+
+    name = "GUROBI"
+
+    def __init__(self):
+        self.model = gp.Model("ilp")
+        self.model.setParam("LogToConsole", 0)
+        # self.model.setParam("Threads", 6)
+
+    def solve(self, obj_coefs: np.ndarray, con_matrix: scipy.sparse.csr_matrix, con_rhs: np.ndarray,
+              var_ubs: np.ndarray, is_lp_relaxation: bool, var_starts: np.ndarray = None,
+              deadline: datetime = None) -> [np.ndarray, float, float]:
+        model = self.model
+        try:
+            model.remove(model.getVars())
+            model.remove(model.getConstrs())
+            var = model.addMVar(len(obj_coefs), lb=0.0, ub=var_ubs, obj=obj_coefs,
+                                vtype=GRB.CONTINUOUS if is_lp_relaxation else GRB.BINARY)
+            model.ModelSense = GRB.MAXIMIZE
+            model.addMConstr(con_matrix, var, GRB.EQUAL, con_rhs)
+            if var_starts is not None and not is_lp_relaxation:
+                var.Start = var_starts
+            model.update()
+            time_limit_sec = get_time_left_sec_to_deadline(deadline)
+            if time_limit_sec <= 0:
+                return None
+            model.setParam("TimeLimit", min(time_limit_sec, GRB.INFINITY))
+            model.optimize()
+            if model.SolCount == 0:
+                return None
+            if is_lp_relaxation:
+                bound = model.ObjVal if model.Status == GRB.OPTIMAL else np.inf
+            else:
+                bound = model.ObjBound
+            return [var.X, model.ObjVal, bound]
+        except gp.GurobiError as e:
+            print(f"\n[GUROBI] Error code = {str(e.message)} ({str(e)}).")
+            return None
+
+
+class HighsBackend(AssignmentBackend):
+    """
+    HighsBackend solves the assignment by the open-source solver HiGHS (needs highspy)
+    Attributes:
+        highs: the HiGHS solver instance, kept with its options between epochs
+    """
+
+    name = "HIGHS"
+
+    def __init__(self):
+        self.highs = highspy.Highs()
+        self.highs.setOptionValue("output_flag", False)
+
+    def solve(self, obj_coefs: np.ndarray, con_matrix: scipy.sparse.csr_matrix, con_rhs: np.ndarray,
+              var_ubs: np.ndarray, is_lp_relaxation: bool, var_starts: np.ndarray = None,
+              deadline: datetime = None) -> [np.ndarray, float, float]:
+        con_matrix = con_matrix.tocsc()
+        lp = highspy.HighsLp()
+        lp.num_col_ = con_matrix.shape[1]
+        lp.num_row_ = con_matrix.shape[0]
+        lp.sense_ = highspy.ObjSense.kMaximize
+        lp.col_cost_ = obj_coefs
+        lp.col_lower_ = np.zeros(len(var_ubs))
+        lp.col_upper_ = var_ubs
+        lp.row_lower_ = con_rhs
+        lp.row_upper_ = con_rhs
+        lp.a_matrix_.format_ = highspy.MatrixFormat.kColwise
+        lp.a_matrix_.num_col_ = con_matrix.shape[1]
+        lp.a_matrix_.num_row_ = con_matrix.shape[0]
+        lp.a_matrix_.start_ = con_matrix.indptr
+        lp.a_matrix_.index_ = con_matrix.indices
+        lp.a_matrix_.value_ = con_matrix.data
+        if not is_lp_relaxation:
+            lp.integrality_ = [highspy.HighsVarType.kInteger] * lp.num_col_
+        self.highs.passModel(lp)
+        if var_starts is not None and not is_lp_relaxation:
+            self.highs.setSolution(len(var_starts), np.arange(len(var_starts), dtype=np.int32), var_starts)
+        time_limit_sec = get_time_left_sec_to_deadline(deadline)
+        if time_limit_sec <= 0:
+            return None
+        self.highs.setOptionValue("time_limit", time_limit_sec)
+        self.highs.run()
+        info = self.highs.getInfo()
+        if info.primal_solution_status != 2:  # (2 means a feasible solution is found)
+            return None
+        objective = info.objective_function_value
+        if is_lp_relaxation:
+            bound = objective if self.highs.getModelStatus() == highspy.HighsModelStatus.kOptimal else np.inf
+        else:
+            bound = info.mip_dual_bound
+        return [np.array(self.highs.getSolution().col_value), objective, bound]
+
+
+# The backend solving the assignment, which is created the first time it is used.
+ASSIGNMENT_BACKEND_IN_USE = None
+
+
+def get_assignment_backend() -> AssignmentBackend:
+    global ASSIGNMENT_BACKEND_IN_USE
+    if ASSIGNMENT_BACKEND_IN_USE is None:
+        ASSIGNMENT_BACKEND_IN_USE = get_assignment_backend_type()()
+    return ASSIGNMENT_BACKEND_IN_USE
+
+
+def get_assignment_backend_type() -> type:
+    if ASSIGNMENT_BACKEND == "GUROBI" or (ASSIGNMENT_BACKEND == "AUTO" and gp is not None):
+        assert (gp is not None and "[ERROR] gurobipy is not installed! Please check the backend in config!")
+        return GurobiBackend
+    elif ASSIGNMENT_BACKEND == "HIGHS" or ASSIGNMENT_BACKEND == "AUTO":
+        assert (highspy is not None and "[ERROR] No solver is installed! Please install gurobipy or highspy!")
+        return HighsBackend
+    else:
+        assert (False and "[ERROR] WRONG ASSIGNMENT BACKEND SETTING! Please check the backend in config!")
@@ -1,73 +1,165 @@
 """
 compute all feasible schedules for a given vehicle v and a trip T.
 """
-import copy
 
-from src.simulator.request import Req
+from src.simulator.request import Req, ReqRegistry
 from src.simulator.vehicle import Veh
 from src.simulator.route_functions import *
+from src.dispatcher.candidate_table import CandidateTable
 from src.value_function.value_function import ValueFunction
 
 
+# Find the veh-req pairs where the vehicle can reach the request's origin before its latest pickup time. Only the
+# vehicles located at the nodes that can reach the origin within the max pickup wait time (the reverse reachability
+# index) are tested, so that the work grows with the number of such pairs rather than the fleet size times the number
+# of requests. (The pairs are returned as two arrays of indices into vehs and rids, sorted by vehicle then request.)
+def compute_pickup_feasible_veh_req_pairs(vehs: list[Veh], rids: list[int], reqs: list[Req],
+                                          system_time_sec: int) -> (np.ndarray, np.ndarray):
+    vehs_nid = np.array([veh.nid for veh in vehs], dtype=np.int64)
+    vehs_t_to_nid = np.array([veh.t_to_nid for veh in vehs], dtype=np.float64)
+    reqs_onid = np.array([reqs[rid].onid for rid in rids], dtype=np.int64)
+    reqs_Clp = np.array([reqs[rid].Clp for rid in rids], dtype=np.float64)
+    reach_indptr, reach_onids = get_reverse_reachability_index(MAX_PICKUP_WAIT_TIME_MIN[0] * 60)
+    num_of_nodes = len(reach_indptr) - 1
+
+    # 1. Bucket the vehicles by their nearest nodes. (The vehicles at node nid are veh_order[ptr[nid-1]:ptr[nid]].)
+    veh_order = np.argsort(vehs_nid, kind="stable")
+    veh_bucket_ptr = np.searchsorted(vehs_nid[veh_order], np.arange(1, num_of_nodes + 2), side="left")
+
+    # 2. Get the nodes that can reach each request's origin and have vehicles on them.
+    reach_pts = concatenate_index_ranges(reach_indptr[reqs_onid - 1], reach_indptr[reqs_onid])
+    reach_req_idxs = np.repeat(np.arange(len(rids)), reach_indptr[reqs_onid] - reach_indptr[reqs_onid - 1])
+    reach_nids = reach_onids[reach_pts]
+    bucket_starts = veh_bucket_ptr[reach_nids - 1]
+    bucket_ends = veh_bucket_ptr[reach_nids]
+    has_vehs = bucket_ends > bucket_starts
+    reach_req_idxs = reach_req_idxs[has_vehs]
+    bucket_starts = bucket_starts[has_vehs]
+    bucket_ends = bucket_ends[has_vehs]
+
+    # 3. Test each pair of such a vehicle and the request.
+    veh_idxs = veh_order[concatenate_index_ranges(bucket_starts, bucket_ends)]
+    req_idxs = np.repeat(reach_req_idxs, bucket_ends - bucket_starts)
+    pickup_durations = get_durations_from_origins_to_dests(vehs_nid[veh_idxs], reqs_onid[req_idxs])
+    is_feasible = pickup_durations + vehs_t_to_nid[veh_idxs] + system_time_sec <= reqs_Clp[req_idxs]
+    veh_idxs = veh_idxs[is_feasible]
+    req_idxs = req_idxs[is_feasible]
+    order = np.lexsort((req_idxs, veh_idxs))
+    return veh_idxs[order], req_idxs[order]
+
+
+# The number of insertions of a request into a schedule evaluated by "compute_schedule" so far (in this process),
+# which is used to measure (and limit) the work of a trip search independently of the machine speed.
+NUM_OF_INSERTION_EVALUATIONS = [0]
+
+
 # (schedules of trip T of size k are computed based on schedules of its subtrip of size k-1)
-def compute_schedule(veh_params: [int, float, int], sub_sches: list[list[(int, int, int, float)]],
+# The request is inserted into each sub-schedule at each pair of pick-up position i and drop-off position j. For each
+# sub-schedule, the arrival times, the loads and the slack times (the latest time minus the arrival time) of its stops
+# are precomputed, so that each insertion is tested in O(1): the pick-up delays the stops between i and j by a detour
+# time, which is feasible if it does not exceed their minimum slack, and the drop-off further delays the stops after j.
+# The insertions are tested in the same order, and stopped by the same violations, as testing the new schedules one by
+# one through "test_constraints_get_cost".
+def compute_schedule(veh_params: [int, float, int], sub_sches: list[tuple[(int, int, int, float), ...]],
                      req_params: [int, int, int, float, float],
-                     system_time_sec: int) -> (list, float, list[list[(int, int, int, float)]]):
+                     system_time_sec: int) -> (list, float, list[tuple[(int, int, int, float), ...]]):
     # veh_params = [veh.nid, veh.t_to_nid, veh.load]
     # req_params = [req.id, req.onid, req.dnid, req.Clp, req.Cld]
+    [veh_nid, veh_t_to_nid, veh_load] = veh_params
+    [rid, r_onid, r_dnid, r_Clp, r_Cld] = req_params
+    pickup_stop = (rid, 1, r_onid, r_Clp)
+    dropoff_stop = (rid, -1, r_dnid, r_Cld)
     feasible_sches = []
     best_sche = None
     min_cost = np.inf
     viol = None
+    num_of_insertion_evaluations = 0
     for sub_sche in sub_sches:
         l = len(sub_sche)
+        # 1. Precompute the arrival time, the load before and the slack time of each stop of the sub-schedule, and the
+        #    minimum slack time of the stops from each stop to the end of the sub-schedule.
+        #    (A stop is late if it is delayed by more than its slack time.)
+        arrival_times = [0.0] * l
+        loads = [veh_load] * (l + 1)
+        slacks = [0.0] * l
+        nid = veh_nid
+        accumulated_time_sec = veh_t_to_nid
+        is_sub_sche_over_capacity = False
+        for m, (_, pod, tnid, ddl) in enumerate(sub_sche):
+            accumulated_time_sec += get_duration_from_origin_to_dest(nid, tnid)
+            arrival_times[m] = accumulated_time_sec
+            slacks[m] = ddl - system_time_sec - accumulated_time_sec
+            loads[m + 1] = loads[m] + pod
+            if loads[m + 1] > VEH_CAPACITY[0]:
+                is_sub_sche_over_capacity = True
+            nid = tnid
+        min_slacks_to_end = [np.inf] * (l + 1)
+        for m in range(l - 1, -1, -1):
+            min_slacks_to_end[m] = min(slacks[m], min_slacks_to_end[m + 1])
+
+        # 3. Test the insertions, picking up the request before the i-th stop and dropping it off before the d-th stop
+        #    (j = d + 1 is the drop-off position in the new schedule).
         # insert the req's pick-up point
         for i in range(l + 1):
+            if i == 0:
+                pickup_time_sec = veh_t_to_nid + get_duration_from_origin_to_dest(veh_nid, r_onid)
+            else:
+                pickup_time_sec = arrival_times[i - 1] + get_duration_from_origin_to_dest(sub_sche[i - 1][2], r_onid)
+            is_pickup_late = system_time_sec + pickup_time_sec > r_Clp
+            if i < l:
+                pickup_detour_sec = \
+                    pickup_time_sec + get_duration_from_origin_to_dest(r_onid, sub_sche[i][2]) - arrival_times[i]
+            max_load_in_between = loads[i]
+            min_slack_in_between = np.inf
             # insert the req's drop-off point
-            for j in range(i + 1, l + 2):
-                new_sche, new_sche_cost, viol = insert_req_into_sche(veh_params, sub_sche, req_params,
-                                                                     i, j, system_time_sec)
-                if new_sche:
-                    if new_sche_cost < min_cost:
-                        best_sche = new_sche
-                        min_cost = new_sche_cost
-                        feasible_sches.insert(0, new_sche)
-                    else:
-                        feasible_sches.append(new_sche)
-                # # always return the first found feasible schedule (will speed up the computation)
-                # if DISPATCHER == 'SBA' and best_sche:
-                #     assert len(feasible_sches) == 1
-                #     return best_sche, min_cost, feasible_sches
-                if viol > 0:
+            for d in range(i, l + 1):
+                num_of_insertion_evaluations += 1
+                if d > i:
+                    max_load_in_between = max(max_load_in_between, loads[d])
+                    min_slack_in_between = min(min_slack_in_between, slacks[d - 1])
+                if is_sub_sche_over_capacity or max_load_in_between + 1 > VEH_CAPACITY[0]:
+                    viol = 1  # over capacity
+                    break
+                if is_pickup_late:
+                    viol = 3  # no more feasible schedules, since later pick-up brings longer wait time
+                    break
+                if d > i and pickup_detour_sec > min_slack_in_between:
+                    viol = 4  # the violation is caused by the pick-up of req, happening before its drop-off
                     break
+                if d == i:
+                    dropoff_time_sec = pickup_time_sec + get_duration_from_origin_to_dest(r_onid, r_dnid)
+                else:
+                    dropoff_time_sec = arrival_times[d - 1] + pickup_detour_sec \
+                                       + get_duration_from_origin_to_dest(sub_sche[d - 1][2], r_dnid)
+                if system_time_sec + dropoff_time_sec > r_Cld:
+                    viol = 2  # a new pick-up insertion is needed, since later drop-off brings longer travel time
+                    break
+                if d < l:
+                    dropoff_detour_sec = \
+                        dropoff_time_sec + get_duration_from_origin_to_dest(r_dnid, sub_sche[d][2]) - arrival_times[d]
+                    if dropoff_detour_sec > min_slacks_to_end[d]:
+                        viol = 0
+                        continue
+                    new_sche_cost = arrival_times[-1] + dropoff_detour_sec
+                else:
+                    new_sche_cost = dropoff_time_sec
+                viol = -1
+                new_sche = sub_sche[:i] + (pickup_stop,) + sub_sche[i:d] + (dropoff_stop,) + sub_sche[d:]
+                if new_sche_cost < min_cost:
+                    best_sche = new_sche
+                    min_cost = new_sche_cost
+                    feasible_sches.insert(0, new_sche)
+                else:
+                    feasible_sches.append(new_sche)
             if viol == 3:
                 break
+    NUM_OF_INSERTION_EVALUATIONS[0] += num_of_insertion_evaluations
     return best_sche, min_cost, feasible_sches
 
 
-# Try to insert "req" into veh's "sub_sche", return the new_sche if it is feasible, else return "new_sche = None".
-def insert_req_into_sche(veh_params: [int, float, int], sub_sche: list[(int, int, int, float)],
-                         req_params: [int, int, int, float, float], idx_p: int, idx_d: int,
-                         system_time_sec: int) -> (list, float, int):
-    [rid, r_onid, r_dnid, r_Clp, r_Cld] = req_params
-    new_sche = None
-    new_sche_cost = np.inf
-
-    sub_sche.insert(idx_p, (rid, 1, r_onid, r_Clp))
-    sub_sche.insert(idx_d, (rid, -1, r_dnid, r_Cld))
-    flag, c, viol = test_constraints_get_cost(veh_params, sub_sche, rid, idx_p, idx_d, system_time_sec)
-
-    if flag:
-        new_sche = copy.copy(sub_sche)
-        new_sche_cost = c
-    sub_sche.pop(idx_d)
-    sub_sche.pop(idx_p)
-    return new_sche, new_sche_cost, viol
-
-
 # Test if a schedule can satisfy all constraints, return the cost (if yes) or the type of violation (if no).
 # The returned cost is the sche time, which is the same as the output of the following function "compute_sche_cost".
-def test_constraints_get_cost(veh_params: [int, float, int], sche: list[(int, int, int, float)],
+def test_constraints_get_cost(veh_params: [int, float, int], sche: tuple[(int, int, int, float), ...],
                               new_rid: int, idx_p: int, idx_d: int, system_time_sec: int) -> (bool, float, int):
     [nid, accumulated_time_sec, n] = veh_params
     # test the capacity constraint during the whole schedule
@@ -98,7 +190,7 @@ def test_constraints_get_cost(veh_params: [int, float, int], sche: list[(int, in
     return True, accumulated_time_sec, -1
 
 
-def compute_sche_cost(veh: Veh, sche: list[(int, int, int, float)]) -> float:
+def compute_sche_cost(veh: Veh, sche: tuple[(int, int, int, float), ...]) -> float:
     nid = veh.nid
     accumulated_time_sec = veh.t_to_nid
     for (rid, pod, tnid, ddl) in sche:
@@ -107,15 +199,15 @@ def compute_sche_cost(veh: Veh, sche: list[(int, int, int, float)]) -> float:
     return accumulated_time_sec
 
 
-def upd_schedule_for_vehicles_in_selected_vt_pairs(candidate_veh_trip_pairs: list,
+def upd_schedule_for_vehicles_in_selected_vt_pairs(candidate_veh_trip_pairs: CandidateTable,
                                                    selected_veh_trip_pair_indices: list[int]):
     t = timer_start()
 
     for idx in selected_veh_trip_pair_indices:
-        [veh, trip, sche, cost, score] = candidate_veh_trip_pairs[idx]
-        for req in trip:
-            req.status = OrderStatus.PICKING
-        veh.build_route(sche)
+        veh = candidate_veh_trip_pairs.vehs[candidate_veh_trip_pairs.veh_ids[idx]]
+        for rid in candidate_veh_trip_pairs.get_trip_rids(idx):
+            candidate_veh_trip_pairs.reqs[rid].status = OrderStatus.PICKING
+        veh.build_route(candidate_veh_trip_pairs.sches[idx])
         veh.sche_has_been_updated_at_current_epoch = True
 
     if DEBUG_PRINT:
@@ -123,7 +215,8 @@ def upd_schedule_for_vehicles_in_selected_vt_pairs(candidate_veh_trip_pairs: lis
               f"({timer_end(t)})")
 
 
-def compute_sche_delay(veh: Veh, sche: list[(int, int, int, float)], reqs: list[Req], system_time_sec: int) -> float:
+def compute_sche_delay(veh: Veh, sche: tuple[(int, int, int, float), ...], reqs: list[Req],
+                       system_time_sec: int) -> float:
     nid = veh.nid
     accumulated_time_sec = veh.t_to_nid
     delay_sec = 0.0
@@ -137,15 +230,54 @@ def compute_sche_delay(veh: Veh, sche: list[(int, int, int, float)], reqs: list[
     return delay_sec
 
 
-def score_vt_pairs_with_num_of_orders_and_sche_cost(veh_trip_pairs: list, reqs: list[Req], system_time_sec: int):
+# Compute the delay of the schedule of each vt_pair, the same as "compute_sche_delay" but for all pairs at once.
+# (The stops of the schedules are arranged in a matrix, where the i-th row holds the i-th schedule, padded by staying
+#  at its last node. The travel times are then got in one table lookup and accumulated column by column, in the same
+#  order as in "compute_sche_delay".)
+def compute_sche_delays_of_vt_pairs(veh_trip_pairs: CandidateTable, reqs: ReqRegistry,
+                                    system_time_sec: int) -> np.ndarray:
+    num_of_pairs = len(veh_trip_pairs)
+    sche_lens = np.array([len(sche) for sche in veh_trip_pairs.sches], dtype=np.int64)
+    max_sche_len = int(sche_lens.max()) if num_of_pairs > 0 else 0
+    delays_sec = np.zeros(num_of_pairs, dtype=np.float64)
+    if max_sche_len == 0:
+        return delays_sec
+
+    # 1. Arrange the stops in matrices.
+    vehs_nid = np.array([veh.nid for veh in veh_trip_pairs.vehs], dtype=np.int64)
+    vehs_t_to_nid = np.array([veh.t_to_nid for veh in veh_trip_pairs.vehs], dtype=np.float64)
+    stops = np.array([(rid, pod, tnid) for sche in veh_trip_pairs.sches for (rid, pod, tnid, ddl) in sche],
+                     dtype=np.int64).reshape(-1, 3)
+    rows = np.repeat(np.arange(num_of_pairs), sche_lens)
+    cols = np.arange(len(stops)) - np.repeat(np.cumsum(sche_lens) - sche_lens, sche_lens)
+    nids = np.zeros((num_of_pairs, max_sche_len + 1), dtype=np.int64)
+    nids[:, 0] = vehs_nid[veh_trip_pairs.veh_ids]
+    nids[rows, cols + 1] = stops[:, 2]
+    pods = np.zeros((num_of_pairs, max_sche_len), dtype=np.int64)
+    pods[rows, cols] = stops[:, 1]
+    rids = np.zeros((num_of_pairs, max_sche_len), dtype=np.int64)
+    rids[rows, cols] = np.where(stops[:, 1] == -1, stops[:, 0], 0)
+    for k in range(1, max_sche_len + 1):
+        nids[:, k] = np.where(k <= sche_lens, nids[:, k], nids[:, k - 1])
+
+    # 2. Accumulate the travel times and the delays at the dropoff stops.
+    durations_sec = get_durations_from_origins_to_dests(nids[:, :-1].ravel(), nids[:, 1:].ravel())
+    is_stop = np.arange(max_sche_len) < sche_lens[:, None]
+    durations_sec = np.where(is_stop, durations_sec.reshape(num_of_pairs, max_sche_len), 0.0)
+    accumulated_times_sec = vehs_t_to_nid[veh_trip_pairs.veh_ids]
+    for k in range(max_sche_len):
+        accumulated_times_sec = accumulated_times_sec + durations_sec[:, k]
+        delays_sec += np.where(pods[:, k] == -1,
+                               system_time_sec + accumulated_times_sec - reqs.Tr[rids[:, k]] - reqs.Ts[rids[:, k]],
+                               0.0)
+    return delays_sec
+
+
+def score_vt_pairs_with_num_of_orders_and_sche_cost(veh_trip_pairs: CandidateTable, reqs: ReqRegistry,
+                                                    system_time_sec: int):
     # 1. Get the coefficients for NumOfOrders and ScheduleCost.
-    max_sche_cost = 1
-    for vt_pair in veh_trip_pairs:
-        [veh, trip, sche, cost, score] = vt_pair
-        vt_pair[3] = compute_sche_delay(veh, sche, reqs, system_time_sec)
-        if vt_pair[3] > max_sche_cost:
-            max_sche_cost = vt_pair[3]
-    max_sche_cost = int(max_sche_cost)
+    veh_trip_pairs.costs = compute_sche_delays_of_vt_pairs(veh_trip_pairs, reqs, system_time_sec)
+    max_sche_cost = int(max(1, veh_trip_pairs.costs.max(initial=1)))
     num_length = 0
     while max_sche_cost:
         max_sche_cost //= 10
@@ -154,26 +286,23 @@ def score_vt_pairs_with_num_of_orders_and_sche_cost(veh_trip_pairs: list, reqs:
 
     # # 2. Score the vt_pairs with NumOfOrders and ScheduleCost.
     # # (The objective is to maximize the number of assigned orders and minimize the schedule cost (travel delay).)
-    # for vt_pair in veh_trip_pairs:
-    #     vt_pair[4] = reward_for_serving_a_req * len(vt_pair[1]) - vt_pair[3]
+    # veh_trip_pairs.scores = reward_for_serving_a_req * veh_trip_pairs.get_trip_sizes() - veh_trip_pairs.costs
 
-    for vt_pair in veh_trip_pairs:
-        vt_pair[4] = len(vt_pair[1])
+    veh_trip_pairs.scores = veh_trip_pairs.get_trip_sizes().astype(np.float64)
 
 
 # ("is_reoptimization" only influences the calculation of rewards in "compute_post_decision_state".)
 def score_vt_pairs_with_num_of_orders_and_value_of_post_decision_state(num_of_new_reqs: int,
                                                                        vehs: list[Veh],
                                                                        reqs: list[Req],
-                                                                       veh_trip_pairs: list,
+                                                                       veh_trip_pairs: CandidateTable,
                                                                        value_func: ValueFunction,
                                                                        system_time_sec: int,
                                                                        is_reoptimization: bool = False):
     expected_vt_scores = value_func.compute_expected_values_for_veh_trip_pairs(num_of_new_reqs, vehs,
-                                                                               copy.deepcopy(veh_trip_pairs),
+                                                                               veh_trip_pairs,
                                                                                system_time_sec, is_reoptimization)
-    for idx, vt_pair in enumerate(veh_trip_pairs):
-        vt_pair[4] = expected_vt_scores[idx]
+    veh_trip_pairs.scores = np.array(expected_vt_scores, dtype=np.float64)
 
     # # 1. Get the coefficients for NumOfOrders and ScheduleCost.
     # max_sche_cost = 1
@@ -0,0 +1,51 @@
+"""
+forecast of the demand of each zone, built from historical taxi requests data
+"""
+
+from src.simulator.request import load_request_records_of_taxi_data_file
+from src.simulator.route_functions import *
+
+
+class DemandForecaster(object):
+    """
+    DemandForecaster forecasts the number of requests of each zone (the area nearest to a vehicle station) by the
+    average over the historical taxi data files, in bins of DEMAND_FORECAST_BIN_MIN minutes of the day
+    Attributes:
+        taxi_data_files: names of the historical taxi data files (days of taxi requests)
+        init_time_sec: the time of the day (seconds from 0 clock) when the simulation starts, i.e. system time 0
+        bin_sec: length of a bin (s)
+        expected_demands: expected number of requests of each zone in each bin of the day, as an array of shape
+            (num_of_bins, num_of_zones)
+        cumulative_demands: cumulative sum of expected_demands over the bins, starting from a row of zeros
+    """
+
+    def __init__(self, taxi_data_files: list[str], init_time_sec: int, request_density: float = REQUEST_DENSITY):
+        self.taxi_data_files = taxi_data_files
+        self.init_time_sec = init_time_sec
+        self.bin_sec = DEMAND_FORECAST_BIN_MIN * 60
+        num_of_bins = int(np.ceil(24 * 3600 / self.bin_sec))
+        num_of_zones = get_num_of_vehicle_stations()
+
+        # Count the requests of each (bin, zone) in all files, and average them (scaled by the replayed fraction).
+        counts = np.zeros(num_of_bins * num_of_zones, dtype=np.float64)
+        for taxi_data_file in taxi_data_files:
+            request_records = load_request_records_of_taxi_data_file(taxi_data_file)
+            bins = np.minimum(request_records["request_time_sec"].astype(np.int64) // self.bin_sec, num_of_bins - 1)
+            zones = get_station_zones_of_nodes(request_records["origin_node_id"].astype(np.int64))
+            counts += np.bincount(bins * num_of_zones + zones, minlength=num_of_bins * num_of_zones)
+        self.expected_demands = counts.reshape(num_of_bins, num_of_zones) * request_density / len(taxi_data_files)
+        self.cumulative_demands = np.zeros((num_of_bins + 1, num_of_zones), dtype=np.float64)
+        np.cumsum(self.expected_demands, axis=0, out=self.cumulative_demands[1:])
+
+    # get the expected number of requests of each zone during system time [T, T + horizon), where a bin partly
+    # covered by the period counts in proportion
+    def get_expected_demands_of_zones(self, system_time_sec: int, horizon_sec: int) -> np.ndarray:
+        return self.get_cumulative_demands_of_zones(system_time_sec + horizon_sec) \
+            - self.get_cumulative_demands_of_zones(system_time_sec)
+
+    # (the expected number of requests of each zone from 0 clock to system time T)
+    def get_cumulative_demands_of_zones(self, system_time_sec: int) -> np.ndarray:
+        time_of_day_sec = min(system_time_sec + self.init_time_sec, len(self.expected_demands) * self.bin_sec)
+        bin_idx = min(time_of_day_sec // self.bin_sec, len(self.expected_demands) - 1)
+        fraction = (time_of_day_sec - bin_idx * self.bin_sec) / self.bin_sec
+        return self.cumulative_demands[bin_idx] + fraction * self.expected_demands[bin_idx]
@@ -0,0 +1,176 @@
+"""
+rebalancing algorithm for the AMoD system, repositioning idle vehicles to demand through min-cost flow
+"""
+
+from src.dispatcher.ilp_assign import *
+
+
+# (The demand of each zone in the near future is given by zone_demands, e.g. forecast by DemandForecaster, or
+# estimated by the recent requests if it is None.)
+def reposition_idle_vehicles_to_pending_orders_and_zone_deficits(reqs: ReqRegistry, vehs: list[Veh],
+                                                                 system_time_sec: int, num_of_new_reqs: int,
+                                                                 value_func: ValueFunction,
+                                                                 zone_demands: np.ndarray = None):
+    t = timer_start()
+
+    # 1. Get the targets of rebalancing, which are the unassigned pending orders (each taking one vehicle) and the
+    #    zones of demand deficits (each taking as many vehicles as its deficit).
+    pending_rids = reqs.get_rids_of_status(OrderStatus.PENDING)
+    if zone_demands is None:
+        zone_demands = compute_recent_demands_of_zones(reqs, system_time_sec)
+    zone_deficits = compute_demand_deficits_of_zones(zone_demands, vehs)
+    idle_vehs = [veh for veh in vehs if veh.status == VehicleStatus.IDLE]
+
+    if DEBUG_PRINT:
+        print(f"        -Repositioning {len(idle_vehs)} idle vehicles to {len(pending_rids)} pending orders and "
+              f"{int(zone_deficits.sum())} zone deficits through MCF...")
+
+    # 2. Reposition the idle vehicles to the targets.
+    deficit_zones = np.flatnonzero(zone_deficits > 0)
+    station_nids = np.array([get_vehicle_station_id(zone) for zone in range(get_num_of_vehicle_stations())],
+                            dtype=np.int64)
+    target_nids = np.concatenate([reqs.onid[np.array(pending_rids, dtype=np.int64)], station_nids[deficit_zones]])
+    target_capacities = np.concatenate([np.ones(len(pending_rids), dtype=np.int64), zone_deficits[deficit_zones]])
+    target_zones = np.concatenate([np.full(len(pending_rids), -1, dtype=np.int64), deficit_zones])
+    num_of_rebl_vehs = reposition_vehs_to_targets_through_min_cost_flow(idle_vehs, target_nids, target_capacities,
+                                                                        target_zones, system_time_sec)
+
+    if DEBUG_PRINT:
+        print(f"            +Rebalancing vehicles: {num_of_rebl_vehs} ({timer_end(t)})")
+
+
+# Estimate the demand of each zone in the near future by the number of requests received in the zone within the last
+# REBALANCING_DEMAND_WINDOW_MIN minutes.
+def compute_recent_demands_of_zones(reqs: ReqRegistry, system_time_sec: int) -> np.ndarray:
+    # (The requests are received in the order of their request times.)
+    Trs = reqs.Tr[:len(reqs)]
+    first_rid = int(np.searchsorted(Trs, system_time_sec - REBALANCING_DEMAND_WINDOW_MIN * 60))
+    zones = get_station_zones_of_nodes(reqs.onid[first_rid:len(reqs)])
+    return np.bincount(zones, minlength=get_num_of_vehicle_stations()).astype(np.float64)
+
+
+# Compute the deficit of each zone, i.e. its demand minus its supply, which is the number of the idle vehicles in the
+# zone and the rebalancing vehicles heading to the zone (the deficit is 0 if the supply is enough).
+def compute_demand_deficits_of_zones(zone_demands: np.ndarray, vehs: list[Veh]) -> np.ndarray:
+    supply_nids = [veh.nid for veh in vehs if veh.status == VehicleStatus.IDLE] \
+        + [veh.sche[0][2] for veh in vehs if veh.status == VehicleStatus.REBALANCING]
+    zone_supplies = np.bincount(get_station_zones_of_nodes(np.array(supply_nids, dtype=np.int64)),
+                                minlength=len(zone_demands))
+    return np.maximum(np.round(zone_demands - zone_supplies), 0).astype(np.int64)
+
+
+# Reposition the vehicles to the targets (nodes), each of which takes at most its capacity of vehicles, by solving
+# the transportation problem of sending as many vehicles as possible with the min total travel time, where a vehicle
+# only goes to the targets within REBALANCING_MAX_TRAVEL_TIME_SEC and not to the zone that it is already in (target
+# zone -1 means no zone). The vehicles at the same node are grouped into a source of their number, so the problem
+# has a source per node and a sink per target. Return the number of moved vehicles.
+def reposition_vehs_to_targets_through_min_cost_flow(vehs: list[Veh], target_nids: np.ndarray,
+                                                     target_capacities: np.ndarray, target_zones: np.ndarray,
+                                                     system_time_sec: int) -> int:
+    if len(vehs) == 0 or len(target_nids) == 0:
+        return 0
+
+    # 1. Group the vehicles by their nodes, and get the arcs from the nodes to the targets within the max travel time.
+    veh_nids = np.array([veh.nid for veh in vehs], dtype=np.int64)
+    source_nids, veh_source_idxs = np.unique(veh_nids, return_inverse=True)
+    rebl_dts = get_duration_matrix_from_origins_to_dests(source_nids, target_nids).astype(np.float64)
+    is_arc = (rebl_dts <= REBALANCING_MAX_TRAVEL_TIME_SEC) \
+        & (get_station_zones_of_nodes(source_nids)[:, np.newaxis] != target_zones[np.newaxis, :])
+    if not is_arc.any():
+        return 0
+    arc_costs = np.where(is_arc, rebl_dts, np.inf)
+
+    # 2. Solve the transportation problem.
+    flows = solve_min_cost_transportation_problem(arc_costs, np.bincount(veh_source_idxs), target_capacities)
+
+    # 3. Push the rebalancing tasks to the vehicles, where the vehicles of a source are sent in turn.
+    veh_idxs_of_sources = np.argsort(veh_source_idxs, kind="stable")
+    next_veh_ptr_of_sources = np.searchsorted(veh_source_idxs[veh_idxs_of_sources], np.arange(len(source_nids)))
+    source_idxs, target_idxs = np.nonzero(flows)
+    for source_idx, target_idx in zip(source_idxs.tolist(), target_idxs.tolist()):
+        rebl_dt = rebl_dts[source_idx, target_idx].item()
+        rebl_sche = ((-1, 0, int(target_nids[target_idx]), system_time_sec + rebl_dt + REBALANCING_DETOUR_SEC),)
+        for _ in range(int(flows[source_idx, target_idx])):
+            vehs[veh_idxs_of_sources[next_veh_ptr_of_sources[source_idx]]].build_route(rebl_sche)
+            next_veh_ptr_of_sources[source_idx] += 1
+
+    return int(flows.sum())
+
+
+# Solve the transportation problem of sending as many units as possible from the sources (each of its supply) to the
+# sinks (each of its capacity) with the min total cost, given the cost of each arc from a source to a sink (inf if no
+# arc), and return the flows as an array of the same shape as the costs. It is the min-cost flow from a super source
+# to a super sink through the supply arcs, the arcs between the sources and the sinks, and the capacity arcs, which is
+# solved by successive shortest paths. The units of the smaller side are sent source by source, each time along the
+# shortest augmenting path (by as many units as the path takes), which alternates between the sinks and the sources
+# sending flows to them. The path is found by Dijkstra's algorithm over the sinks, on the reduced costs given by the
+# potentials of the sinks, and it stops at the first sink with a spare capacity, which is the nearest free sink in
+# most cases. A dummy sink of unlimited capacity takes the units that cannot be sent, of which the cost exceeds the
+# total cost of the other units, so that sending more units always comes first.
+def solve_min_cost_transportation_problem(arc_costs: np.ndarray, supplies: np.ndarray,
+                                          capacities: np.ndarray) -> np.ndarray:
+    # 0. Send the units of the smaller side (as the sources), where the problem is transposed if it is the sinks.
+    if supplies.sum() > capacities.sum():
+        return solve_min_cost_transportation_problem(arc_costs.T, capacities, supplies).T
+    num_of_sources, num_of_sinks = arc_costs.shape
+    is_arc = np.isfinite(arc_costs)
+    if not is_arc.any():
+        return np.zeros(arc_costs.shape, dtype=np.int64)
+
+    # 1. Add the dummy sink, which is the last one.
+    dummy_cost = float(arc_costs[is_arc].max()) * (int(supplies.sum()) + 1) + 1.0
+    costs = np.concatenate([arc_costs, np.full((num_of_sources, 1), dummy_cost)], axis=1)
+    capacities = np.append(capacities, supplies.sum()).astype(np.int64)
+    flows = np.zeros(costs.shape, dtype=np.int64)
+    loads = np.zeros(num_of_sinks + 1, dtype=np.int64)
+    potentials = np.zeros(num_of_sinks + 1)
+
+    # 2. Send the units of the sources with arcs (the others cannot be sent).
+    for source_idx in np.flatnonzero(is_arc.any(axis=1)).tolist():
+        num_of_unsent_units = int(supplies[source_idx])
+        while num_of_unsent_units > 0:
+            # 2.1. Find the shortest path to a free sink, where each sink is reached from the source or from a sink
+            #      of which a source moves a unit of flow to it.
+            #      (The full sinks of which the flows are all from the source lead to nothing, which are taken as
+            #      scanned.)
+            dists = costs[source_idx] - potentials
+            is_scanned = (flows[source_idx] == loads) & (loads == capacities) & (loads > 0)
+            unscanned_dists = np.where(is_scanned, np.inf, dists)
+            pred_sources = np.full(num_of_sinks + 1, -1, dtype=np.int64)
+            pred_sinks = np.full(num_of_sinks + 1, -1, dtype=np.int64)
+            while True:
+                sink_idx = int(np.argmin(unscanned_dists))
+                if loads[sink_idx] < capacities[sink_idx]:
+                    break
+                is_scanned[sink_idx] = True
+                unscanned_dists[sink_idx] = np.inf
+                holder_idxs = np.flatnonzero(flows[:, sink_idx])
+                if len(holder_idxs) == 0:
+                    continue
+                # (The arcs of the flows are tight, i.e. of zero reduced costs.)
+                reduced_costs = costs[holder_idxs] - potentials \
+                    - (costs[holder_idxs, sink_idx] - potentials[sink_idx])[:, np.newaxis]
+                best_holders = np.argmin(reduced_costs, axis=0)
+                new_dists = dists[sink_idx] + reduced_costs[best_holders, np.arange(num_of_sinks + 1)]
+                is_improved = (new_dists < unscanned_dists) & ~is_scanned
+                dists[is_improved] = unscanned_dists[is_improved] = new_dists[is_improved]
+                pred_sources[is_improved] = holder_idxs[best_holders[is_improved]]
+                pred_sinks[is_improved] = sink_idx
+
+            # 2.2. Update the potentials of the scanned sinks, which keeps the reduced costs non-negative.
+            potentials += np.minimum(dists - dists[sink_idx], 0.0)
+
+            # 2.3. Augment the flows along the path, by as many units as it takes.
+            path_sink_idxs = [sink_idx]
+            while pred_sinks[path_sink_idxs[-1]] != -1:
+                path_sink_idxs.append(int(pred_sinks[path_sink_idxs[-1]]))
+            num_of_units = min(num_of_unsent_units, int(capacities[sink_idx] - loads[sink_idx]),
+                               *[int(flows[pred_sources[k], pred_sinks[k]]) for k in path_sink_idxs[:-1]])
+            loads[sink_idx] += num_of_units
+            for k in path_sink_idxs[:-1]:
+                flows[pred_sources[k], k] += num_of_units
+                flows[pred_sources[k], pred_sinks[k]] -= num_of_units
+            flows[source_idx, path_sink_idxs[-1]] += num_of_units
+            num_of_unsent_units -= num_of_units
+
+    return flows[:, :num_of_sinks]
@@ -5,15 +5,12 @@ rebalancing algorithm for the AMoD system
 from src.dispatcher.ilp_assign import *
 
 
-def reposition_idle_vehicles_to_nearest_pending_orders(reqs: list[Req], vehs: list[Veh], system_time_sec: int,
+def reposition_idle_vehicles_to_nearest_pending_orders(reqs: ReqRegistry, vehs: list[Veh], system_time_sec: int,
                                                        num_of_new_reqs: int, value_func: ValueFunction):
     t = timer_start()
 
     # 1. Get a list of the unassigned orders.
-    pending_rids = []
-    for req in reqs:
-        if req.status == OrderStatus.PENDING:
-            pending_rids.append(req.id)
+    pending_rids = reqs.get_rids_of_status(OrderStatus.PENDING)
 
     if DEBUG_PRINT:
         num_of_idle_vehs = 0
@@ -24,43 +21,63 @@ def reposition_idle_vehicles_to_nearest_pending_orders(reqs: list[Req], vehs: li
               f"{len(pending_rids)} locations through NPO...")
 
     # 2. Compute all rebalancing candidates.
-    rebl_veh_req_pairs = []
-    for rid in pending_rids:
-        req = reqs[rid]
-        for veh in vehs:
-            if veh.status != VehicleStatus.IDLE:
-                continue
-            rebl_dt = get_duration_from_origin_to_dest(veh.nid, req.onid)
-            detour_sec = 240  # A hyper parameter and 240 is probably not the best option.
-            #  A rebalancing vehicle is allowed to pick up new orders
-            #  if it can still visit the reposition waypoint with a small detour.
-            rebl_sche = [(-1, 0, req.onid, system_time_sec + rebl_dt + detour_sec)]
-            rebl_veh_req_pairs.append([veh, [req], rebl_sche, rebl_dt, -rebl_dt])
+    #    (The travel times from all idle vehicles to all pending orders are got in one table lookup. The candidate
+    #    of the i-th idle vehicle and the j-th pending order is scored by rebl_scores[i, j].)
+    idle_vehs = [veh for veh in vehs if veh.status == VehicleStatus.IDLE]
+    rebl_dts = get_duration_matrix_from_origins_to_dests([veh.nid for veh in idle_vehs],
+                                                         [reqs[rid].onid for rid in pending_rids])
+    rebl_scores = -rebl_dts
+    detour_sec = REBALANCING_DETOUR_SEC  # A hyper parameter and 240 is probably not the best option.
+    #  A rebalancing vehicle is allowed to pick up new orders
+    #  if it can still visit the reposition waypoint with a small detour.
 
     # # 000. Score the rebalancing task using value functions.
-    # if len(rebl_veh_req_pairs) > 1:
+    # if rebl_scores.size > 1:
+    #     rebl_veh_req_pairs = CandidateTable(vehs, reqs)
+    #     for j, rid in enumerate(pending_rids):
+    #         for i, veh in enumerate(idle_vehs):
+    #             rebl_dt = rebl_dts[i, j].item()
+    #             rebl_sche = ((-1, 0, reqs[rid].onid, system_time_sec + rebl_dt + detour_sec),)
+    #             rebl_veh_req_pairs.add_pair(veh.id, [rid], rebl_sche, rebl_dt, -rebl_dt)
+    #     rebl_veh_req_pairs.build_arrays()
     #     expected_values = value_func.compute_expected_values_for_veh_trip_pairs(num_of_new_reqs, vehs,
     #                                                                             rebl_veh_req_pairs, system_time_sec)
-    #     for idx, vr_pair in enumerate(rebl_veh_req_pairs):
-    #         vr_pair[4] = expected_values[idx]
+    #     rebl_scores = np.array(expected_values).reshape(len(pending_rids), len(idle_vehs)).T
 
     # 3. Select suitable rebalancing candidates. Greedily from the one with the shortest travel time.
-    rebl_veh_req_pairs.sort(key=lambda e: -e[4])
-    selected_vids = []
-    selected_rids = []
-    for [veh, [req], sche, cost, score] in rebl_veh_req_pairs:
+    #    (A selected candidate is among the best num_of_selections ones of its vehicle and of its order, since each
+    #    better one was skipped for another selected candidate. So only those are sorted, along the longer dimension.)
+    num_of_selections = min(len(idle_vehs), len(pending_rids))
+    is_kept = np.ones(rebl_scores.shape, dtype=bool)
+    if len(idle_vehs) > len(pending_rids) > 0:
+        kth_scores = -np.partition(-rebl_scores, num_of_selections - 1, axis=0)[num_of_selections - 1]
+        is_kept = rebl_scores >= kth_scores[np.newaxis, :]
+    elif len(pending_rids) > len(idle_vehs) > 0:
+        kth_scores = -np.partition(-rebl_scores, num_of_selections - 1, axis=1)[:, num_of_selections - 1]
+        is_kept = rebl_scores >= kth_scores[:, np.newaxis]
+    veh_idxs, req_idxs = np.nonzero(is_kept)
+    order = np.lexsort((veh_idxs, req_idxs, -rebl_scores[veh_idxs, req_idxs]))
+    is_veh_selected = np.zeros(len(idle_vehs), dtype=bool)
+    is_req_selected = np.zeros(len(pending_rids), dtype=bool)
+    num_of_selected_vehs = 0
+    for i, j in zip(veh_idxs[order].tolist(), req_idxs[order].tolist()):
+        if num_of_selected_vehs == num_of_selections:
+            break
         # Check if the vehicle has been selected to do a rebalancing task.
-        if veh.id in selected_vids:
+        if is_veh_selected[i]:
             continue
         # Check if the visiting point in the current rebalancing task has been visited.
-        if req.id in selected_rids:
+        if is_req_selected[j]:
             continue
-        selected_vids.append(veh.id)
-        selected_rids.append(req.id)
+        is_veh_selected[i] = True
+        is_req_selected[j] = True
+        num_of_selected_vehs += 1
 
         # 4. Push the rebalancing task to the assigned vehicle.
-        veh.build_route(sche)
+        rebl_dt = rebl_dts[i, j].item()
+        rebl_sche = ((-1, 0, reqs[pending_rids[j]].onid, system_time_sec + rebl_dt + detour_sec),)
+        idle_vehs[i].build_route(rebl_sche)
 
     if DEBUG_PRINT:
-        print(f"            +Rebalancing vehicles: {len(selected_vids)} ({timer_end(t)})")
+        print(f"            +Rebalancing vehicles: {num_of_selected_vehs} ({timer_end(t)})")
 
@@ -15,6 +15,10 @@ PATH_TO_NETWORK_NODES = f"{ROOT_PATH}/datalog-gitignore/map-data/nodes.pickle"
 PATH_TO_SHORTEST_PATH_TABLE = f"{ROOT_PATH}/datalog-gitignore/map-data/path-table.pickle"
 PATH_TO_MEAN_TRAVEL_TIME_TABLE = f"{ROOT_PATH}/datalog-gitignore/map-data/mean-table.pickle"
 PATH_TO_TRAVEL_DISTANCE_TABLE = f"{ROOT_PATH}/datalog-gitignore/map-data/dist-table.pickle"
+# (the three tables above in one memory-mapped binary file, used instead of the pickle files if it exists)
+PATH_TO_MAP_TABLES = f"{ROOT_PATH}/datalog-gitignore/map-data/map-tables.bin"
+# max number of recovered paths kept in memory by the route functions (least recently used ones are dropped)
+PATH_CACHE_SIZE = 20000
 
 # taxi-data
 # SIMULATION_DAYs = ["03", "04", "05", "10", "11", "12", "17", "18", "19"]
@@ -31,7 +35,38 @@ PARTIAL_PATH_TO_REPLAY_BUFFER_DATA = f"{ROOT_PATH}/datalog-gitignore/value-func-
 ##################################################################################
 # dispatch_config
 DISPATCHER = "OSP"        # 3 options: SBA, OSP-NR, OSP
-REBALANCER = "NPO"        # 2 options: NONE, NPO
+REBALANCER = "NPO"        # 4 options: NONE, NPO, MCF, MCF-P
+# number of worker processes searching the vehicles' feasible trips in OSP (1: search in the main process)
+DISPATCH_NUM_OF_WORKERS = 1
+# max number of insertion evaluations spent on searching trips of size k >= 2 in OSP, per vehicle and per epoch
+# (the budget of each vehicle is the smaller one of the former and its even share of the latter)
+OSP_TRIP_SEARCH_BUDGET_PER_VEH = 10000
+OSP_TRIP_SEARCH_BUDGET_PER_EPOCH = 15000000
+# solver of the assignment ILP in SBA and OSP: GUROBI (needs gurobipy), HIGHS (needs highspy), or AUTO (GUROBI if
+# gurobipy is installed, otherwise HIGHS)
+ASSIGNMENT_BACKEND = "AUTO"
+# solve the LP relaxation of the assignment ILP and round it to an assignment, instead of solving the ILP
+# (much faster for large instances, while the assignment may be suboptimal, see the reported optimality gap)
+ASSIGNMENT_LP_RELAXATION = False
+# max running time of solving the assignment per epoch (s), including getting the initial solution (the current or
+# the greedy assignment), splitting the model and loading it into the solver, after which the best assignment found
+# so far is used
+# (None: no limit; the solver may still run over it by its own overhead, which is reported)
+ASSIGNMENT_TIME_LIMIT_SEC = None
+# number of worker processes solving the independent components of the assignment ILP (1: solve in the main process)
+ASSIGNMENT_NUM_OF_WORKERS = 1
+# detour time (s) allowed for a rebalancing vehicle to pick up new orders before it reaches its target
+REBALANCING_DETOUR_SEC = 240
+# max travel time (s) of a rebalancing vehicle to its target (a pending order or a zone of demand deficit) in MCF
+REBALANCING_MAX_TRAVEL_TIME_SEC = 600
+# the near future demand of each zone (the area nearest to a vehicle station) in the next time window (min) is
+# estimated by the requests received in the zone within the last time window in MCF, or forecast in MCF-P
+REBALANCING_DEMAND_WINDOW_MIN = 5
+# the historical taxi data files (the same weekdays of the week before the simulated days), of which the average
+# requests of each zone in each time bin (min) are the demand forecast in MCF-P (they need to be converted by
+# data_serializer.py as the simulated days)
+DEMAND_FORECAST_TAXI_DATA_FILEs = [f"201605{day}-peak" for day in ["18", "19"]]
+DEMAND_FORECAST_BIN_MIN = 5
 
 # fleet_config:
 FLEET_SIZE = [1500]
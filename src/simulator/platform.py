@@ -2,13 +2,16 @@
 main structure for the AMoD simulator
 """
 
-from src.simulator.request import Req
-from src.simulator.vehicle import Veh
+from src.simulator.request import ReqRegistry, DemandGenerator
+from src.simulator.vehicle import Fleet
 from src.simulator.route_functions import *
 
 from src.dispatcher.dispatch_sba import assign_orders_through_sba
-from src.dispatcher.dispatch_osp import assign_orders_through_osp
+from src.dispatcher.dispatch_osp import assign_orders_through_osp, TRIP_SEARCH_STATS
+from src.dispatcher.ilp_assign import ASSIGNMENT_REPORTS
 from src.rebalancer.rebalancing_npo import reposition_idle_vehicles_to_nearest_pending_orders
+from src.rebalancer.rebalancing_mcf import reposition_idle_vehicles_to_pending_orders_and_zone_deficits
+from src.rebalancer.demand_forecaster import DemandForecaster
 from src.value_function.value_function import ValueFunction
 
 
@@ -17,22 +20,30 @@ class Platform(object):
     Model is the initial class for the AMoD system
     Attributes:
         system_time_sec: system time at current state
+        fleet: the states of all vehicles, stored as arrays
         vehs: the list of vehicles
-        reqs: the list of all received requests
-        reqs_data: the list of collected real taxi requests data
-        req_init_idx: init index to read reqs_data
+        reqs: the list of all received requests, indexed by status (ReqRegistry)
+        demand_generator: the replayer of the collected real taxi requests data
+        demand_forecaster: the forecast of the demand of each zone, built from historical taxi data (only for MCF-P)
         dispatcher: the algorithm used to do the dispatching
         rebalancer: the algorithm used to do the rebalancing
+        road_network: the map data used by the route functions during the simulation
 
     """
 
     def __init__(self, taxi_data_file: str,
                  value_func: ValueFunction,
-                 simulation_start_time_stamp: datetime):
+                 simulation_start_time_stamp: datetime,
+                 road_network: RoadNetwork = None):
         t = timer_start()
         self.taxi_data_file = taxi_data_file
         self.value_func = value_func
 
+        # Use the given road network (e.g. a network variant), otherwise the default one of the route functions.
+        if road_network is not None:
+            set_road_network(road_network)
+        self.road_network = get_road_network()
+
         # Initialize the simulation times.
         self.system_time_sec = 0
         self.main_sim_start_time_sec = self.system_time_sec + WARMUP_DURATION_MIN * 60
@@ -46,23 +57,19 @@ class Platform(object):
                 and "[ERROR] WRONG TIME SETTING! Please check the simulation start time or duration in config!")
 
         # Initialize the fleet.
-        self.vehs = []
+        vehs_nid = []
         num_of_stations = get_num_of_vehicle_stations()
         for i in range(FLEET_SIZE[0]):
             station_idx = int(i * num_of_stations / FLEET_SIZE[0])
-            nid = get_vehicle_station_id(station_idx)
-            [lng, lat] = get_node_geo(nid)
-            self.vehs.append(Veh(i, nid, lng, lat, VEH_CAPACITY[0], self.system_time_sec))
+            vehs_nid.append(get_vehicle_station_id(station_idx))
+        self.fleet = Fleet(vehs_nid, VEH_CAPACITY[0], self.system_time_sec)
+        self.vehs = self.fleet.vehs
 
         # Initialize the demand generator.
-        self.reqs = []
+        self.reqs = ReqRegistry()
         t = timer_start()
-        with open(f"{PARTIAL_PATH_TO_TAXI_DATA}{self.taxi_data_file}.pickle", "rb") as f:
-            self.reqs_data = pickle.load(f)
-        self.req_init_time_sec = compute_the_accumulated_seconds_from_0_clock(SIMULATION_START_TIME)
-        self.req_init_idx = 0
-        while self.reqs_data[self.req_init_idx].request_time_sec < self.req_init_time_sec:
-            self.req_init_idx += 1
+        self.demand_generator = DemandGenerator(self.taxi_data_file,
+                                                compute_the_accumulated_seconds_from_0_clock(SIMULATION_START_TIME))
         print(f"[INFO] Demand Generator is ready. ({timer_end(t)})")
 
         # Initialize the dispatcher and the rebalancer.
@@ -78,9 +85,21 @@ class Platform(object):
             self.rebalancer = RebalancerMethod.NONE
         elif REBALANCER == "NPO":
             self.rebalancer = RebalancerMethod.NPO
+        elif REBALANCER == "MCF":
+            self.rebalancer = RebalancerMethod.MCF
+        elif REBALANCER == "MCF-P":
+            self.rebalancer = RebalancerMethod.MCF_P
         else:
             assert (False and "[ERROR] WRONG REBALANCER SETTING! Please check the name of rebalancer in config!")
 
+        # Initialize the demand forecaster (only used by MCF-P).
+        self.demand_forecaster = None
+        if self.rebalancer == RebalancerMethod.MCF_P:
+            t_forecaster = timer_start()
+            self.demand_forecaster = DemandForecaster(
+                DEMAND_FORECAST_TAXI_DATA_FILEs, compute_the_accumulated_seconds_from_0_clock(SIMULATION_START_TIME))
+            print(f"[INFO] Demand Forecaster is ready. ({timer_end(t_forecaster)})")
+
         # System report about running time.
         self.time_of_init = get_runtime_sec_from_t_to_now(simulation_start_time_stamp)
         self.start_time_stamp = get_time_stamp_datetime()
@@ -102,6 +121,8 @@ class Platform(object):
     def run_simulation(self) -> list:
         # Frames record the states of the AMoD model for animation purpose
         frames_system_states = []
+        # (Another platform in the same process may have switched the road network used by the route functions.)
+        set_road_network(self.road_network)
 
         if DEBUG_PRINT:
             for epoch_start_time_sec in range(0, self.system_shutdown_time_sec, CYCLE_S[0]):
@@ -164,23 +185,24 @@ class Platform(object):
         if self.rebalancer == RebalancerMethod.NPO:
             reposition_idle_vehicles_to_nearest_pending_orders(self.reqs, self.vehs, self.system_time_sec,
                                                                len(new_received_rids), self.value_func)
+        elif self.rebalancer == RebalancerMethod.MCF:
+            reposition_idle_vehicles_to_pending_orders_and_zone_deficits(self.reqs, self.vehs, self.system_time_sec,
+                                                                         len(new_received_rids), self.value_func)
+        elif self.rebalancer == RebalancerMethod.MCF_P:
+            zone_demands = self.demand_forecaster.get_expected_demands_of_zones(self.system_time_sec,
+                                                                                REBALANCING_DEMAND_WINDOW_MIN * 60)
+            reposition_idle_vehicles_to_pending_orders_and_zone_deficits(self.reqs, self.vehs, self.system_time_sec,
+                                                                         len(new_received_rids), self.value_func,
+                                                                         zone_demands)
 
         # 5. Check the statuses of orders, to make sure that no one is assigned to multiple vehicles.
         if DEBUG_PRINT:
             num_of_total_orders = len(self.reqs)
-            num_of_completed_orders = num_of_onboard_orders = num_of_picking_orders \
-                = num_of_pending_orders = num_of_walkaway_orders = 0
-            for req in self.reqs:
-                if req.status == OrderStatus.COMPLETE:
-                    num_of_completed_orders += 1
-                elif req.status == OrderStatus.ONBOARD:
-                    num_of_onboard_orders += 1
-                elif req.status == OrderStatus.PICKING:
-                    num_of_picking_orders += 1
-                elif req.status == OrderStatus.PENDING:
-                    num_of_pending_orders += 1
-                elif req.status == OrderStatus.WALKAWAY:
-                    num_of_walkaway_orders += 1
+            num_of_completed_orders = self.reqs.num_of_reqs_of_status[OrderStatus.COMPLETE]
+            num_of_onboard_orders = self.reqs.num_of_reqs_of_status[OrderStatus.ONBOARD]
+            num_of_picking_orders = self.reqs.num_of_reqs_of_status[OrderStatus.PICKING]
+            num_of_pending_orders = self.reqs.num_of_reqs_of_status[OrderStatus.PENDING]
+            num_of_walkaway_orders = self.reqs.num_of_reqs_of_status[OrderStatus.WALKAWAY]
             assert (num_of_total_orders == num_of_completed_orders + num_of_onboard_orders + num_of_picking_orders
                     + num_of_pending_orders + num_of_walkaway_orders)
             num_of_onboard_orders_from_vehicle_schedule = num_of_picking_orders_from_vehicle_schedule = \
@@ -215,22 +237,18 @@ class Platform(object):
         if DEBUG_PRINT:
             print(f"        -Updating vehicles positions and orders status by {CYCLE_S[0]}s...")
 
-        # Advance the vehicles by the whole cycle.
-        for veh in self.vehs:
-            done = veh.move_to_time(self.system_time_sec,
-                                    verify_the_current_epoch_is_in_the_main_study_horizon(self.system_time_sec))
-            for (rid, pod, time_of_arrival) in done:
-                if pod == 1:
-                    self.reqs[rid].update_pick_info(time_of_arrival)
-                elif pod == -1:
-                    self.reqs[rid].update_drop_info(time_of_arrival)
+        # Advance the whole fleet by the cycle.
+        done = self.fleet.move_to_time(self.system_time_sec,
+                                       verify_the_current_epoch_is_in_the_main_study_horizon(self.system_time_sec))
+        for (vid, rid, pod, time_of_arrival) in done:
+            if pod == 1:
+                self.reqs[rid].update_pick_info(time_of_arrival)
+            elif pod == -1:
+                self.reqs[rid].update_drop_info(time_of_arrival)
 
         # Reject the long waited orders.
-        for req in self.reqs:
-            if req.status != OrderStatus.PENDING:
-                continue
-            if self.system_time_sec >= req.Tr + 150 or self.system_time_sec >= req.Clp:
-                req.status = OrderStatus.WALKAWAY
+        for rid in self.reqs.get_pending_rids_past_walkaway_time(self.system_time_sec):
+            self.reqs[rid].status = OrderStatus.WALKAWAY
 
         if DEBUG_PRINT:
             noi = 0  # number of idle vehicles at the end of the current epoch
@@ -255,23 +273,12 @@ class Platform(object):
             print(f"        -Loading new orders submitted during "
                   f"{self.system_time_sec - CYCLE_S[0]}s ≤ T < {self.system_time_sec}s...")
 
-        new_received_rids = []
-        current_request_count = len(self.reqs)
-        new_raw_req_idx = self.req_init_idx + int(current_request_count / REQUEST_DENSITY)
-        while self.reqs_data[new_raw_req_idx].request_time_sec < self.system_time_sec + self.req_init_time_sec:
-            new_raw_req = self.reqs_data[new_raw_req_idx]
-            req_id = current_request_count
-            req_Tr = new_raw_req.request_time_sec - self.req_init_time_sec
-            req_onid = new_raw_req.origin_node_id
-            req_dnid = new_raw_req.destination_node_id
-            req = Req(req_id, req_Tr, req_onid, req_dnid)
-            current_request_count += 1
-            new_raw_req_idx = self.req_init_idx + int(current_request_count / REQUEST_DENSITY)
-            new_received_rids.append(len(self.reqs))
-            self.reqs.append(req)
-
-            # if DEBUG_PRINT:
-            #     print(f"            Received req #{req_id} at T = {req_Tr}s, from {req_onid} to {req_dnid}")
+        new_Trs, new_onids, new_dnids = self.demand_generator.gen_reqs_before_time(self.system_time_sec)
+        new_received_rids = self.reqs.add_reqs(new_Trs, new_onids, new_dnids)
+        # if DEBUG_PRINT:
+        #     for rid in new_received_rids:
+        #         req = self.reqs[rid]
+        #         print(f"            Received req #{req.id} at T = {req.Tr}s, from {req.onid} to {req.dnid}")
 
         if DEBUG_PRINT:
             print(f"            +Orders new received: {len(new_received_rids)} ({timer_end(t)})")
@@ -328,6 +335,36 @@ class Platform(object):
               f"Time: {total_sim_runtime_formatted}.")
         print(f"  - Main Simulation: init_time = {self.time_of_init:.2f} s, runtime = {main_sim_runtime_formatted}, "
               f"avg_time = {main_sim_runtime_s / num_of_main_epochs:.2f} s.")
+        num_of_path_lookups = self.road_network.path_cache_hits + self.road_network.path_cache_misses
+        if num_of_path_lookups > 0:
+            print(f"  - Path Cache: hit_rate = {100.0 * self.road_network.path_cache_hits / num_of_path_lookups:.2f}% "
+                  f"({self.road_network.path_cache_hits}/{num_of_path_lookups}), "
+                  f"size = {len(self.road_network.path_cache)}/{self.road_network.path_cache_size}.")
+        if TRIP_SEARCH_STATS["num_of_searches"] > 0:
+            print(f"  - Trip Search: budget_hit_rate = "
+                  f"{100.0 * TRIP_SEARCH_STATS['num_of_budget_hits'] / TRIP_SEARCH_STATS['num_of_searches']:.2f}% "
+                  f"({TRIP_SEARCH_STATS['num_of_budget_hits']}/{TRIP_SEARCH_STATS['num_of_searches']}), "
+                  f"avg_insertions = "
+                  f"{TRIP_SEARCH_STATS['num_of_insertion_evaluations'] / TRIP_SEARCH_STATS['num_of_searches']:.0f}.")
+        if len(ASSIGNMENT_REPORTS) > 0:
+            times_sec = [report["build_time_sec"] + report["solve_time_sec"] for report in ASSIGNMENT_REPORTS]
+            start_times_sec = [report["start_time_sec"] for report in ASSIGNMENT_REPORTS]
+            # (The epochs of unknown gaps are left out of the gaps, and counted separately.)
+            gaps = np.array([report["gap"] for report in ASSIGNMENT_REPORTS])
+            known_gaps = gaps[np.isfinite(gaps)]
+            gap_info = "avg_gap = max_gap = N/A"
+            if len(known_gaps) > 0:
+                gap_info = f"avg_gap = {100.0 * np.mean(known_gaps):.2f}%, max_gap = {100.0 * np.max(known_gaps):.2f}%"
+            print(f"  - Assignment: backend = {ASSIGNMENT_REPORTS[-1]['backend']} ({ASSIGNMENT_REPORTS[-1]['mode']}), "
+                  f"avg_time = {np.mean(times_sec):.3f} s (start = {np.mean(start_times_sec):.3f} s), "
+                  f"max_time = {np.max(times_sec):.3f} s, {gap_info} "
+                  f"(unknown in {len(gaps) - len(known_gaps)}/{len(gaps)} epochs).")
+            if ASSIGNMENT_TIME_LIMIT_SEC is not None:
+                overruns_sec = np.array([report["solve_time_sec"] for report in ASSIGNMENT_REPORTS]) \
+                    - ASSIGNMENT_TIME_LIMIT_SEC
+                print(f"  - Assignment Time Limit: {ASSIGNMENT_TIME_LIMIT_SEC} s, exceeded in "
+                      f"{int((overruns_sec > 0).sum())}/{len(overruns_sec)} epochs, "
+                      f"max_overrun = {max(np.max(overruns_sec), 0.0):.3f} s.")
 
         # Print the platform configurations.
         print("# System Configurations")
@@ -342,35 +379,21 @@ class Platform(object):
 
     def report_simulation_result(self, show: bool = True):
         # 1. Report order status.
-        req_count = 0
-        walkaway_req_count = 0
-        complete_req_count = 0
-        onboard_req_count = 0
-        picking_req_count = 0
-        pending_req_count = 0
-        total_wait_time_sec = 0
-        total_delay_time_sec = 0
-        total_req_time_sec = 0
-
-        for req in self.reqs:
-            if req.Tr <= self.main_sim_start_time_sec:
-                continue
-            if req.Tr > self.main_sim_end_time_sec:
-                break
-            req_count += 1
-            if req.status == OrderStatus.WALKAWAY:
-                walkaway_req_count += 1
-            elif req.status == OrderStatus.COMPLETE:
-                complete_req_count += 1
-                total_wait_time_sec += req.Tp - req.Tr
-                total_delay_time_sec += req.Td - (req.Tr + req.Ts)
-                total_req_time_sec += req.Ts
-            elif req.status == OrderStatus.ONBOARD:
-                onboard_req_count += 1
-            elif req.status == OrderStatus.PICKING:
-                picking_req_count += 1
-            elif req.status == OrderStatus.PENDING:
-                pending_req_count += 1
+        num_of_reqs = len(self.reqs)
+        Tr = self.reqs.Tr[:num_of_reqs]
+        status = self.reqs.status[:num_of_reqs]
+        is_main = (Tr > self.main_sim_start_time_sec) & (Tr <= self.main_sim_end_time_sec)
+        is_complete = is_main & (status == OrderStatus.COMPLETE.value)
+        req_count = int(is_main.sum())
+        walkaway_req_count = int((is_main & (status == OrderStatus.WALKAWAY.value)).sum())
+        complete_req_count = int(is_complete.sum())
+        onboard_req_count = int((is_main & (status == OrderStatus.ONBOARD.value)).sum())
+        picking_req_count = int((is_main & (status == OrderStatus.PICKING.value)).sum())
+        pending_req_count = int((is_main & (status == OrderStatus.PENDING.value)).sum())
+        Ts = self.reqs.Ts[:num_of_reqs][is_complete]
+        total_wait_time_sec = float((self.reqs.Tp[:num_of_reqs][is_complete] - Tr[is_complete]).sum())
+        total_delay_time_sec = float((self.reqs.Td[:num_of_reqs][is_complete] - (Tr[is_complete] + Ts)).sum())
+        total_req_time_sec = float(Ts.sum())
 
         service_req_count = complete_req_count + onboard_req_count
         self.main_sim_result = [service_req_count, req_count, round(100.0 * service_req_count / req_count, 2)]
@@ -393,24 +416,14 @@ class Platform(object):
             print("  [PLEASE USE LONGER SIMULATION DURATION TO BE ABLE TO COMPLETE ORDERS!]")
 
         # 2. Report veh status.
-        total_dist_traveled = 0
-        total_loaded_dist_traveled = 0
-        total_empty_dist_traveled = 0
-        total_rebl_dist_traveled = 0
-        total_time_traveled_sec = 0
-        total_loaded_time_traveled_sec = 0
-        total_empty_time_traveled_sec = 0
-        total_rebl_time_traveled_sec = 0
-
-        for veh in self.vehs:
-            total_dist_traveled += veh.Ds
-            total_loaded_dist_traveled += veh.Ld
-            total_empty_dist_traveled += veh.Ds_empty
-            total_rebl_dist_traveled += veh.Dr
-            total_time_traveled_sec += veh.Ts
-            total_loaded_time_traveled_sec += veh.Lt
-            total_empty_time_traveled_sec += veh.Ts_empty
-            total_rebl_time_traveled_sec += veh.Tr
+        total_dist_traveled = float(self.fleet.Ds.sum())
+        total_loaded_dist_traveled = float(self.fleet.Ld.sum())
+        total_empty_dist_traveled = float(self.fleet.Ds_empty.sum())
+        total_rebl_dist_traveled = float(self.fleet.Dr.sum())
+        total_time_traveled_sec = float(self.fleet.Ts.sum())
+        total_loaded_time_traveled_sec = float(self.fleet.Lt.sum())
+        total_empty_time_traveled_sec = float(self.fleet.Ts_empty.sum())
+        total_rebl_time_traveled_sec = float(self.fleet.Tr.sum())
 
         avg_dist_traveled_km = total_dist_traveled / 1000.0 / FLEET_SIZE[0]
         avg_empty_dist_traveled_km = total_empty_dist_traveled / 1000.0 / FLEET_SIZE[0]
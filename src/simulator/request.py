@@ -2,14 +2,19 @@
 definition of requests for the AMoD system
 """
 
+import heapq
+
 from src.simulator.route_functions import *
 
 
 class Req(object):
     """
     Req is a class for requests
+    (The data of a request are stored in the columns of its registry, indexed by id.)
     Attributes:
+        registry: the registry (ReqRegistry) of all requests, which stores the data of each request
         id: sequential unique id
+        status: pending, picking, onboard, complete and walkaway
         Tr: request time
         onid: nearest origin node id in network
         dnid: nearest destination node id in network
@@ -22,23 +27,39 @@ class Req(object):
         D: detour factor
     """
 
-    def __init__(self, id: int, Tr: int, onid: int, dnid: int):
+    __slots__ = ("registry", "id")
+
+    Tr = ArrayAttribute("registry")
+    onid = ArrayAttribute("registry")
+    dnid = ArrayAttribute("registry")
+    Ts = ArrayAttribute("registry")
+    Ds = ArrayAttribute("registry")
+    Clp = ArrayAttribute("registry")
+    Cld = ArrayAttribute("registry")
+    Tp = ArrayAttribute("registry")
+    Td = ArrayAttribute("registry")
+
+    def __init__(self, registry, id: int):
+        self.registry = registry
         self.id = id
-        self.status = OrderStatus.PENDING
-        self.Tr = Tr
-        self.onid = onid
-        self.dnid = dnid
-        self.Ts = get_duration_from_origin_to_dest(self.onid, self.dnid)
-        self.Ds = get_distance_from_origin_to_dest(self.onid, self.dnid)
-        self.Clp = Tr + MAX_PICKUP_WAIT_TIME_MIN[0] * 60
-        self.Cld = Tr + self.Ts + MAX_PICKUP_WAIT_TIME_MIN[0] * 60 * 2
-        # self.Clp = Tr + min(MAX_PICKUP_WAIT_TIME_MIN[0] * 60, self.Ts * (2 - MAX_ONBOARD_DETOUR))
-        # self.Cld = \
-        #     Tr + self.Ts + min(MAX_PICKUP_WAIT_TIME_MIN[0] * 60 * 2, self.Clp - Tr + self.Ts * (MAX_ONBOARD_DETOUR - 1))
-        self.Clp_backup = self.Clp
-        self.Tp = -1.0
-        self.Td = -1.0
-        self.D = 0.0
+
+    @property
+    def status(self) -> OrderStatus:
+        return OrderStatus(int(self.registry.status[self.id]))
+
+    @status.setter
+    def status(self, status: OrderStatus):
+        self.registry.update_status(self.id, status)
+
+    @property
+    def D(self) -> float:
+        if self.Td == -1.0:
+            return 0.0
+        return (self.Td - self.Tp) / self.Ts
+
+    # (A request is the same entity wherever it appears, e.g. in copied vehicle trip pairs, so it is never copied.)
+    def __deepcopy__(self, memo):
+        return self
 
     def update_pick_info(self, t: int):
         self.Tp = t
@@ -51,6 +72,203 @@ class Req(object):
 
     def update_drop_info(self, t: int):
         self.Td = t
-        self.D = (self.Td - self.Tp) / self.Ts
         assert(self.status == OrderStatus.ONBOARD)
         self.status = OrderStatus.COMPLETE
+
+
+class ReqRegistry(list):
+    """
+    ReqRegistry is the list of all received requests (indexed by id), which stores the data of the requests in
+    columns (arrays indexed by id) and also indexes the requests by status, so that finding the active (pending,
+    picking or onboard) requests does not need to scan all requests
+    Attributes:
+        capacity: number of requests that the columns can hold before they are enlarged
+        Tr, onid, dnid, Ts, Ds, Clp, Cld, Tp, Td: columns of the request data (see Req)
+        status: status of each request (value of OrderStatus)
+        rids_of_status: ids of the requests of each active status
+        num_of_reqs_of_status: number of requests of each status
+        walkaway_heap: a heap of (walkaway_time, rid), where a pending request walks away after its walkaway_time
+        rids_past_walkaway_time: ids of requests past their walkaway time, which are picking but may become pending
+            again (when they are reassigned through reoptimization)
+    """
+
+    column_dtypes = {"Tr": np.int64, "onid": np.int64, "dnid": np.int64, "Ts": np.float64, "Ds": np.float64,
+                     "Clp": np.float64, "Cld": np.float64, "Tp": np.float64, "Td": np.float64, "status": np.int8}
+
+    def __init__(self, capacity: int = 1024):
+        super().__init__()
+        self.capacity = capacity
+        for name, dtype in self.column_dtypes.items():
+            setattr(self, name, np.zeros(capacity, dtype=dtype))
+        self.rids_of_status = {OrderStatus.PENDING: set(), OrderStatus.PICKING: set(), OrderStatus.ONBOARD: set()}
+        self.num_of_reqs_of_status = {status: 0 for status in OrderStatus}
+        self.walkaway_heap = []
+        self.rids_past_walkaway_time = set()
+
+    # enlarge the columns (by doubling the capacity) so that they can hold num_of_reqs requests
+    def reserve(self, num_of_reqs: int):
+        if num_of_reqs <= self.capacity:
+            return
+        while self.capacity < num_of_reqs:
+            self.capacity *= 2
+        for name in self.column_dtypes:
+            column = getattr(self, name)
+            new_column = np.zeros(self.capacity, dtype=column.dtype)
+            new_column[:len(self)] = column[:len(self)]
+            setattr(self, name, new_column)
+
+    # create a new pending request and add it to the registry
+    def add_req(self, Tr: int, onid: int, dnid: int) -> Req:
+        rid = self.add_reqs([Tr], [onid], [dnid])[0]
+        return self[rid]
+
+    # create new pending requests in one batch (the data of the i-th request given by the i-th elements of the arrays)
+    # and add them to the registry, returning their ids
+    def add_reqs(self, Trs: np.ndarray, onids: np.ndarray, dnids: np.ndarray) -> list[int]:
+        # 1. Compute the data of the new requests.
+        Trs = np.asarray(Trs, dtype=np.int64)
+        onids = np.asarray(onids, dtype=np.int64)
+        dnids = np.asarray(dnids, dtype=np.int64)
+        num_of_new_reqs = len(Trs)
+        if num_of_new_reqs == 0:
+            return []
+        Ts = get_durations_from_origins_to_dests(onids, dnids)
+        Ds = get_distances_from_origins_to_dests(onids, dnids)
+        Clp = Trs + MAX_PICKUP_WAIT_TIME_MIN[0] * 60
+        Cld = Trs + Ts + MAX_PICKUP_WAIT_TIME_MIN[0] * 60 * 2
+        # Clp = Trs + np.minimum(MAX_PICKUP_WAIT_TIME_MIN[0] * 60, Ts * (2 - MAX_ONBOARD_DETOUR))
+        # Cld = Trs + Ts + np.minimum(MAX_PICKUP_WAIT_TIME_MIN[0] * 60 * 2, Clp - Trs + Ts * (MAX_ONBOARD_DETOUR - 1))
+
+        # 2. Write the data into the columns.
+        first_rid = len(self)
+        end_rid = first_rid + num_of_new_reqs
+        self.reserve(end_rid)
+        self.Tr[first_rid:end_rid] = Trs
+        self.onid[first_rid:end_rid] = onids
+        self.dnid[first_rid:end_rid] = dnids
+        self.Ts[first_rid:end_rid] = Ts
+        self.Ds[first_rid:end_rid] = Ds
+        self.Clp[first_rid:end_rid] = Clp
+        self.Cld[first_rid:end_rid] = Cld
+        self.Tp[first_rid:end_rid] = -1.0
+        self.Td[first_rid:end_rid] = -1.0
+        self.status[first_rid:end_rid] = OrderStatus.PENDING.value
+
+        # 3. Create the request objects and index the new requests.
+        new_rids = list(range(first_rid, end_rid))
+        self.extend(Req(self, rid) for rid in new_rids)
+        self.rids_of_status[OrderStatus.PENDING].update(new_rids)
+        self.num_of_reqs_of_status[OrderStatus.PENDING] += num_of_new_reqs
+        # A pending request walks away if it has waited for 150 s or has passed its latest pickup time.
+        for walkaway_time, rid in zip(np.minimum(Trs + 150, Clp).tolist(), new_rids):
+            heapq.heappush(self.walkaway_heap, (walkaway_time, rid))
+        return new_rids
+
+    def update_status(self, rid: int, status: OrderStatus):
+        old_status = OrderStatus(int(self.status[rid]))
+        if old_status == status:
+            return
+        self.status[rid] = status.value
+        self.num_of_reqs_of_status[old_status] -= 1
+        self.num_of_reqs_of_status[status] += 1
+        if old_status in self.rids_of_status:
+            self.rids_of_status[old_status].remove(rid)
+        if status in self.rids_of_status:
+            self.rids_of_status[status].add(rid)
+
+    # get the ids of the requests of the given statuses, in ascending order
+    def get_rids_of_status(self, *statuses: OrderStatus) -> list[int]:
+        rids = []
+        for status in statuses:
+            rids.extend(self.rids_of_status[status])
+        rids.sort()
+        return rids
+
+    # get the ids of the pending requests that should walk away at time T
+    def get_pending_rids_past_walkaway_time(self, system_time_sec: int) -> list[int]:
+        while self.walkaway_heap and self.walkaway_heap[0][0] <= system_time_sec:
+            walkaway_time, rid = heapq.heappop(self.walkaway_heap)
+            if self.status[rid] == OrderStatus.PENDING.value or self.status[rid] == OrderStatus.PICKING.value:
+                self.rids_past_walkaway_time.add(rid)
+        walkaway_rids = []
+        for rid in sorted(self.rids_past_walkaway_time):
+            if self.status[rid] == OrderStatus.PENDING.value:
+                walkaway_rids.append(rid)
+            if self.status[rid] != OrderStatus.PICKING.value:
+                self.rids_past_walkaway_time.remove(rid)
+        return walkaway_rids
+
+
+# open the request records stored in a binary file (see "save_request_data_to_binary_file" in data_serializer.py)
+# as a read-only memory map, so that only the pages of the requests actually replayed are read from the disk
+def load_request_data_from_binary_file(path_to_binary: str) -> np.ndarray:
+    header = np.fromfile(path_to_binary, dtype=REQUEST_DATA_HEADER_DTYPE, count=1)[0]
+    assert (header["magic"] == REQUEST_DATA_FILE_MAGIC and header["version"] == REQUEST_DATA_FILE_VERSION
+            and "[ERROR] WRONG REQUEST DATA FILE! Please regenerate it using data_serializer.py!")
+    return np.memmap(path_to_binary, dtype=REQUEST_DATA_RECORD_DTYPE, mode="r",
+                     offset=int(header["records_offset"]), shape=(int(header["num_of_reqs"]),))
+
+
+# convert a list of raw requests (RawRequest) into an array of request records
+def convert_raw_requests_to_records(raw_reqs: list) -> np.ndarray:
+    records = np.zeros(len(raw_reqs), dtype=REQUEST_DATA_RECORD_DTYPE)
+    records["request_time_sec"] = [raw_req.request_time_sec for raw_req in raw_reqs]
+    records["origin_node_id"] = [raw_req.origin_node_id for raw_req in raw_reqs]
+    records["destination_node_id"] = [raw_req.destination_node_id for raw_req in raw_reqs]
+    return records
+
+
+# load the request records of a taxi data file, from its binary file if it exists, otherwise from its pickle file
+def load_request_records_of_taxi_data_file(taxi_data_file: str) -> np.ndarray:
+    path_to_binary = f"{PARTIAL_PATH_TO_TAXI_DATA}{taxi_data_file}.bin"
+    if os.path.exists(path_to_binary):
+        return load_request_data_from_binary_file(path_to_binary)
+    path_to_pickle = f"{PARTIAL_PATH_TO_TAXI_DATA}{taxi_data_file}.pickle"
+    if not os.path.exists(path_to_pickle):
+        raise FileNotFoundError(f"[ERROR] TAXI DATA FILE {taxi_data_file} IS NOT FOUND! "
+                                f"Please convert it from csv using data_serializer.py!")
+    with open(path_to_pickle, "rb") as f:
+        return convert_raw_requests_to_records(pickle.load(f))
+
+
+class DemandGenerator(object):
+    """
+    DemandGenerator is a class for replaying the taxi requests data, which gives the raw requests submitted in each
+    epoch in one batch of arrays
+    Attributes:
+        taxi_data_file: name of the taxi data file (a day of taxi requests)
+        request_records: records of all requests of the day, sorted by request time (REQUEST_DATA_RECORD_DTYPE)
+        init_time_sec: the time of the day (seconds from 0 clock) when the simulation starts, i.e. system time 0
+        init_idx: index of the first request submitted not earlier than init_time_sec
+        request_density: the fraction of the requests that are replayed
+        num_of_generated_reqs: number of requests generated so far
+    """
+
+    def __init__(self, taxi_data_file: str, init_time_sec: int, request_density: float = REQUEST_DENSITY):
+        self.taxi_data_file = taxi_data_file
+        self.request_records = load_request_records_of_taxi_data_file(taxi_data_file)
+        self.init_time_sec = init_time_sec
+        self.init_idx = int(np.searchsorted(self.request_records["request_time_sec"], init_time_sec, side="left"))
+        self.request_density = request_density
+        self.num_of_generated_reqs = 0
+
+    # get the requests submitted before system time T (and not generated yet),
+    # as three arrays (request times in system time, origin node ids, destination node ids)
+    def gen_reqs_before_time(self, system_time_sec: int) -> (np.ndarray, np.ndarray, np.ndarray):
+        # 1. Find the end of the requests submitted before T.
+        request_times = self.request_records["request_time_sec"]
+        end_idx = int(np.searchsorted(request_times, system_time_sec + self.init_time_sec, side="left"))
+
+        # 2. Pick the requests to replay. (The k-th generated request is the (init_idx + k / density)-th request.)
+        num_of_candidates = int(np.ceil((end_idx - self.init_idx) * self.request_density)) + 1
+        ks = np.arange(self.num_of_generated_reqs, max(self.num_of_generated_reqs, num_of_candidates))
+        idxs = self.init_idx + (ks / self.request_density).astype(np.int64)
+        idxs = idxs[idxs < end_idx]
+        self.num_of_generated_reqs += len(idxs)
+
+        # 3. Read the picked requests.
+        records = self.request_records[idxs]
+        Trs = records["request_time_sec"].astype(np.int64) - self.init_time_sec
+        onids = records["origin_node_id"].astype(np.int64)
+        dnids = records["destination_node_id"].astype(np.int64)
+        return Trs, onids, dnids
@@ -2,83 +2,337 @@
 route planning functions
 """
 
+from collections import OrderedDict
+from functools import cached_property
 from src.utility.utility_functions import *
 
-t = timer_start()
-with open(PATH_TO_NETWORK_NODES, "rb") as f:
-    network_nodes = pickle.load(f)
-with open(PATH_TO_VEHICLE_STATIONS, "rb") as f:
-    vehicle_stations = pickle.load(f)
-with open(PATH_TO_SHORTEST_PATH_TABLE, "rb") as f:
-    shortest_path_table = pickle.load(f)
-with open(PATH_TO_MEAN_TRAVEL_TIME_TABLE, "rb") as f:
-    mean_travel_time_table = pickle.load(f)
-with open(PATH_TO_TRAVEL_DISTANCE_TABLE, "rb") as f:
-    travel_distance_table = pickle.load(f)
-print(f"[INFO] Route functions are ready. ({timer_end(t)})")
+
+# open the three map tables stored in a binary file (see "save_map_tables_to_binary_file" in data_serializer.py)
+# as read-only memory maps, so that the loading is almost instant and all processes share one page-cached copy
+def load_map_tables_from_binary_file(path_to_binary: str) -> (np.ndarray, np.ndarray, np.ndarray):
+    header = np.fromfile(path_to_binary, dtype=MAP_TABLES_HEADER_DTYPE, count=1)[0]
+    assert (header["magic"] == MAP_TABLES_FILE_MAGIC and header["version"] == MAP_TABLES_FILE_VERSION
+            and "[ERROR] WRONG MAP TABLES FILE! Please regenerate it using data_serializer.py!")
+    num_of_nodes = int(header["num_of_nodes"])
+    shape = (num_of_nodes, num_of_nodes)
+    mean_table = np.memmap(path_to_binary, dtype="<f4", mode="r",
+                           offset=int(header["mean_table_offset"]), shape=shape)
+    dist_table = np.memmap(path_to_binary, dtype="<f4", mode="r",
+                           offset=int(header["dist_table_offset"]), shape=shape)
+    path_table = np.memmap(path_to_binary, dtype=np.dtype(header["path_table_dtype"].decode()), mode="r",
+                           offset=int(header["path_table_offset"]), shape=shape)
+    return mean_table, dist_table, path_table
+
+
+def load_pickle_file(path_to_pickle: str):
+    with open(path_to_pickle, "rb") as f:
+        return pickle.load(f)
+
+
+class RoadNetwork(object):
+    """
+    RoadNetwork is a class for the map data, where each table is loaded the first time it is used
+    Attributes:
+        network_nodes: a list of nodes (Pos), indexed by node_id - 1
+        node_lngs: longitude of each node, indexed by node_id - 1
+        node_lats: latitude of each node, indexed by node_id - 1
+        vehicle_stations: a list of nodes (Pos) where vehicles are initially located
+        station_zone_of_nodes: zone of each node (the index of the vehicle station of the shortest travel time to
+            the node), indexed by node_id - 1
+        mean_travel_time_table: mean travel time between each pair of nodes
+        travel_distance_table: travel distance between each pair of nodes
+        shortest_path_table: predecessor of the destination node on the best route between each pair of nodes
+        path_cache: recently recovered paths (Path) keyed by (origin, destination), in least recently used order
+        path_cache_size: max number of paths in the path cache
+        path_cache_hits: number of paths got from the path cache
+        path_cache_misses: number of paths recovered from the shortest path table
+        reverse_reachability_indices: the built reverse reachability indices, keyed by travel time radius
+    """
+
+    def __init__(self,
+                 path_to_network_nodes: str = PATH_TO_NETWORK_NODES,
+                 path_to_vehicle_stations: str = PATH_TO_VEHICLE_STATIONS,
+                 path_to_map_tables: str = PATH_TO_MAP_TABLES,
+                 path_to_shortest_path_table: str = PATH_TO_SHORTEST_PATH_TABLE,
+                 path_to_mean_travel_time_table: str = PATH_TO_MEAN_TRAVEL_TIME_TABLE,
+                 path_to_travel_distance_table: str = PATH_TO_TRAVEL_DISTANCE_TABLE,
+                 path_cache_size: int = PATH_CACHE_SIZE):
+        self.path_to_network_nodes = path_to_network_nodes
+        self.path_to_vehicle_stations = path_to_vehicle_stations
+        self.path_to_map_tables = path_to_map_tables
+        self.path_to_shortest_path_table = path_to_shortest_path_table
+        self.path_to_mean_travel_time_table = path_to_mean_travel_time_table
+        self.path_to_travel_distance_table = path_to_travel_distance_table
+        self.path_cache = OrderedDict()
+        self.path_cache_size = path_cache_size
+        self.path_cache_hits = 0
+        self.path_cache_misses = 0
+        self.reverse_reachability_indices = {}
+
+    # (Only the file paths are pickled, e.g. when the network is shipped to worker processes, which then load the
+    # tables by themselves on their first use.)
+    def __getstate__(self) -> dict:
+        return {"path_to_network_nodes": self.path_to_network_nodes,
+                "path_to_vehicle_stations": self.path_to_vehicle_stations,
+                "path_to_map_tables": self.path_to_map_tables,
+                "path_to_shortest_path_table": self.path_to_shortest_path_table,
+                "path_to_mean_travel_time_table": self.path_to_mean_travel_time_table,
+                "path_to_travel_distance_table": self.path_to_travel_distance_table,
+                "path_cache_size": self.path_cache_size}
+
+    def __setstate__(self, state: dict):
+        self.__init__(**state)
+
+    # (Each cached_property is loaded on its first access and then stays a plain instance attribute.)
+    @cached_property
+    def network_nodes(self) -> list[Pos]:
+        return load_pickle_file(self.path_to_network_nodes)
+
+    @cached_property
+    def vehicle_stations(self) -> list[Pos]:
+        return load_pickle_file(self.path_to_vehicle_stations)
+
+    @cached_property
+    def node_lngs(self) -> np.ndarray:
+        return np.array([pos.lng for pos in self.network_nodes])
+
+    @cached_property
+    def node_lats(self) -> np.ndarray:
+        return np.array([pos.lat for pos in self.network_nodes])
+
+    @cached_property
+    def map_tables(self) -> (np.ndarray, np.ndarray, np.ndarray):
+        t = timer_start()
+        if os.path.exists(self.path_to_map_tables):
+            map_tables = load_map_tables_from_binary_file(self.path_to_map_tables)
+        else:
+            map_tables = (load_pickle_file(self.path_to_mean_travel_time_table),
+                          load_pickle_file(self.path_to_travel_distance_table),
+                          load_pickle_file(self.path_to_shortest_path_table))
+        print(f"[INFO] Map tables are loaded. ({timer_end(t)})")
+        return map_tables
+
+    @cached_property
+    def mean_travel_time_table(self) -> np.ndarray:
+        return self.map_tables[0]
+
+    @cached_property
+    def travel_distance_table(self) -> np.ndarray:
+        return self.map_tables[1]
+
+    @cached_property
+    def shortest_path_table(self) -> np.ndarray:
+        return self.map_tables[2]
+
+    @cached_property
+    def station_zone_of_nodes(self) -> np.ndarray:
+        station_nids = np.array([pos.node_id for pos in self.vehicle_stations], dtype=np.int64)
+        durations = np.asarray(self.mean_travel_time_table[station_nids - 1]).astype(np.float64)
+        durations[durations < 0] = np.inf
+        return np.argmin(durations, axis=0)
+
+    # get the mean duration of the best route from origin to destination
+    def get_duration_from_origin_to_dest(self, onid: int, dnid: int) -> float:
+        duration = float(self.mean_travel_time_table[onid - 1, dnid - 1])
+        assert duration != -1
+        return duration
+
+    # get the distance of the best route from origin to destination
+    def get_distance_from_origin_to_dest(self, onid: int, dnid: int) -> float:
+        distance = float(self.travel_distance_table[onid - 1, dnid - 1])
+        assert distance != -1
+        return distance
+
+    # get the mean durations of the best routes from origins to destinations (element-wise on two node id arrays)
+    def durations(self, onids: np.ndarray, dnids: np.ndarray) -> np.ndarray:
+        onids = np.asarray(onids, dtype=np.int64)
+        dnids = np.asarray(dnids, dtype=np.int64)
+        durations = self.mean_travel_time_table[onids - 1, dnids - 1].astype(np.float64)
+        assert np.all(durations != -1)
+        return durations
+
+    # get the distances of the best routes from origins to destinations (element-wise on two node id arrays)
+    def distances(self, onids: np.ndarray, dnids: np.ndarray) -> np.ndarray:
+        onids = np.asarray(onids, dtype=np.int64)
+        dnids = np.asarray(dnids, dtype=np.int64)
+        distances = self.travel_distance_table[onids - 1, dnids - 1].astype(np.float64)
+        assert np.all(distances != -1)
+        return distances
+
+    # get the mean durations of the best routes from each origin (row) to each destination (column)
+    def duration_matrix(self, onids: np.ndarray, dnids: np.ndarray) -> np.ndarray:
+        onids = np.asarray(onids, dtype=np.int64)
+        dnids = np.asarray(dnids, dtype=np.int64)
+        durations = self.mean_travel_time_table[np.ix_(onids - 1, dnids - 1)].astype(np.float64)
+        assert np.all(durations != -1)
+        return durations
+
+    # get the best path from origin to destination, which is only recovered if it is not in the path cache
+    def get_path_from_origin_to_dest(self, onid: int, dnid: int) -> Path:
+        key = (onid, dnid)
+        path = self.path_cache.get(key)
+        if path is not None:
+            self.path_cache.move_to_end(key)
+            self.path_cache_hits += 1
+            return path
+        self.path_cache_misses += 1
+        path = self.recover_path_from_origin_to_dest(onid, dnid)
+        self.path_cache[key] = path
+        if len(self.path_cache) > self.path_cache_size:
+            self.path_cache.popitem(last=False)
+        return path
+
+    # recover the best path from origin to destination from the path table
+    def recover_path_from_origin_to_dest(self, onid: int, dnid: int) -> Path:
+        shortest_path_table = self.shortest_path_table
+        path = [dnid]
+        pre_node = int(shortest_path_table[onid - 1, dnid - 1])
+        while pre_node > 0:
+            path.append(pre_node)
+            pre_node = int(shortest_path_table[onid - 1, pre_node - 1])
+        path.reverse()
+
+        nids = np.array(path, dtype=np.int32)
+        cum_t = np.zeros(len(nids))
+        cum_d = np.zeros(len(nids))
+        np.cumsum(self.durations(nids[:-1], nids[1:]), out=cum_t[1:])
+        np.cumsum(self.distances(nids[:-1], nids[1:]), out=cum_d[1:])
+
+        # check the accuracy of routing.
+        deviation_due_to_data_structure = 0.005
+        assert (abs(cum_t[-1] - self.mean_travel_time_table[onid - 1, dnid - 1])
+                <= deviation_due_to_data_structure)
+        assert (abs(cum_d[-1] - self.travel_distance_table[onid - 1, dnid - 1])
+                <= deviation_due_to_data_structure)
+
+        # (Cached paths are shared by all their users, so they are made read-only.)
+        for array in (nids, cum_t, cum_d):
+            array.flags.writeable = False
+        return Path(nids, cum_t, cum_d)
+
+    # get the reverse reachability index of the given travel time radius, which is built the first time it is used
+    def get_reverse_reachability_index(self, radius_sec: float) -> (np.ndarray, np.ndarray):
+        index = self.reverse_reachability_indices.get(radius_sec)
+        if index is None:
+            index = self.build_reverse_reachability_index(radius_sec)
+            self.reverse_reachability_indices[radius_sec] = index
+        return index
+
+    # build the index of the nodes that can reach each node within the travel time radius, as a compressed sparse
+    # row structure (indptr, onids), where onids[indptr[dnid - 1]:indptr[dnid]] are the nodes reaching dnid
+    def build_reverse_reachability_index(self, radius_sec: float) -> (np.ndarray, np.ndarray):
+        t = timer_start()
+        mean_travel_time_table = self.mean_travel_time_table
+        num_of_nodes = mean_travel_time_table.shape[0]
+
+        # 1. Find all (origin, destination) pairs within the radius, reading the table in chunks of rows.
+        onids_of_chunks = []
+        dnids_of_chunks = []
+        num_of_rows_per_chunk = max(1, 2 ** 24 // num_of_nodes)
+        for start_row in range(0, num_of_nodes, num_of_rows_per_chunk):
+            durations = np.asarray(mean_travel_time_table[start_row:start_row + num_of_rows_per_chunk])
+            rows, cols = np.nonzero((durations >= 0) & (durations <= radius_sec))
+            onids_of_chunks.append((rows + start_row + 1).astype(np.int32))
+            dnids_of_chunks.append((cols + 1).astype(np.int32))
+        onids = np.concatenate(onids_of_chunks)
+        dnids = np.concatenate(dnids_of_chunks)
+
+        # 2. Group the pairs by destination. (The origins of each destination stay in ascending order.)
+        order = np.argsort(dnids, kind="stable")
+        indptr = np.zeros(num_of_nodes + 1, dtype=np.int64)
+        np.cumsum(np.bincount(dnids - 1, minlength=num_of_nodes), out=indptr[1:])
+        print(f"[INFO] Reverse reachability index ({radius_sec} s) is built, "
+              f"avg_size = {len(onids) / num_of_nodes:.1f}. ({timer_end(t)})")
+        return indptr, onids[order]
+
+    # return the geo of node [lng, lat]
+    def get_node_geo(self, nid: int) -> [float, float]:
+        pos = self.network_nodes[nid - 1]
+        return [pos.lng, pos.lat]
+
+    # return the geos of nodes as two arrays (lngs, lats)
+    def get_node_geos(self, nids: np.ndarray) -> (np.ndarray, np.ndarray):
+        nids = np.asarray(nids, dtype=np.int64)
+        return self.node_lngs[nids - 1], self.node_lats[nids - 1]
+
+    def get_num_of_vehicle_stations(self) -> int:
+        return len(self.vehicle_stations)
+
+    def get_vehicle_station_id(self, station_index: int) -> int:
+        return self.vehicle_stations[station_index].node_id
+
+    # return the zones of nodes, i.e. the index of the vehicle station nearest to each node
+    def get_station_zones_of_nodes(self, nids: np.ndarray) -> np.ndarray:
+        return self.station_zone_of_nodes[np.asarray(nids, dtype=np.int64) - 1]
+
+
+# The road network used by the route functions below. Nothing is loaded until a function needs it.
+road_network = RoadNetwork()
+
+
+def get_road_network() -> RoadNetwork:
+    return road_network
+
+
+# switch the route functions to another road network (e.g. a network variant injected into Platform)
+def set_road_network(network: RoadNetwork):
+    global road_network
+    road_network = network
 
 
 # get the mean duration of the best route from origin to destination
 def get_duration_from_origin_to_dest(onid: int, dnid: int) -> float:
-    duration = mean_travel_time_table[onid - 1][dnid - 1]
-    assert duration != -1
-    return duration
+    return road_network.get_duration_from_origin_to_dest(onid, dnid)
 
 
 # get the distance of the best route from origin to destination
 def get_distance_from_origin_to_dest(onid: int, dnid: int) -> float:
-    distance = travel_distance_table[onid - 1][dnid - 1]
-    assert distance != -1
-    return distance
-
-
-# get the best route from origin to destination
-def build_route_from_origin_to_dest(onid: int, dnid: int) -> (float, float, list[tuple]):
-    # 1. recover the best path from origin to destination from the path table
-    path = [dnid]
-    pre_node = shortest_path_table[onid - 1][dnid - 1]
-    while pre_node > 0:
-        path.append(pre_node)
-        pre_node = shortest_path_table[onid - 1][pre_node - 1]
-    path.reverse()
-
-    # 2. get the route information from origin to destination
-    duration = 0.0
-    distance = 0.0
-    steps = []
-    for i in range(len(path) - 1):
-        u = path[i]
-        v = path[i + 1]
-        t = mean_travel_time_table[u - 1][v - 1]
-        d = travel_distance_table[u - 1][v - 1]
-        u_geo = get_node_geo(u)
-        v_geo = get_node_geo(v)
-        steps.append((t, d, [u, v], [u_geo, v_geo]))
-        duration += t
-        distance += d
-    tnid = path[-1]
-    tnid_geo = get_node_geo(tnid)
-    steps.append((0.0, 0.0, [tnid, tnid], [tnid_geo, tnid_geo]))
-
-    # check the accuracy of routing.
-    deviation_due_to_data_structure = 0.005
-    assert (abs(duration - mean_travel_time_table[onid - 1][dnid - 1])
-            <= deviation_due_to_data_structure)
-    assert (abs(distance - travel_distance_table[onid - 1][dnid - 1])
-            <= deviation_due_to_data_structure)
-
-    return duration, distance, steps
+    return road_network.get_distance_from_origin_to_dest(onid, dnid)
+
+
+# get the mean durations of the best routes from origins to destinations (element-wise)
+def get_durations_from_origins_to_dests(onids: np.ndarray, dnids: np.ndarray) -> np.ndarray:
+    return road_network.durations(onids, dnids)
+
+
+# get the distances of the best routes from origins to destinations (element-wise)
+def get_distances_from_origins_to_dests(onids: np.ndarray, dnids: np.ndarray) -> np.ndarray:
+    return road_network.distances(onids, dnids)
+
+
+# get the mean durations of the best routes from each origin (row) to each destination (column)
+def get_duration_matrix_from_origins_to_dests(onids: np.ndarray, dnids: np.ndarray) -> np.ndarray:
+    return road_network.duration_matrix(onids, dnids)
+
+
+# get the best path from origin to destination (node ids, accumulated durations and accumulated distances)
+def get_path_from_origin_to_dest(onid: int, dnid: int) -> Path:
+    return road_network.get_path_from_origin_to_dest(onid, dnid)
+
+
+# get the index of the nodes that can reach each node within the travel time radius, as (indptr, onids),
+# where onids[indptr[dnid - 1]:indptr[dnid]] are the nodes reaching dnid
+def get_reverse_reachability_index(radius_sec: float) -> (np.ndarray, np.ndarray):
+    return road_network.get_reverse_reachability_index(radius_sec)
 
 
 # return the geo of node [lng, lat]
 def get_node_geo(nid: int) -> [float, float]:
-    pos = network_nodes[nid - 1]
-    return [pos.lng, pos.lat]
+    return road_network.get_node_geo(nid)
+
+
+# return the geos of nodes as two arrays (lngs, lats)
+def get_node_geos(nids: np.ndarray) -> (np.ndarray, np.ndarray):
+    return road_network.get_node_geos(nids)
 
 
 def get_num_of_vehicle_stations() -> int:
-    return len(vehicle_stations)
+    return road_network.get_num_of_vehicle_stations()
 
 
 def get_vehicle_station_id(station_index: int) -> int:
-    return vehicle_stations[station_index].node_id
+    return road_network.get_vehicle_station_id(station_index)
+
+
+def get_station_zones_of_nodes(nids: np.ndarray) -> np.ndarray:
+    return road_network.get_station_zones_of_nodes(nids)
@@ -2,8 +2,8 @@
 definition of routes for the AMoD system
 """
 
-from collections import deque
 from enum import Enum
+import numpy as np
 
 
 ##################################################################################
@@ -36,52 +36,26 @@ class RebalancerMethod(Enum):
     NONE = 1
     RVS = 2
     NPO = 3
+    MCF = 4
+    MCF_P = 5
 
 
 ##################################################################################
 # Route Types
 ##################################################################################
-class Step(object):
+class Path(object):
     """
-    Step is a class for steps in a leg
+    Path is a class for the best path between two nodes, recovered from the shortest path table
     Attributes:
-        t: duration
-        d: distance
-        nid_pair: [origin_node_id, destination_node_id]
-        geo_pair: [origin_node_geo, destination_node_geo]
+        nids: node ids along the path, from the origin to the destination
+        cum_t: accumulated duration from the origin to each node
+        cum_d: accumulated distance from the origin to each node
     """
 
-    def __init__(self, t=0.0, d=0.0, nid: [int, int] = [], geo: [[float, float], [float, float]] = []):
-        self.t = t
-        self.d = d
-        self.nid_pair = nid
-        self.geo_pair = geo
-
-
-class Leg(object):
-    """
-    Leg is a class for legs in the route
-    A leg may consists of a series of steps
-    Attributes:
-        rid: request id (if rebalancing then -1)
-        pod: pickup (+1) or dropoff (-1), rebalancing (0)
-        tnid: target (end of leg) node id in network
-        ddl: latest arriving time
-        t: total duration
-        d: total distance
-        steps: a list of steps
-    """
-
-    def __init__(self, rid: int, pod: int, tnid: int, ddl: int,
-                 t: float = 0.0, d: float = 0.0,
-                 steps: deque[Step] = []):
-        self.rid = rid
-        self.pod = pod
-        self.tnid = tnid
-        self.ddl = ddl
-        self.t = t
-        self.d = d
-        self.steps = deque(steps)
+    def __init__(self, nids: np.ndarray, cum_t: np.ndarray, cum_d: np.ndarray):
+        self.nids = nids
+        self.cum_t = cum_t
+        self.cum_d = cum_d
 
 
 ##################################################################################
@@ -99,4 +73,32 @@ class RawRequest(object):
         self.origin_node_id = 1
         self.destination_node_id = 2
         self.request_time_sec = 0
-        self.request_time_date = "0000-00-00 00:00:00"
\ No newline at end of file
+        self.request_time_date = "0000-00-00 00:00:00"
+
+
+# The binary map tables file consists of a fixed-size header, followed by the mean travel time table (float32),
+# the travel distance table (float32) and the shortest path table (int16 or int32), each of shape [N, N].
+MAP_TABLES_FILE_MAGIC = b"AMODMAP"
+MAP_TABLES_FILE_VERSION = 1
+MAP_TABLES_HEADER_SIZE = 64
+MAP_TABLES_HEADER_DTYPE = np.dtype([("magic", "S8"),
+                                    ("version", "<i4"),
+                                    ("num_of_nodes", "<i4"),
+                                    ("path_table_dtype", "S4"),
+                                    ("mean_table_offset", "<i8"),
+                                    ("dist_table_offset", "<i8"),
+                                    ("path_table_offset", "<i8")])
+
+
+# The binary request data file consists of a fixed-size header, followed by the records of all requests of a day,
+# sorted by request time (seconds from 0 clock).
+REQUEST_DATA_FILE_MAGIC = b"AMODREQ"
+REQUEST_DATA_FILE_VERSION = 1
+REQUEST_DATA_HEADER_SIZE = 64
+REQUEST_DATA_HEADER_DTYPE = np.dtype([("magic", "S8"),
+                                      ("version", "<i4"),
+                                      ("num_of_reqs", "<i8"),
+                                      ("records_offset", "<i8")])
+REQUEST_DATA_RECORD_DTYPE = np.dtype([("request_time_sec", "<i4"),
+                                      ("origin_node_id", "<i4"),
+                                      ("destination_node_id", "<i4")])
@@ -8,23 +8,23 @@ from src.simulator.route_functions import *
 class Veh(object):
     """
     Veh is a class for vehicles
+    (The location, load, route and statistics of a vehicle are stored in the arrays of its fleet, indexed by id.)
     Attributes:
         id: sequential unique id
+        fleet: the fleet (Fleet) that the vehicle belongs to
         status: idle, working and rebalancing
         state_time: system time at current state
         lat: current lngitude
         lng: current longtitude
         nid: current nearest node id in network
-        step_to_nid: step from current location (when veh is on an edge) to the sink node in network
         t_to_nid: travel time from current location (when veh is on an edge) to the sink node in network
         d_to_nid: travel distance from current location (when veh is on an edge) to the sink node in network
         tnid: target (end of route) node id
         K: capacity
         load: number of passengers on board
-        sche: (schedule) a list of pick-up and drop-off points
-        route: a list of legs
-        t: total duration of the route
-        d: total distance of the route
+        sche: (schedule) a tuple of pick-up and drop-off points
+        t: remaining duration of the route
+        d: remaining distance of the route
         Ds: accumulated service distance traveled
         Ts: accumulated service time traveled
         Dr: accumulated rebalancing distance traveled
@@ -38,237 +38,109 @@ class Veh(object):
 
     """
 
-    def __init__(self, id: int, nid: int, lng: float, lat: float, capacity: int, system_time_sec: float):
+    state_time = ArrayAttribute("fleet")
+    lng = ArrayAttribute("fleet")
+    lat = ArrayAttribute("fleet")
+    nid = ArrayAttribute("fleet")
+    t_to_nid = ArrayAttribute("fleet")
+    d_to_nid = ArrayAttribute("fleet")
+    load = ArrayAttribute("fleet")
+    Ds = ArrayAttribute("fleet")
+    Ts = ArrayAttribute("fleet")
+    Ds_empty = ArrayAttribute("fleet")
+    Ts_empty = ArrayAttribute("fleet")
+    Dr = ArrayAttribute("fleet")
+    Tr = ArrayAttribute("fleet")
+    Lt = ArrayAttribute("fleet")
+    Ld = ArrayAttribute("fleet")
+
+    def __init__(self, fleet, id: int, capacity: int):
+        self.fleet = fleet
         self.id = id
-        self.status = VehicleStatus.IDLE
-        self.state_time = system_time_sec
-        self.lng = lng
-        self.lat = lat
-        self.nid = nid
         self.K = capacity
-        self.step_to_nid = None
-        self.t_to_nid = 0.0
-        self.d_to_nid = 0.0
         self.tnid = self.nid
-        self.load = 0
-        self.sche = []
-        self.route = deque([])
-        self.t = 0.0
-        self.d = 0.0
-        self.Ds = 0.0
-        self.Ts = 0.0
-        self.Ds_empty = 0.0
-        self.Ts_empty = 0.0
-        self.Dr = 0.0
-        self.Tr = 0.0
-        self.Lt = 0.0
-        self.Ld = 0.0
+        self.sche = ()
         self.picking_rids = []
         self.onboard_rids = []
         self.new_picked_rids = []
         self.new_dropped_rids = []
         self.sche_has_been_updated_at_current_epoch = False
 
-    # update the vehicle location as well as the route after moving to time T
-    def move_to_time(self, system_time_sec: int, update_vehicle_statistics: bool) -> list:
-        dT = system_time_sec - self.state_time
-        if dT <= 0:
-            return []
-        self.step_to_nid = None
-        self.t_to_nid = 0.0
-        self.d_to_nid = 0.0
-        # done is a list of finished legs
-        done = []
-        self.new_picked_rids.clear()
-        self.new_dropped_rids.clear()
-        while dT > 0 and len(self.route) > 0:
-            leg = self.route[0]
-            # if the first leg could be finished by then
-            if leg.t < dT:
-                dT -= leg.t
-                self.state_time += leg.t
-                if update_vehicle_statistics:
-                    self.Ts += leg.t
-                    self.Ds += leg.d
-                    self.Lt += leg.t * self.load
-                    self.Ld += leg.d * self.load
-                    if self.status == VehicleStatus.WORKING and self.load == 0:
-                        self.Ts_empty += leg.t
-                        self.Ds_empty += leg.d
-                    if self.status == VehicleStatus.REBALANCING:
-                        self.Tr += leg.t
-                        self.Dr += leg.d
-
-                self.update_service_status_after_veh_finish_a_leg(done, leg)
-            else:
-                while dT > 0 and len(leg.steps) > 0:
-                    step = leg.steps[0]
-                    # if the first leg could not be finished, but the first step of the leg could be finished by then
-                    if step.t < dT:
-                        dT -= step.t
-                        self.state_time += step.t
-                        if update_vehicle_statistics:
-                            self.Ts += step.t
-                            self.Ds += step.d
-                            self.Lt += step.t * self.load
-                            self.Ld += step.d * self.load
-                            if self.status == VehicleStatus.WORKING and self.load == 0:
-                                self.Ts_empty += step.t
-                                self.Ds_empty += step.d
-                            if self.status == VehicleStatus.REBALANCING:
-                                self.Tr += step.t
-                                self.Dr += step.d
-
-                        self.jump_to_location(step.nid_pair[1], step.geo_pair[1][0], step.geo_pair[1][1])
-                        self.pop_step()
-
-                        if len(leg.steps) == 0:
-                            # corner case: leg.t extremely small, but still larger than dT
-                            # this is due to the limited precision of the floating point numbers
-                            self.update_service_status_after_veh_finish_a_leg(done, leg)
-                            break
-                    # the vehicle has to stop somewhere within the step
-                    else:
-                        pct = dT / step.t
-                        if update_vehicle_statistics:
-                            self.Ts += dT
-                            self.Ds += step.d * pct
-                            self.Lt += dT * self.load
-                            self.Ld += step.d * pct * self.load
-                            if self.status == VehicleStatus.WORKING and self.load == 0:
-                                self.Ts_empty += dT
-                                self.Ds_empty += step.d * pct
-                            if self.status == VehicleStatus.REBALANCING:
-                                self.Tr += dT
-                                self.Dr += step.d * pct
-
-                        # find the exact location the vehicle stops and update the step
-                        self.cut_step(pct)
-                        self.jump_to_location(step.nid_pair[0], step.geo_pair[0][0], step.geo_pair[0][1])
-                        self.state_time = system_time_sec
-                        return done
-
-        # We've finished the whole schedule.
-        assert dT > 0 or np.isclose(dT, 0.0)
-        assert self.state_time < system_time_sec or np.isclose(self.state_time, system_time_sec)
-        assert len(self.route) == len(self.sche) == 0
-        assert self.load == len(self.onboard_rids) == len(self.picking_rids) == 0
-        assert np.isclose(self.d, 0.0)
-        assert np.isclose(self.t, 0.0)
-        self.state_time = system_time_sec
-        self.d = 0.0
-        self.t = 0.0
-        self.status = VehicleStatus.IDLE
-        return done
-
-    def update_service_status_after_veh_finish_a_leg(self, done: list[(int, int, int)], leg: Leg):
-        self.jump_to_location(leg.tnid)
-        self.load += leg.pod
-        if leg.rid != -2:
-            done.append((leg.rid, leg.pod, self.state_time))
-            finished_sche_step = self.sche.pop(0)
-            assert finished_sche_step[0] == leg.rid
-            if leg.pod == 1:
-                self.picking_rids.remove(leg.rid)
-                self.new_picked_rids.append(leg.rid)
-                self.onboard_rids.append(leg.rid)
-                # if DEBUG_PRINT:
-                #     print(f"            +vehicle #{self.id} picked up req #{leg.rid} at {self.state_time}s")
-            elif leg.pod == -1:
-                self.new_dropped_rids.append(leg.rid)
-                self.onboard_rids.remove(leg.rid)
-                # if DEBUG_PRINT:
-                #     print(f"            +vehicle #{self.id} dropped up req #{leg.rid} at {self.state_time}s")
-        assert self.load == len(self.onboard_rids)
-        # if set(self.new_picked_rids) & set(self.new_dropped_rids) != set():
-        #     print('[INFO]', self.new_picked_rids, self.new_dropped_rids)
-        # assert set(self.new_picked_rids) & set(self.new_dropped_rids) == set()
-        self.pop_leg()
-
-    # pop the first leg from the route list
-    def pop_leg(self):
-        leg = self.route.popleft()
-        self.d -= leg.d
-        self.t -= leg.t
-
-    # pop the first step from the first leg
-    def pop_step(self):
-        step = self.route[0].steps.popleft()
-        self.t -= step.t
-        self.d -= step.d
-        self.route[0].t -= step.t
-        self.route[0].d -= step.d
-
-    # find the exact location the vehicle stops and update the step
-    def cut_step(self, pct: float):
-        step = self.route[0].steps[0]
-        step.nid_pair[0] = step.nid_pair[1]
-        step.geo_pair[0][0] += pct * (step.geo_pair[1][0] - step.geo_pair[0][0])
-        step.geo_pair[0][1] += pct * (step.geo_pair[1][1] - step.geo_pair[0][1])
-        self.t_to_nid = step.t * (1 - pct)
-        self.d_to_nid = step.d * (1 - pct)
-        self.t -= step.t * pct
-        self.d -= step.d * pct
-        self.route[0].t -= step.t * pct
-        self.route[0].d -= step.d * pct
-        self.route[0].steps[0].t -= step.t * pct
-        self.route[0].steps[0].d -= step.d * pct
-        self.step_to_nid = copy.deepcopy(self.route[0].steps[0])
-        assert self.route[0].steps[0].nid_pair[0] == self.route[0].steps[0].nid_pair[1]
-        assert np.isclose(self.step_to_nid.t, self.t_to_nid)
-        assert np.isclose(self.step_to_nid.d, self.d_to_nid)
-
-    def jump_to_location(self, nid: int, lng=None, lat=None):
-        self.nid = nid
-        if lng is None:
-            [lng, lat] = get_node_geo(nid)
-        self.lng = lng
-        self.lat = lat
+    @property
+    def status(self) -> VehicleStatus:
+        return VehicleStatus(int(self.fleet.status[self.id]))
+
+    @status.setter
+    def status(self, status: VehicleStatus):
+        self.fleet.status[self.id] = status.value
+
+    @property
+    def t(self) -> float:
+        return self.fleet.get_remaining_route_t(self.id)
+
+    @property
+    def d(self) -> float:
+        return self.fleet.get_remaining_route_d(self.id)
 
     # build the route of the vehicle based on a series of schedule tasks (rid, pod, tnid, ddl)
     # update t, d, status accordingly
-    # rid, pod, tlng, tlat are defined as in class Leg
-    def build_route(self, sche: list[(int, int, int, float)]):
+    def build_route(self, sche: tuple[(int, int, int, float), ...]):
         # if a vehicle is assigned a trip while ensuring it visits the rebalancing node,
         # its rebalancing task can be cancelled
         if self.status == VehicleStatus.REBALANCING and len(sche) > 1:
             assert (len(self.sche) == 1)
-            idx = -1
-            for (rid, pod, tnid, ddl) in sche:
-                idx += 1
-                if rid == -1:
-                    sche.pop(idx)
-                    break
+            sche = tuple((rid, pod, tnid, ddl) for (rid, pod, tnid, ddl) in sche if rid != -1)
 
         # 1. Update vehicle's schedule with detailed route.
+        #    (Schedules are immutable tuples, so the given one is shared rather than copied.)
         self.clear_route()
-        self.sche = copy.copy(sche)
-        if self.step_to_nid:
-            assert self.lng == self.step_to_nid.geo_pair[0][0]
-            # add the unfinished step from last move updating
-            rid = -2
-            pod = 0
-            tnid = self.step_to_nid.nid_pair[1]
-            tlng = self.step_to_nid.geo_pair[1][0]
-            tlat = self.step_to_nid.geo_pair[1][1]
-            ddl = self.state_time + self.step_to_nid.t
-            duration = self.step_to_nid.t
-            distance = self.step_to_nid.d
-            steps = [copy.deepcopy(self.step_to_nid), Step(0, 0, [tnid, tnid], [[tlng, tlat], [tlng, tlat]])]
-            leg = Leg(rid, pod, tnid, ddl, duration, distance, steps)
-            # the last step of a leg is always of length 2,
-            # consisting of 2 identical points as a flag of the end of the leg
-            assert len(leg.steps[-1].geo_pair) == 2
-            assert leg.steps[-1].geo_pair[0] == leg.steps[-1].geo_pair[1]
-            self.route.append(leg)
-            self.tnid = leg.steps[-1].nid_pair[1]
-            self.d += leg.d
-            self.t += leg.t
-        if self.sche:
-            for (rid, pod, tnid, ddl) in self.sche:
-                self.add_leg(rid, pod, tnid, ddl)
-                if pod == 1:
-                    self.picking_rids.append(rid)
+        self.sche = tuple(sche)
+        # (Point 0 of the route is the vehicle's current location, and each leg ends at one of the following points.)
+        nid = self.nid
+        t_to_nid = self.t_to_nid
+        seg_nids = [np.array([nid], dtype=np.int32)]
+        seg_cum_t = [np.zeros(1)]
+        seg_cum_d = [np.zeros(1)]
+        leg_rids = []
+        leg_pods = []
+        leg_end_idxs = []
+        end_idx = 0
+        route_t = 0.0
+        route_d = 0.0
+        if t_to_nid > 0:
+            # add the unfinished edge from last move updating (as a leg of rid -2)
+            d_to_nid = self.d_to_nid
+            seg_nids.append(np.array([nid], dtype=np.int32))
+            seg_cum_t.append(np.array([t_to_nid]))
+            seg_cum_d.append(np.array([d_to_nid]))
+            end_idx += 1
+            route_t += t_to_nid
+            route_d += d_to_nid
+            leg_rids.append(-2)
+            leg_pods.append(0)
+            leg_end_idxs.append(end_idx)
+        for (rid, pod, tnid, ddl) in self.sche:
+            path = get_path_from_origin_to_dest(self.tnid, tnid)
+            seg_nids.append(path.nids[1:])
+            seg_cum_t.append(path.cum_t[1:] + route_t)
+            seg_cum_d.append(path.cum_d[1:] + route_d)
+            end_idx += len(path.nids) - 1
+            route_t += float(path.cum_t[-1])
+            route_d += float(path.cum_d[-1])
+            leg_rids.append(rid)
+            leg_pods.append(pod)
+            leg_end_idxs.append(end_idx)
+            self.tnid = tnid
+            if pod == 1:
+                self.picking_rids.append(rid)
+        if len(leg_rids) > 0:
+            route_nids = np.concatenate(seg_nids)
+            route_lngs, route_lats = get_node_geos(route_nids)
+            route_lngs[0] = self.lng
+            route_lats[0] = self.lat
+            self.fleet.set_route(self.id, route_nids, route_lngs, route_lats,
+                                 np.concatenate(seg_cum_t), np.concatenate(seg_cum_d),
+                                 leg_rids, leg_pods, leg_end_idxs)
 
         # 2. Update vehicle's status.
         self.sche_has_been_updated_at_current_epoch = True
@@ -277,8 +149,8 @@ class Veh(object):
                 self.status = VehicleStatus.WORKING
                 # verify the route with capacity constraint
                 n = self.load
-                for leg in self.route:
-                    n += leg.pod
+                for pod in leg_pods:
+                    n += pod
                 assert n == 0
             else:
                 self.status = VehicleStatus.REBALANCING
@@ -286,28 +158,304 @@ class Veh(object):
         else:
             self.status = VehicleStatus.IDLE
 
-    # add a leg based on (rid, pod, tnid, ddl)
-    def add_leg(self, rid: int, pod: int, tnid: int, ddl: float):
-        duration, distance, segments = build_route_from_origin_to_dest(self.tnid, tnid)
-        steps = [Step(s[0], s[1], s[2], s[3]) for s in segments]
-        leg = Leg(rid, pod, tnid, ddl, duration, distance, steps)
-        # the last step of a leg is always of length 2,
-        # consisting of 2 identical points as a flag of the end of the leg
-        # (this check is due to using OSRM, might not necessary now)
-        assert len(leg.steps[-1].geo_pair) == 2
-        assert leg.steps[-1].geo_pair[0] == leg.steps[-1].geo_pair[1]
-        self.route.append(leg)
-        self.tnid = leg.steps[-1].nid_pair[1]
-        self.d += leg.d
-        self.t += leg.t
-
     # remove the current route
     def clear_route(self):
         self.picking_rids.clear()
-        self.route.clear()
-        self.sche.clear()
-        self.d = 0.0
-        self.t = 0.0
+        self.fleet.clear_route(self.id)
+        self.sche = ()
         self.tnid = self.nid
 
+    # the vehicle's location followed by the route points it has not passed
+    def get_remaining_route_geos(self) -> (list[float], list[float]):
+        return self.fleet.get_remaining_route_geos(self.id)
+
+
+class Fleet(object):
+    """
+    Fleet is a class for the states of all vehicles, stored in arrays indexed by vehicle id
+    The routes of all vehicles share one pool of route points and one pool of legs, where each vehicle owns a
+    contiguous range, so that the whole fleet is advanced by a few array operations per epoch.
+    Attributes:
+        vehs: the list of vehicles (Veh), which read their attributes from the arrays below
+        status: status of each vehicle (value of VehicleStatus)
+        state_time, nid, lng, lat, t_to_nid, d_to_nid, load: states of each vehicle (same as in Veh)
+        Ds, Ts, Ds_empty, Ts_empty, Dr, Tr, Lt, Ld: accumulated statistics of each vehicle (same as in Veh)
+        route_nids: node id of each route point in the pool
+        route_lngs: longitude of each route point in the pool
+        route_lats: latitude of each route point in the pool
+        route_cum_t: accumulated duration from the start of its route to each route point in the pool
+        route_cum_d: accumulated distance from the start of its route to each route point in the pool
+        num_of_route_points: number of route points used in the pool
+        leg_rids: request id of each leg in the pool (if rebalancing then -1, if finishing the current edge then -2)
+        leg_pods: pickup (+1) or dropoff (-1), rebalancing (0) of each leg in the pool
+        leg_end_pts: index of the route point (in the pool) where each leg ends
+        num_of_legs: number of legs used in the pool
+        route_cursor: index of the last route point passed by each vehicle
+        route_end: index after the last route point of each vehicle
+        route_t_traveled: duration traveled along the route of each vehicle
+        route_d_traveled: distance traveled along the route of each vehicle
+        leg_head: index of the first unfinished leg of each vehicle
+        leg_tail: index after the last leg of each vehicle
+        vids_with_new_picked_or_dropped_rids: ids of vehicles that picked or dropped requests during the last move
+    """
+
+    def __init__(self, nids: list[int], capacity: int, system_time_sec: float):
+        num_of_vehs = len(nids)
+        self.status = np.full(num_of_vehs, VehicleStatus.IDLE.value, dtype=np.int8)
+        self.state_time = np.full(num_of_vehs, system_time_sec, dtype=np.float64)
+        self.nid = np.array(nids, dtype=np.int64)
+        self.lng, self.lat = get_node_geos(self.nid)
+        self.t_to_nid = np.zeros(num_of_vehs)
+        self.d_to_nid = np.zeros(num_of_vehs)
+        self.load = np.zeros(num_of_vehs, dtype=np.int64)
+        self.Ds = np.zeros(num_of_vehs)
+        self.Ts = np.zeros(num_of_vehs)
+        self.Ds_empty = np.zeros(num_of_vehs)
+        self.Ts_empty = np.zeros(num_of_vehs)
+        self.Dr = np.zeros(num_of_vehs)
+        self.Tr = np.zeros(num_of_vehs)
+        self.Lt = np.zeros(num_of_vehs)
+        self.Ld = np.zeros(num_of_vehs)
+
+        pool_size_of_route_points = max(1024, 64 * num_of_vehs)
+        pool_size_of_legs = max(128, 8 * num_of_vehs)
+        self.route_nids = np.zeros(pool_size_of_route_points, dtype=np.int32)
+        self.route_lngs = np.zeros(pool_size_of_route_points)
+        self.route_lats = np.zeros(pool_size_of_route_points)
+        self.route_cum_t = np.zeros(pool_size_of_route_points)
+        self.route_cum_d = np.zeros(pool_size_of_route_points)
+        self.num_of_route_points = 0
+        self.leg_rids = np.zeros(pool_size_of_legs, dtype=np.int64)
+        self.leg_pods = np.zeros(pool_size_of_legs, dtype=np.int64)
+        self.leg_end_pts = np.zeros(pool_size_of_legs, dtype=np.int64)
+        self.num_of_legs = 0
+        self.route_cursor = np.zeros(num_of_vehs, dtype=np.int64)
+        self.route_end = np.zeros(num_of_vehs, dtype=np.int64)
+        self.route_t_traveled = np.zeros(num_of_vehs)
+        self.route_d_traveled = np.zeros(num_of_vehs)
+        self.leg_head = np.zeros(num_of_vehs, dtype=np.int64)
+        self.leg_tail = np.zeros(num_of_vehs, dtype=np.int64)
+
+        self.vids_with_new_picked_or_dropped_rids = []
+        self.vehs = [Veh(self, vid, capacity) for vid in range(num_of_vehs)]
+
+    def get_remaining_route_t(self, vid: int) -> float:
+        if self.leg_head[vid] == self.leg_tail[vid]:
+            return 0.0
+        return float(self.route_cum_t[self.route_end[vid] - 1] - self.route_t_traveled[vid])
+
+    def get_remaining_route_d(self, vid: int) -> float:
+        if self.leg_head[vid] == self.leg_tail[vid]:
+            return 0.0
+        return float(self.route_cum_d[self.route_end[vid] - 1] - self.route_d_traveled[vid])
+
+    def get_remaining_route_geos(self, vid: int) -> (list[float], list[float]):
+        if self.leg_head[vid] == self.leg_tail[vid]:
+            return [], []
+        pts = slice(self.route_cursor[vid] + 1, self.route_end[vid])
+        return ([float(self.lng[vid])] + self.route_lngs[pts].tolist(),
+                [float(self.lat[vid])] + self.route_lats[pts].tolist())
+
+    def clear_route(self, vid: int):
+        self.leg_head[vid] = self.leg_tail[vid]
+
+    # store the new route of a vehicle at the end of the pools (leg_end_idxs count from the first route point)
+    def set_route(self, vid: int, nids: np.ndarray, lngs: np.ndarray, lats: np.ndarray,
+                  cum_t: np.ndarray, cum_d: np.ndarray,
+                  leg_rids: list[int], leg_pods: list[int], leg_end_idxs: list[int]):
+        self.clear_route(vid)
+        num_of_points = len(nids)
+        num_of_legs = len(leg_rids)
+        if (self.num_of_route_points + num_of_points > len(self.route_nids)
+                or self.num_of_legs + num_of_legs > len(self.leg_rids)):
+            self.compact_route_pools(num_of_points, num_of_legs)
+
+        s = self.num_of_route_points
+        e = s + num_of_points
+        self.route_nids[s:e] = nids
+        self.route_lngs[s:e] = lngs
+        self.route_lats[s:e] = lats
+        self.route_cum_t[s:e] = cum_t
+        self.route_cum_d[s:e] = cum_d
+        self.num_of_route_points = e
+        self.route_cursor[vid] = s
+        self.route_end[vid] = e
+        self.route_t_traveled[vid] = 0.0
+        self.route_d_traveled[vid] = 0.0
+
+        ls = self.num_of_legs
+        le = ls + num_of_legs
+        self.leg_rids[ls:le] = leg_rids
+        self.leg_pods[ls:le] = leg_pods
+        self.leg_end_pts[ls:le] = np.asarray(leg_end_idxs, dtype=np.int64) + s
+        self.num_of_legs = le
+        self.leg_head[vid] = ls
+        self.leg_tail[vid] = le
+
+    # move the unfinished parts of all routes to the front of the pools,
+    # which grow if there is still not enough room for the given numbers of new route points and legs
+    def compact_route_pools(self, num_of_new_points: int, num_of_new_legs: int):
+        vids = np.flatnonzero(self.leg_head < self.leg_tail)
+        # (The points before the cursor have been passed. The cursor itself is kept as the start of the current edge.)
+        pts = concatenate_index_ranges(self.route_cursor[vids], self.route_end[vids])
+        legs = concatenate_index_ranges(self.leg_head[vids], self.leg_tail[vids])
+        pt_lens = self.route_end[vids] - self.route_cursor[vids]
+        leg_lens = self.leg_tail[vids] - self.leg_head[vids]
+        new_pt_starts = np.cumsum(pt_lens) - pt_lens
+        new_leg_starts = np.cumsum(leg_lens) - leg_lens
+        pt_shifts = new_pt_starts - self.route_cursor[vids]
+
+        pool_size_of_route_points = max(len(self.route_nids), 2 * (len(pts) + num_of_new_points))
+        for name in ("route_nids", "route_lngs", "route_lats", "route_cum_t", "route_cum_d"):
+            old_pool = getattr(self, name)
+            new_pool = np.zeros(pool_size_of_route_points, dtype=old_pool.dtype)
+            new_pool[:len(pts)] = old_pool[pts]
+            setattr(self, name, new_pool)
+        pool_size_of_legs = max(len(self.leg_rids), 2 * (len(legs) + num_of_new_legs))
+        for name in ("leg_rids", "leg_pods", "leg_end_pts"):
+            old_pool = getattr(self, name)
+            new_pool = np.zeros(pool_size_of_legs, dtype=old_pool.dtype)
+            new_pool[:len(legs)] = old_pool[legs]
+            setattr(self, name, new_pool)
+        self.leg_end_pts[:len(legs)] += np.repeat(pt_shifts, leg_lens)
+
+        self.route_cursor[:] = 0
+        self.route_end[:] = 0
+        self.leg_head[:] = 0
+        self.leg_tail[:] = 0
+        self.route_cursor[vids] = new_pt_starts
+        self.route_end[vids] = new_pt_starts + pt_lens
+        self.leg_head[vids] = new_leg_starts
+        self.leg_tail[vids] = new_leg_starts + leg_lens
+        self.num_of_route_points = len(pts)
+        self.num_of_legs = len(legs)
+
+    # update the vehicles' locations as well as their routes after moving to time T,
+    # return the finished tasks [(vid, rid, pod, time_of_arrival)] (in the order they are finished by each vehicle)
+    def move_to_time(self, system_time_sec: int, update_vehicle_statistics: bool) -> list[(int, int, int, float)]:
+        for vid in self.vids_with_new_picked_or_dropped_rids:
+            self.vehs[vid].new_picked_rids.clear()
+            self.vehs[vid].new_dropped_rids.clear()
+        self.vids_with_new_picked_or_dropped_rids = []
+
+        dT = system_time_sec - self.state_time
+        vids = np.flatnonzero((dT > 0) & (self.leg_head < self.leg_tail))
+        state_time = self.state_time[vids]
+        self.state_time[dT > 0] = system_time_sec
+        if len(vids) == 0:
+            return []
+        num_of_moving_vehs = len(vids)
+        t0 = self.route_t_traveled[vids]
+        d0 = self.route_d_traveled[vids]
+        t_target = t0 + dT[vids]
+
+        # 1. Find the legs that the vehicles can finish by then.
+        #    (The legs of vids[i] are legs[leg_first[i]: leg_first[i] + num_of_legs[i]].)
+        num_of_legs = self.leg_tail[vids] - self.leg_head[vids]
+        leg_first = np.cumsum(num_of_legs) - num_of_legs
+        legs = concatenate_index_ranges(self.leg_head[vids], self.leg_tail[vids])
+        leg_owners = np.repeat(np.arange(num_of_moving_vehs), num_of_legs)
+        leg_end_pts = self.leg_end_pts[legs]
+        leg_end_t = self.route_cum_t[leg_end_pts]
+        leg_end_d = self.route_cum_d[leg_end_pts]
+        leg_pods = self.leg_pods[legs]
+        is_finished = leg_end_t < t_target[leg_owners]
+        num_of_finished_legs = np.bincount(leg_owners, weights=is_finished,
+                                           minlength=num_of_moving_vehs).astype(np.int64)
+        is_done = num_of_finished_legs == num_of_legs
+
+        # 2. Find where the vehicles stop, either at the end of the route or on an edge of the first unfinished leg.
+        end_t = np.empty(num_of_moving_vehs)
+        end_d = np.empty(num_of_moving_vehs)
+        done = np.flatnonzero(is_done)
+        last_pts = leg_end_pts[leg_first[done] + num_of_legs[done] - 1]
+        end_t[done] = self.route_cum_t[last_pts]
+        end_d[done] = self.route_cum_d[last_pts]
+        stopped = np.flatnonzero(~is_done)
+        stop_leg_end_pts = leg_end_pts[leg_first[stopped] + num_of_finished_legs[stopped]]
+        # (idx is the first point that cannot be reached by then, the same as a searchsorted on the route's cum_t.)
+        search_starts = self.route_cursor[vids[stopped]] + 1
+        pts = concatenate_index_ranges(search_starts, stop_leg_end_pts + 1)
+        pt_owners = np.repeat(np.arange(len(stopped)), stop_leg_end_pts + 1 - search_starts)
+        num_of_passed_pts = np.bincount(pt_owners, weights=self.route_cum_t[pts] < t_target[stopped][pt_owners],
+                                        minlength=len(stopped)).astype(np.int64)
+        idx = np.minimum(search_starts + num_of_passed_pts, stop_leg_end_pts)
+        edge_t = self.route_cum_t[idx] - self.route_cum_t[idx - 1]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            pct = np.where(edge_t > 0, np.minimum((t_target[stopped] - self.route_cum_t[idx - 1]) / edge_t, 1.0), 1.0)
+        end_t[stopped] = t_target[stopped]
+        end_d[stopped] = self.route_cum_d[idx - 1] + pct * (self.route_cum_d[idx] - self.route_cum_d[idx - 1])
+
+        # 3. Accumulate the statistics leg by leg, since the load changes at the end of each leg.
+        if update_vehicle_statistics:
+            prev_leg_end_t = np.empty(len(legs))
+            prev_leg_end_d = np.empty(len(legs))
+            prev_leg_end_t[1:] = leg_end_t[:-1]
+            prev_leg_end_d[1:] = leg_end_d[:-1]
+            prev_leg_end_t[leg_first] = t0
+            prev_leg_end_d[leg_first] = d0
+            leg_t = np.maximum(np.minimum(leg_end_t, end_t[leg_owners]) - prev_leg_end_t, 0.0)
+            leg_d = np.maximum(np.minimum(leg_end_d, end_d[leg_owners]) - prev_leg_end_d, 0.0)
+            exclusive_cum_pods = np.cumsum(leg_pods) - leg_pods
+            leg_loads = self.load[vids][leg_owners] + exclusive_cum_pods - exclusive_cum_pods[leg_first][leg_owners]
+            leg_status = self.status[vids][leg_owners]
+            is_empty = (leg_status == VehicleStatus.WORKING.value) & (leg_loads == 0)
+            is_rebalancing = leg_status == VehicleStatus.REBALANCING.value
+            for name, weights in (("Ts", leg_t), ("Ds", leg_d), ("Lt", leg_t * leg_loads), ("Ld", leg_d * leg_loads),
+                                  ("Ts_empty", leg_t * is_empty), ("Ds_empty", leg_d * is_empty),
+                                  ("Tr", leg_t * is_rebalancing), ("Dr", leg_d * is_rebalancing)):
+                getattr(self, name)[vids] += np.bincount(leg_owners, weights=weights, minlength=num_of_moving_vehs)
+
+        # 4. Update the vehicles' locations and routes.
+        self.load[vids] += np.bincount(leg_owners, weights=leg_pods * is_finished,
+                                       minlength=num_of_moving_vehs).astype(np.int64)
+        self.leg_head[vids] += num_of_finished_legs
+        self.route_t_traveled[vids] = end_t
+        self.route_d_traveled[vids] = end_d
+
+        stopped_vids = vids[stopped]
+        self.route_cursor[stopped_vids] = idx - 1
+        self.nid[stopped_vids] = self.route_nids[idx]
+        self.lng[stopped_vids] = self.route_lngs[idx - 1] + pct * (self.route_lngs[idx] - self.route_lngs[idx - 1])
+        self.lat[stopped_vids] = self.route_lats[idx - 1] + pct * (self.route_lats[idx] - self.route_lats[idx - 1])
+        self.t_to_nid[stopped_vids] = self.route_cum_t[idx] - end_t[stopped]
+        self.d_to_nid[stopped_vids] = self.route_cum_d[idx] - end_d[stopped]
+
+        done_vids = vids[done]
+        self.route_cursor[done_vids] = last_pts
+        self.nid[done_vids] = self.route_nids[last_pts]
+        self.lng[done_vids], self.lat[done_vids] = get_node_geos(self.nid[done_vids])
+        self.t_to_nid[done_vids] = 0.0
+        self.d_to_nid[done_vids] = 0.0
+        self.status[done_vids] = VehicleStatus.IDLE.value
+
+        # 5. Update the vehicles' schedules with the finished tasks.
+        finished = np.flatnonzero(is_finished & (self.leg_rids[legs] != -2))
+        finished_owners = leg_owners[finished]
+        finished_times = state_time[finished_owners] + (leg_end_t[finished] - t0[finished_owners])
+        done_tasks = []
+        for vid, rid, pod, time_of_arrival in zip(vids[finished_owners].tolist(), self.leg_rids[legs[finished]].tolist(),
+                                                  leg_pods[finished].tolist(), finished_times.tolist()):
+            veh = self.vehs[vid]
+            done_tasks.append((vid, rid, pod, time_of_arrival))
+            finished_sche_step = veh.sche[0]
+            veh.sche = veh.sche[1:]
+            assert finished_sche_step[0] == rid
+            if pod == 1:
+                veh.picking_rids.remove(rid)
+                veh.new_picked_rids.append(rid)
+                veh.onboard_rids.append(rid)
+            elif pod == -1:
+                veh.new_dropped_rids.append(rid)
+                veh.onboard_rids.remove(rid)
+            if len(self.vids_with_new_picked_or_dropped_rids) == 0 \
+                    or self.vids_with_new_picked_or_dropped_rids[-1] != vid:
+                self.vids_with_new_picked_or_dropped_rids.append(vid)
+        for vid in self.vids_with_new_picked_or_dropped_rids:
+            assert self.load[vid] == len(self.vehs[vid].onboard_rids)
 
+        # The vehicles in done_vids have finished their whole schedules.
+        for vid in done_vids.tolist():
+            assert len(self.vehs[vid].sche) == 0
+            assert self.load[vid] == len(self.vehs[vid].onboard_rids) == len(self.vehs[vid].picking_rids) == 0
+        return done_tasks
@@ -3,7 +3,6 @@ animation functions are found here
 """
 
 import time
-import numpy as np
 import matplotlib.pyplot as plt
 import matplotlib.image as mpimg
 from matplotlib import animation
@@ -21,13 +20,7 @@ def anim(frames_vehs):
     def init():
         for i in range(len(vehs)):
             vehs[i].set_data([frames_vehs[0][i].lng], [frames_vehs[0][i].lat])
-            r1x = []
-            r1y = []
-            for leg in frames_vehs[0][i].route:
-                for step in leg.steps:
-                    geo = np.transpose(step.geo)
-                    r1x.extend(geo[0])
-                    r1y.extend(geo[1])
+            r1x, r1y = frames_vehs[0][i].get_remaining_route_geos()
             if i % veh_showing_route_step == 0:
                 routes1[i].set_data(r1x, r1y)
         return vehs, routes1
@@ -35,13 +28,7 @@ def anim(frames_vehs):
     def animate(n):
         for i in range(len(vehs)):
             vehs[i].set_data([frames_vehs[n][i].lng], [frames_vehs[n][i].lat])
-            r1x = []
-            r1y = []
-            for leg in frames_vehs[n][i].route:
-                for step in leg.steps:
-                    geo = np.transpose(step.geo)
-                    r1x.extend(geo[0])
-                    r1y.extend(geo[1])
+            r1x, r1y = frames_vehs[n][i].get_remaining_route_geos()
             if i % veh_showing_route_step == 0:
                 routes1[i].set_data(r1x, r1y)
         return vehs, routes1
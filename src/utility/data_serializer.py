@@ -1,23 +1,24 @@
 
 import pandas as pd
+import multiprocessing
 import sys
 import os
 ROOT_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), "../.."))
 sys.path.append(ROOT_PATH)
 from src.utility.utility_functions import *
+from src.simulator.request import convert_raw_requests_to_records
 
 
 def load_network_node_from_csv_file_and_save_it_to_pickle_file(path_to_csv: str):
     all_nodes = []
     nodes_csv = pd.read_csv(path_to_csv)
-    num_of_nodes = nodes_csv.shape[0]
     print(f"[INFO] num_of_nodes {nodes_csv.shape}")
     print(nodes_csv.head(2))
-    for idx in range(num_of_nodes):
+    for node_id, lng, lat in zip(nodes_csv["id"].tolist(), nodes_csv["lng"].tolist(), nodes_csv["lat"].tolist()):
         node = Pos()
-        node.node_id = int(nodes_csv.iloc[idx]["id"])
-        node.lng = nodes_csv.iloc[idx]["lng"]
-        node.lat = nodes_csv.iloc[idx]["lat"]
+        node.node_id = int(node_id)
+        node.lng = lng
+        node.lat = lat
         all_nodes.append(node)
     path_to_pickle = path_to_csv.replace(".csv", ".pickle")
     with open(path_to_pickle, 'wb') as f:
@@ -31,40 +32,134 @@ def load_path_table_from_csv_file_and_save_it_to_pickle(path_to_csv: str):
         pickle.dump(path_table_csv, f)
 
 
-def load_request_data_from_csv_file_and_save_it_to_pickle_file(path_to_csv: str):
+def load_table_from_csv_or_pickle_file(path_to_table: str) -> np.ndarray:
+    if path_to_table.endswith(".csv"):
+        return pd.read_csv(path_to_table, index_col=0).values
+    with open(path_to_table, "rb") as f:
+        return np.asarray(pickle.load(f))
+
+
+# write the mean travel time table, the travel distance table and the shortest path table into one binary file,
+# which is opened by route_functions.py as memory maps (float32 for durations and distances, int16/int32 for paths)
+def save_map_tables_to_binary_file(path_to_mean_table: str, path_to_dist_table: str, path_to_path_table: str,
+                                   path_to_binary: str):
+    t = timer_start()
+    mean_table = load_table_from_csv_or_pickle_file(path_to_mean_table).astype("<f4")
+    dist_table = load_table_from_csv_or_pickle_file(path_to_dist_table).astype("<f4")
+    path_table = load_table_from_csv_or_pickle_file(path_to_path_table)
+    num_of_nodes = mean_table.shape[0]
+    assert (mean_table.shape == dist_table.shape == path_table.shape == (num_of_nodes, num_of_nodes))
+    if np.iinfo(np.int16).min <= path_table.min() and path_table.max() <= np.iinfo(np.int16).max:
+        path_table = path_table.astype("<i2")
+    else:
+        path_table = path_table.astype("<i4")
+    print(f"[INFO] num_of_nodes {num_of_nodes}, path_table_dtype {path_table.dtype}")
+
+    header = np.zeros(1, dtype=MAP_TABLES_HEADER_DTYPE)
+    header["magic"] = MAP_TABLES_FILE_MAGIC
+    header["version"] = MAP_TABLES_FILE_VERSION
+    header["num_of_nodes"] = num_of_nodes
+    header["path_table_dtype"] = path_table.dtype.str.encode()
+    header["mean_table_offset"] = MAP_TABLES_HEADER_SIZE
+    header["dist_table_offset"] = header["mean_table_offset"] + mean_table.nbytes
+    header["path_table_offset"] = header["dist_table_offset"] + dist_table.nbytes
+    with open(path_to_binary, "wb") as f:
+        f.write(header.tobytes().ljust(MAP_TABLES_HEADER_SIZE, b"\0"))
+        mean_table.tofile(f)
+        dist_table.tofile(f)
+        path_table.tofile(f)
+    print(f"[INFO] Map tables are saved to {path_to_binary}. ({timer_end(t)})")
+
+
+# read the requests of a day from a csv file (columns "ptime", "onid" and "dnid") into an array of request records,
+# where the request times are parsed and converted to seconds from 0 clock as whole columns, and return the records
+# with the request time strings ("ptime"), so that the file is only parsed once for both the pickle and binary files
+def load_request_data_from_csv_file(path_to_csv: str) -> (np.ndarray, list[str]):
+    requests_csv = pd.read_csv(path_to_csv, usecols=["ptime", "onid", "dnid"])
+    request_times = pd.to_datetime(requests_csv["ptime"])
+    records = np.zeros(len(requests_csv), dtype=REQUEST_DATA_RECORD_DTYPE)
+    records["request_time_sec"] = (request_times.dt.hour.to_numpy() * 3600 + request_times.dt.minute.to_numpy() * 60
+                                   + request_times.dt.second.to_numpy())
+    records["origin_node_id"] = requests_csv["onid"].to_numpy()
+    records["destination_node_id"] = requests_csv["dnid"].to_numpy()
+    return records, requests_csv["ptime"].tolist()
+
+
+def load_request_data_from_csv_or_pickle_file(path_to_requests: str) -> np.ndarray:
+    if path_to_requests.endswith(".csv"):
+        return load_request_data_from_csv_file(path_to_requests)[0]
+    with open(path_to_requests, "rb") as f:
+        return convert_raw_requests_to_records(pickle.load(f))
+
+
+def save_request_data_to_pickle_file(records: np.ndarray, request_time_dates: list[str], path_to_pickle: str):
+    print(f"[INFO] num_of_requests {len(records)}")
     all_requests = []
-    requests_csv = pd.read_csv(path_to_csv)
-    num_of_requests = requests_csv.shape[0]
-    print(f"[INFO] num_of_requests {requests_csv.shape}")
-    print(requests_csv.head(2))
-    for idx in tqdm(range(num_of_requests), "loading requests"):
+    for record, request_time_date in zip(records.tolist(), request_time_dates):
         request = RawRequest()
-        request.origin_node_id = int(requests_csv.iloc[idx]["onid"])
-        request.destination_node_id = int(requests_csv.iloc[idx]["dnid"])
-        request.request_time_date = requests_csv.iloc[idx]["ptime"]
-        request.request_time_sec = compute_the_accumulated_seconds_from_0_clock(request.request_time_date)
+        request.request_time_sec, request.origin_node_id, request.destination_node_id = record
+        request.request_time_date = request_time_date
         all_requests.append(request)
-    path_to_pickle = path_to_csv.replace(".csv", ".pickle")
     with open(path_to_pickle, 'wb') as f:
         pickle.dump(all_requests, f)
 
 
-if __name__ == '__main__':
-    vehicle_stations = f"{ROOT_PATH}/datalog-gitignore/map-data/stations-101.csv"
-    network_nodes = f"{ROOT_PATH}/datalog-gitignore/map-data/nodes.csv"
-    mean_table = f"{ROOT_PATH}/datalog-gitignore/map-data/mean-table.csv"
-    dist_table = f"{ROOT_PATH}/datalog-gitignore/map-data/dist-table.csv"
-    path_table = f"{ROOT_PATH}/datalog-gitignore/map-data/path-table.csv"
+def load_request_data_from_csv_file_and_save_it_to_pickle_file(path_to_csv: str):
+    records, request_time_dates = load_request_data_from_csv_file(path_to_csv)
+    save_request_data_to_pickle_file(records, request_time_dates, path_to_csv.replace(".csv", ".pickle"))
+
+
+# write the request records of a day (e.g. given by "load_request_data_from_csv_or_pickle_file") into a binary file of
+# records sorted by request time, which is opened by request.py as a memory map and replayed epoch by epoch
+def save_request_data_to_binary_file(records: np.ndarray, path_to_binary: str):
+    t = timer_start()
+    records = records[np.argsort(records["request_time_sec"], kind="stable")]
+    print(f"[INFO] num_of_requests {len(records)}")
+
+    header = np.zeros(1, dtype=REQUEST_DATA_HEADER_DTYPE)
+    header["magic"] = REQUEST_DATA_FILE_MAGIC
+    header["version"] = REQUEST_DATA_FILE_VERSION
+    header["num_of_reqs"] = len(records)
+    header["records_offset"] = REQUEST_DATA_HEADER_SIZE
+    with open(path_to_binary, "wb") as f:
+        f.write(header.tobytes().ljust(REQUEST_DATA_HEADER_SIZE, b"\0"))
+        records.tofile(f)
+    print(f"[INFO] Request data are saved to {path_to_binary}. ({timer_end(t)})")
+
+
+# convert a day of taxi data from csv into the pickle file and the binary file, parsing the csv file once
+def convert_taxi_data_file(path_to_csv: str):
+    records, request_time_dates = load_request_data_from_csv_file(path_to_csv)
+    save_request_data_to_pickle_file(records, request_time_dates, path_to_csv.replace(".csv", ".pickle"))
+    save_request_data_to_binary_file(records, path_to_csv.replace(".csv", ".bin"))
 
-    # for node_file in [vehicle_stations, network_nodes]:
-    #     load_network_node_from_csv_file_and_save_it_to_pickle_file(node_file)
 
-    # for table_file in [mean_table, dist_table, path_table]:
-    #     load_path_table_from_csv_file_and_save_it_to_pickle(table_file)
+# convert all csv data files in one go: the node files, the three map tables (into pickle files and the binary
+# map tables file) and the taxi data of the given days, where the tables and the days are processed in parallel
+def convert_all_data_files(taxi_data_files: list[str], num_of_processes: int = os.cpu_count()):
+    t = timer_start()
+    map_data = f"{ROOT_PATH}/datalog-gitignore/map-data"
+    taxi_data = f"{ROOT_PATH}/datalog-gitignore/taxi-data"
+    table_files = [f"{map_data}/mean-table.csv", f"{map_data}/dist-table.csv", f"{map_data}/path-table.csv"]
 
-    # for day in ["03", "04", "05", "10", "11", "12", "17", "19", "24", "25", "26"]:
-    #     taxi_data = f"{ROOT_PATH}/datalog-gitignore/taxi-data/manhattan-taxi-201605{day}-peak.csv"
-    #     load_request_data_from_csv_file_and_save_it_to_pickle_file(taxi_data)
+    # 1. Convert the node files.
+    for node_file in [f"{map_data}/stations-101.csv", f"{map_data}/nodes.csv"]:
+        load_network_node_from_csv_file_and_save_it_to_pickle_file(node_file)
+
+    with multiprocessing.Pool(num_of_processes) as pool:
+        # 2. Convert the map tables. (The binary file is made from the pickle files, which load faster than csv.)
+        pool.map(load_path_table_from_csv_file_and_save_it_to_pickle, table_files)
+        save_map_tables_to_binary_file(*[table_file.replace(".csv", ".pickle") for table_file in table_files],
+                                       PATH_TO_MAP_TABLES)
+
+        # 3. Convert the taxi data, one day per process.
+        pool.map(convert_taxi_data_file, [f"{taxi_data}/manhattan-taxi-{file}.csv" for file in taxi_data_files])
+    print(f"[INFO] All data files are converted. ({timer_end(t)})")
+
+
+if __name__ == '__main__':
+    convert_all_data_files([f"201605{day}-peak" for day in
+                            ["03", "04", "05", "10", "11", "12", "17", "18", "19", "24", "25", "26"]])
 
-    taxi_data = f"{ROOT_PATH}/datalog-gitignore/taxi-data/manhattan-taxi-20160406.csv"
-    load_request_data_from_csv_file_and_save_it_to_pickle_file(taxi_data)
+    # taxi_data = f"{ROOT_PATH}/datalog-gitignore/taxi-data/manhattan-taxi-20160406.csv"
+    # convert_taxi_data_file(taxi_data)
@@ -37,7 +37,48 @@ def timer_end(t: datetime) -> str:
     return f"{runtime_sec:.3f}s"
 
 
+# (inf if there is no deadline)
+def get_time_left_sec_to_deadline(deadline: datetime) -> float:
+    if deadline is None:
+        return np.inf
+    return (deadline - datetime.now()).total_seconds()
+
+
 def verify_the_current_epoch_is_in_the_main_study_horizon(epoch_end_time_sec: int) -> bool:
     main_sim_start_time_sec = WARMUP_DURATION_MIN * 60
     main_sim_end_time_sec = main_sim_start_time_sec + SIMULATION_DURATION_MIN * 60
     return main_sim_start_time_sec < epoch_end_time_sec <= main_sim_end_time_sec
+
+
+# concatenate the index ranges [starts[i], ends[i]) into one array
+def concatenate_index_ranges(starts: np.ndarray, ends: np.ndarray) -> np.ndarray:
+    lens = ends - starts
+    total = int(lens.sum())
+    if total == 0:
+        return np.zeros(0, dtype=np.int64)
+    offsets = np.cumsum(lens) - lens
+    return np.arange(total, dtype=np.int64) + np.repeat(starts - offsets, lens)
+
+
+class ArrayAttribute(object):
+    """
+    ArrayAttribute is a descriptor for an attribute of an object that is a view of one index of a struct of arrays,
+    where the value is stored in the array of the same name in the struct
+    Attributes:
+        struct_attribute: name of the view's attribute referring to the struct (the index being the view's "id")
+        name: name of the attribute, as well as the array in the struct
+    """
+
+    def __init__(self, struct_attribute: str):
+        self.struct_attribute = struct_attribute
+
+    def __set_name__(self, owner, name: str):
+        self.name = name
+
+    def __get__(self, view, owner=None):
+        if view is None:
+            return self
+        return getattr(getattr(view, self.struct_attribute), self.name)[view.id].item()
+
+    def __set__(self, view, value):
+        getattr(getattr(view, self.struct_attribute), self.name)[view.id] = value
@@ -159,7 +159,7 @@ def store_vehs_current_state_and_post_decision_state_as_an_experience(num_of_new
     return new_experience
 
 
-def compute_current_sche_state_of_a_veh(veh_nid: int, veh_t_to_nid: float, sche: list[(int, int, int, float)],
+def compute_current_sche_state_of_a_veh(veh_nid: int, veh_t_to_nid: float, sche: tuple[(int, int, int, float), ...],
                                         system_time_sec: int) -> [list[int], list[float], int]:
     extra_length_for_long_sche = 6
     # A 2-seat vehicle might serve 3 orders in one trip.
@@ -254,7 +254,7 @@ def compute_post_decision_state_for_vt_pairs(veh_trip_pairs: list, vehs: list[Ve
 
 # Compute the next schedule state of a vehicle, by updating its position and assigned schedule to the next epoch.
 def compute_next_sche_state_of_a_veh(veh_nid: int, veh_t_to_nid: float,
-                                     assigned_sche: list[(int, int, int, float)],
+                                     assigned_sche: tuple[(int, int, int, float), ...],
                                      system_time_sec: int) -> [list[int], list[float], int]:
 
     updated_veh_nid, updated_veh_t_to_nid, updated_assigned_sche = \
@@ -273,7 +273,7 @@ def compute_next_sche_state_of_a_veh(veh_nid: int, veh_t_to_nid: float,
 # Compute the vehicle's location (and update the given schedule) at the next epoch,
 # if the vehicle is following the given schedule.
 def update_veh_pos_and_sche_to_next_epoch(veh_nid: int, veh_t_to_nid: float,
-                                          sche: list[(int, int, int, float)]) -> (int, float, list):
+                                          sche: tuple[(int, int, int, float), ...]) -> (int, float, list):
     updated_veh_nid = veh_nid
     updated_veh_t_to_nid = 0.0
     sche_start_idx_at_next_epoch = 0
@@ -288,14 +288,11 @@ def update_veh_pos_and_sche_to_next_epoch(veh_nid: int, veh_t_to_nid: float,
                 updated_veh_nid = tnid
                 sche_start_idx_at_next_epoch += 1
             else:
-                leg_duration_sec, leg_distance_m, leg_segments = build_route_from_origin_to_dest(updated_veh_nid, tnid)
-                for [t, d, nid_pair, geo_pair] in leg_segments:
-                    assert (updated_veh_nid == nid_pair[0])
-                    updated_veh_nid = nid_pair[1]
-                    dT -= t
-                    if dT <= 0:
-                        updated_veh_t_to_nid = -dT
-                        break
+                # The vehicle stops on the edge ending at the first node it cannot pass by then.
+                path = get_path_from_origin_to_dest(updated_veh_nid, tnid)
+                idx = min(int(np.searchsorted(path.cum_t, dT, side="left")), len(path.nids) - 1)
+                updated_veh_nid = int(path.nids[idx])
+                updated_veh_t_to_nid = max(float(path.cum_t[idx]) - dT, 0.0)
                 break
     updated_sche = sche[sche_start_idx_at_next_epoch:]
 
@@ -0,0 +1,158 @@
+"""
+differential test of fast_compute in OSP: the trip tables carried forward from the last epoch must give the same
+candidate vehicle-trip pairs as the full search from scratch, run on a small synthetic grid network
+"""
+
+import os
+import sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import numpy as np
+import scipy.sparse
+import scipy.sparse.csgraph
+import src.dispatcher.dispatch_osp as dispatch_osp
+from src.dispatcher.candidate_table import CandidateTable
+from src.dispatcher.dispatch_osp import compute_candidate_veh_trip_pairs
+from src.dispatcher.fast_assign import greedy_assignment
+from src.dispatcher.scheduling import score_vt_pairs_with_num_of_orders_and_sche_cost, \
+    upd_schedule_for_vehicles_in_selected_vt_pairs
+from src.simulator.config import CYCLE_S, FLEET_SIZE, VEH_CAPACITY
+from src.simulator.request import ReqRegistry
+from src.simulator.route_functions import RoadNetwork, get_road_network, set_road_network
+from src.simulator.types import OrderStatus, Pos, VehicleStatus
+from src.simulator.vehicle import Fleet, Veh
+
+GRID_SIZE = 8
+NUM_OF_VEHS = 10
+VEH_CAPACITY_OF_TEST = 3
+NUM_OF_REQS_PER_EPOCH = 4
+NUM_OF_EPOCHS = 12
+
+
+# Build a grid network of random travel times, of which the tables are set directly (rather than loaded from files).
+def build_grid_road_network(rng: np.random.Generator) -> RoadNetwork:
+    num_of_nodes = GRID_SIZE * GRID_SIZE
+    network_nodes = []
+    for idx in range(num_of_nodes):
+        pos = Pos()
+        pos.node_id = idx + 1
+        pos.lng = -74.0 + (idx % GRID_SIZE) * 0.004
+        pos.lat = 40.7 + (idx // GRID_SIZE) * 0.006
+        network_nodes.append(pos)
+
+    # 1. Get the edges between the neighbouring nodes.
+    origins, dests = [], []
+    for idx in range(num_of_nodes):
+        x, y = idx % GRID_SIZE, idx // GRID_SIZE
+        for dx, dy in ((1, 0), (-1, 0), (0, 1), (0, -1)):
+            if 0 <= x + dx < GRID_SIZE and 0 <= y + dy < GRID_SIZE:
+                origins.append(idx)
+                dests.append((y + dy) * GRID_SIZE + x + dx)
+    edge_times = np.round(rng.uniform(20, 60, len(origins)), 2)
+    edge_graph = scipy.sparse.csr_matrix((edge_times, (origins, dests)), shape=(num_of_nodes, num_of_nodes))
+
+    # 2. Compute the shortest paths, and accumulate the travel times and distances along them.
+    shortest_times, predecessors = scipy.sparse.csgraph.shortest_path(edge_graph, return_predecessors=True)
+    mean_table = np.zeros((num_of_nodes, num_of_nodes))
+    dist_table = np.zeros((num_of_nodes, num_of_nodes))
+    for o in range(num_of_nodes):
+        for d in np.argsort(shortest_times[o]).tolist():
+            if d == o:
+                continue
+            p = predecessors[o, d]
+            mean_table[o, d] = mean_table[o, p] + edge_graph[p, d]
+            dist_table[o, d] = dist_table[o, p] + edge_graph[p, d] * 8.0
+    path_table = np.where(predecessors < 0, -1, predecessors + 1).astype(np.int64)
+
+    road_network = RoadNetwork()
+    road_network.network_nodes = network_nodes
+    road_network.vehicle_stations = network_nodes[::5]
+    road_network.map_tables = (mean_table, dist_table, path_table)
+    return road_network
+
+
+# Compute the candidate pairs with fast_compute, and again by the full search from scratch (which leaves the trip
+# tables of fast_compute for the next epoch). The search budget is lifted, so that all trip tables are complete.
+def compute_candidate_veh_trip_pairs_fast_and_fully(new_received_rids: list[int], considered_rids: list[int],
+                                                    reqs: ReqRegistry, vehs: list[Veh], system_time_sec: int) \
+        -> (CandidateTable, CandidateTable):
+    budget = np.iinfo(np.int64).max
+    fast_computed_pairs = compute_candidate_veh_trip_pairs(new_received_rids, considered_rids, reqs, vehs,
+                                                           system_time_sec, budget, True, True)
+    fast_computed_tables = (dispatch_osp.FEASIBLE_TRIP_TABLE, dispatch_osp.FEASIBLE_TRIP_TABLE_IS_COMPLETE)
+    fully_computed_pairs = compute_candidate_veh_trip_pairs(new_received_rids, considered_rids, reqs, vehs,
+                                                            system_time_sec, budget, True, False)
+    (dispatch_osp.FEASIBLE_TRIP_TABLE, dispatch_osp.FEASIBLE_TRIP_TABLE_IS_COMPLETE) = fast_computed_tables
+    return fast_computed_pairs, fully_computed_pairs
+
+
+# (Each pair is keyed by its vehicle and the sorted ids of its trip, with its cost.)
+def get_sorted_pair_keys(veh_trip_pairs: CandidateTable) -> list[(int, tuple[int, ...], float)]:
+    return sorted((int(veh_trip_pairs.veh_ids[idx]), tuple(sorted(veh_trip_pairs.get_trip_rids(idx))),
+                   round(float(veh_trip_pairs.costs[idx]), 6)) for idx in range(len(veh_trip_pairs)))
+
+
+def test_fast_compute_finds_the_same_candidate_pairs_as_full_search(monkeypatch):
+    # (The full search takes all trips of the vehicles without the budget, so the capacity is kept small.)
+    monkeypatch.setattr(dispatch_osp, "DISPATCH_NUM_OF_WORKERS", 1)
+    rng = np.random.default_rng(0)
+    road_network = build_grid_road_network(rng)
+    previous_road_network = get_road_network()
+    previous_veh_capacity = VEH_CAPACITY[0]
+    set_road_network(road_network)
+    VEH_CAPACITY[0] = VEH_CAPACITY_OF_TEST
+    try:
+        num_of_nodes = GRID_SIZE * GRID_SIZE
+        system_time_sec = 0
+        fleet = Fleet(rng.integers(1, num_of_nodes + 1, NUM_OF_VEHS).tolist(), VEH_CAPACITY[0], system_time_sec)
+        vehs = fleet.vehs
+        reqs = ReqRegistry()
+        dispatch_osp.FEASIBLE_TRIP_TABLE_IS_COMPLETE = [False] * FLEET_SIZE[0]
+        num_of_fast_computed_vehs = 0
+
+        for epoch in range(NUM_OF_EPOCHS):
+            # 1. Move the vehicles to the end of the epoch, and update the orders' statuses (as in Platform).
+            system_time_sec += CYCLE_S[0]
+            for (vid, rid, pod, time_of_arrival) in fleet.move_to_time(system_time_sec, True):
+                if pod == 1:
+                    reqs[rid].update_pick_info(time_of_arrival)
+                elif pod == -1:
+                    reqs[rid].update_drop_info(time_of_arrival)
+            for rid in reqs.get_pending_rids_past_walkaway_time(system_time_sec):
+                reqs[rid].status = OrderStatus.WALKAWAY
+
+            # 2. Generate the new requests.
+            onids = rng.integers(1, num_of_nodes + 1, NUM_OF_REQS_PER_EPOCH)
+            dnids = (onids + rng.integers(1, num_of_nodes, NUM_OF_REQS_PER_EPOCH) - 1) % num_of_nodes + 1
+            Trs = np.sort(rng.integers(system_time_sec - CYCLE_S[0], system_time_sec, NUM_OF_REQS_PER_EPOCH))
+            new_received_rids = reqs.add_reqs(Trs, onids, dnids)
+
+            # 3. Compare the candidate pairs of fast_compute with those of the full search.
+            for veh in vehs:
+                veh.sche_has_been_updated_at_current_epoch = False
+            considered_rids = reqs.get_rids_of_status(OrderStatus.PICKING, OrderStatus.PENDING)
+            num_of_fast_computed_vehs += sum(dispatch_osp.FEASIBLE_TRIP_TABLE_IS_COMPLETE[veh.id]
+                                             and veh.status != VehicleStatus.REBALANCING for veh in vehs)
+            fast_computed_pairs, fully_computed_pairs = \
+                compute_candidate_veh_trip_pairs_fast_and_fully(new_received_rids, considered_rids, reqs, vehs,
+                                                                system_time_sec)
+            assert get_sorted_pair_keys(fast_computed_pairs) == get_sorted_pair_keys(fully_computed_pairs), \
+                f"fast_compute differs from the full search at epoch {epoch}"
+
+            # 4. Assign the orders greedily, which moves the states on to the next epoch.
+            score_vt_pairs_with_num_of_orders_and_sche_cost(fast_computed_pairs, reqs, system_time_sec)
+            selected_veh_trip_pair_indices = greedy_assignment(fast_computed_pairs)
+            for rid in considered_rids:
+                reqs[rid].status = OrderStatus.PENDING
+            upd_schedule_for_vehicles_in_selected_vt_pairs(fast_computed_pairs, selected_veh_trip_pair_indices)
+
+        # (The test is only meaningful if the trip tables have been carried forward.)
+        assert num_of_fast_computed_vehs > 0
+    finally:
+        set_road_network(previous_road_network)
+        VEH_CAPACITY[0] = previous_veh_capacity
+
+
+if __name__ == "__main__":
+    import pytest
+    sys.exit(pytest.main([__file__, "-q"]))